@@ -6,11 +6,32 @@ import sys
 import hashlib
 import argparse
 import sqlite3
-import gc
+import mmap
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from datetime import datetime
 from PIL import Image
 import logging
 
+# NumPy为可选依赖，用于向量化计算感知哈希
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Numba为可选依赖，用于将感知哈希内核编译为本地代码
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# BLAKE3为可选依赖，比SHA-256更快（SIMD加速）
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -22,9 +43,128 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 支持的图片扩展名，模块级别定义避免每次调用重复创建
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'})
+
+# 需要跳过的系统目录（群晖缩略图、回收站等）
+SKIP_DIRS = frozenset({'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail'})
+
+# 哈希算法名称，写入哈希缓存以免不同算法的结果混用
+FILE_HASH_ALGORITHM = 'blake3' if blake3 is not None else 'sha256'
+CONTENT_HASH_ALGORITHM = 'ahash8'
+HASH_ALGORITHM = f"{FILE_HASH_ALGORITHM}+{CONTENT_HASH_ALGORITHM}"
+
+if njit is not None and np is not None:
+    @njit(cache=True)
+    def _ahash_kernel(pixels):
+        """计算平均值并逐位打包为64位整数，一次遍历完成比较和打包"""
+        total = 0
+        for value in pixels:
+            total += value
+        avg_pixel = total / pixels.size
+        one = np.uint64(1)
+        bits = np.uint64(0)
+        for value in pixels:
+            bits = bits << one
+            if value >= avg_pixel:
+                bits = bits | one
+        return bits
+else:
+    _ahash_kernel = None
+
+# 哈希计算函数定义在模块级别，以便在子进程中并行执行
+def new_file_hasher(data=b''):
+    """
+    创建文件哈希对象：优先使用BLAKE3，否则使用SHA-256（OpenSSL支持SHA-NI加速）
+    """
+    if blake3 is not None:
+        return blake3(data)
+    return hashlib.sha256(data)
+
+def calculate_image_content_hash(image_path, fp=None):
+    """
+    计算图片的内容哈希值（感知哈希）
+    fp 可传入已打开的文件对象（如mmap），避免重复读取文件
+    """
+    try:
+        with Image.open(fp if fp is not None else image_path) as img:
+            # JPEG不使用draft()按DCT比例缩小解码：缩小解码的结果与PNG等格式完整解码后缩放的结果略有差异，
+            # 会使同一图片不同格式的内容哈希不一致
+            # 转换为小缩略图并转为灰度（8x8下BILINEAR与LANCZOS效果相当且更快）
+            img = img.resize((8, 8), Image.Resampling.BILINEAR).convert('L')
+            if _ahash_kernel is not None:
+                # JIT编译的内核，避免NumPy生成中间数组（首次调用的编译结果会缓存到磁盘）
+                return '%016x' % int(_ahash_kernel(np.frombuffer(img.tobytes(), dtype=np.uint8)))
+            if np is not None:
+                # 向量化计算：与平均值比较后直接打包为64位
+                arr = np.frombuffer(img.tobytes(), dtype=np.uint8)
+                return np.packbits(arr >= arr.mean()).tobytes().hex()
+            # 计算像素平均值
+            pixels = img.tobytes()
+            avg_pixel = sum(pixels) / len(pixels)
+            # 基于平均值直接按位累加，避免构造字符串再按二进制解析
+            bits = 0
+            for pixel in pixels:
+                bits = (bits << 1) | (pixel >= avg_pixel)
+            return '%016x' % bits
+    except Exception as e:
+        logger.debug(f"无法计算图片内容哈希: {image_path}, 错误: {e}")
+        return None
+
+def calculate_image_hash(image_path, use_content_hash=True):
+    """
+    计算图片的哈希值（文件哈希 + 内容哈希）
+    通过mmap只读取一次文件，文件哈希和内容哈希共用同一块映射内存
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            # 空文件无法映射，直接返回空内容的哈希
+            if os.fstat(f.fileno()).st_size == 0:
+                return new_file_hasher().hexdigest(), None
+            
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # 文件哈希
+                file_hash = new_file_hasher(mm).hexdigest()
+                
+                # 内容哈希
+                content_hash = None
+                if use_content_hash:
+                    content_hash = calculate_image_content_hash(image_path, mm)
+        
+        return file_hash, content_hash
+        
+    except Exception as e:
+        logger.error(f"计算图片哈希失败: {image_path}, 错误: {e}")
+        return None, None
+
 class ImageCleaner:
-    def __init__(self, db_path="image_cleaner.db"):
+    # 插入语句只定义一次，sqlite3会缓存已编译的语句供executemany复用
+    INSERT_SOURCE_SQL = '''
+        INSERT OR IGNORE INTO images 
+        (path, filename, size, file_hash, content_hash, is_source)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    INSERT_DELETED_SQL = '''
+        INSERT OR IGNORE INTO images 
+        (path, filename, size, file_hash, content_hash, is_source, deleted)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+    UPSERT_CACHE_SQL = '''
+        INSERT OR REPLACE INTO hash_cache 
+        (dev, ino, mtime, size, file_hash, content_hash, algorithm)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+    BATCH_SIZE = 5000
+    
+    def __init__(self, db_path="image_cleaner.db", workers=None, use_threads=False, transient=False):
         self.db_path = db_path
+        # 临时数据库在运行结束后会被删除，可以放弃持久性换取写入速度
+        self.transient = transient
+        self.use_threads = use_threads
+        # 线程模式下哈希和解码会释放GIL，线程数取CPU核心数的两倍以掩盖I/O等待
+        cpu_count = os.cpu_count() or 1
+        self.workers = workers or (cpu_count * 2 if use_threads else cpu_count)
+        self._last_progress_time = 0.0
         self.init_database()
         
     def init_database(self):
@@ -32,6 +172,21 @@ class ImageCleaner:
         self.conn = sqlite3.connect(self.db_path)
         cursor = self.conn.cursor()
         
+        # 优化SQLite设置，减少提交时的fsync开销
+        if self.transient:
+            # 临时数据库：日志放在内存且不做fsync，崩溃时数据库本来就会被丢弃
+            cursor.execute('PRAGMA journal_mode = MEMORY')
+            cursor.execute('PRAGMA synchronous = OFF')
+            cursor.execute('PRAGMA locking_mode = EXCLUSIVE')
+            cursor.execute('PRAGMA mmap_size = 268435456')
+        else:
+            # WAL模式下读操作不会被写事务阻塞
+            cursor.execute('PRAGMA journal_mode = WAL')
+            cursor.execute('PRAGMA synchronous = NORMAL')
+            cursor.execute('PRAGMA wal_autocheckpoint = 10000')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.execute('PRAGMA cache_size = -200000')
+        
         # 创建图片信息表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS images (
@@ -47,12 +202,31 @@ class ImageCleaner:
             )
         ''')
         
-        # 创建索引以提高查询性能
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_hash ON images(file_hash)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_content_hash ON images(content_hash)')
+        # 哈希缓存表：按(设备号, inode)记录修改时间、大小和哈希值
+        # 使用 --keep-db 保留数据库时可跨运行复用，跳过未变化文件的哈希计算
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS hash_cache (
+                dev INTEGER,
+                ino INTEGER,
+                mtime INTEGER,
+                size INTEGER,
+                file_hash TEXT,
+                content_hash TEXT,
+                algorithm TEXT,
+                PRIMARY KEY (dev, ino)
+            )
+        ''')
+        
+        self.conn.commit()
+        
+    def build_indexes(self):
+        """
+        在源目录批量写入完成后再创建索引，避免插入时逐行维护B树
+        哈希匹配已改为内存集合查找，因此不再需要哈希列的索引
+        """
+        cursor = self.conn.cursor()
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_filename ON images(filename)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_is_source ON images(is_source)')
-        
         self.conn.commit()
         
     def close_database(self):
@@ -66,82 +240,123 @@ class ImageCleaner:
         cursor.execute('DELETE FROM images')
         self.conn.commit()
         
-    def calculate_file_hash(self, file_path, chunk_size=8192):
+    def is_image_file(self, filename):
+        """判断文件是否为图片文件，仅依赖扩展名（损坏的图片在计算哈希时处理）"""
+        # 直接截取扩展名，只对扩展名部分转小写
+        dot = filename.rfind('.')
+        return dot >= 0 and filename[dot:].lower() in IMAGE_EXTENSIONS
+
+    def should_skip_directory(self, dir_name):
+        """判断是否应该跳过该目录（传入目录名而非完整路径）"""
+        return dir_name in SKIP_DIRS or dir_name.startswith('.')
+
+    def show_progress(self, label, processed, total):
         """
-        计算文件的MD5哈希值，使用流式读取减少内存使用
+        在同一行刷新进度（每秒最多一次），直接写stderr而不经过日志处理器
         """
-        try:
-            hash_md5 = hashlib.md5()
-            with open(file_path, 'rb') as f:
-                while chunk := f.read(chunk_size):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
-        except Exception as e:
-            logger.error(f"计算文件哈希失败: {file_path}, 错误: {e}")
-            return None
+        now = time.monotonic()
+        if processed < total and now - self._last_progress_time < 1.0:
+            return
+        self._last_progress_time = now
+        sys.stderr.write(f"\r{label}: {processed}/{total} ({processed/total*100:.1f}%)")
+        if processed == total:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+    def insert_batch(self, sql, batch_data):
+        """在单个事务中批量插入数据（数据库只在主线程中访问，工作线程/进程只计算哈希）"""
+        if batch_data:
+            with self.conn:
+                self.conn.executemany(sql, batch_data)
 
-    def calculate_image_content_hash(self, image_path):
+    def hash_files(self, paths, use_content_hash=True):
         """
-        计算图片的内容哈希值（感知哈希）
+        使用进程池（或线程池）并行计算图片哈希值，按输入顺序返回 (file_hash, content_hash)
         """
-        try:
-            with Image.open(image_path) as img:
-                # 转换为小缩略图并转为灰度
-                img = img.resize((8, 8), Image.Resampling.LANCZOS).convert('L')
-                # 计算像素平均值
-                pixels = list(img.getdata())
-                avg_pixel = sum(pixels) / len(pixels)
-                # 基于平均值生成位序列
-                bits = ''.join(['1' if pixel >= avg_pixel else '0' for pixel in pixels])
-                # 将位序列转换为十六进制字符串
-                content_hash = hex(int(bits, 2))[2:].zfill(16)
-                return content_hash
-        except Exception as e:
-            logger.debug(f"无法计算图片内容哈希: {image_path}, 错误: {e}")
-            return None
+        worker = partial(calculate_image_hash, use_content_hash=use_content_hash)
+        if self.workers <= 1 or len(paths) <= 1:
+            yield from map(worker, paths)
+            return
+        
+        if self.use_threads:
+            # 线程池没有进程启动和数据序列化的开销，适合I/O为瓶颈的场景
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                yield from executor.map(worker, paths)
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                yield from executor.map(worker, paths, chunksize=32)
 
-    def calculate_image_hash(self, image_path, use_content_hash=True):
+    def hash_images(self, image_files, use_content_hash=True):
         """
-        计算图片的哈希值（文件哈希 + 内容哈希）
+        计算图片哈希值，按输入顺序返回 (路径, 文件名, stat信息, file_hash, content_hash)
+        设备号、inode、修改时间和大小均未变化的文件直接使用缓存结果
         """
-        try:
-            # 文件哈希
-            file_hash = self.calculate_file_hash(image_path)
-            if file_hash is None:
-                return None, None
-                
-            # 内容哈希
-            content_hash = None
-            if use_content_hash:
-                content_hash = self.calculate_image_content_hash(image_path)
-                
-            return file_hash, content_hash
-            
-        except Exception as e:
-            logger.error(f"计算图片哈希失败: {image_path}, 错误: {e}")
-            return None, None
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT dev, ino, mtime, size, file_hash, content_hash FROM hash_cache 
+            WHERE algorithm = ?
+        ''', (HASH_ALGORITHM,))
+        cache = {(dev, ino, mtime, size): (file_hash, content_hash)
+                 for dev, ino, mtime, size, file_hash, content_hash in cursor}
+        
+        # 找出缓存未命中的文件（精确模式下缺少内容哈希的记录也需要重新计算）
+        results = []
+        miss_paths = []
+        for file_path, _, st in image_files:
+            cached = cache.get((st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)) if st.st_ino else None
+            if cached is not None and (cached[1] is not None or not use_content_hash):
+                results.append(cached)
+            else:
+                results.append(None)
+                miss_paths.append(file_path)
+        
+        if cache and image_files:
+            logger.info(f"哈希缓存命中 {len(image_files) - len(miss_paths)} 个文件，需要计算 {len(miss_paths)} 个")
+        
+        miss_results = self.hash_files(miss_paths, use_content_hash)
+        cache_batch = []
+        for (file_path, filename, st), cached in zip(image_files, results):
+            if cached is None:
+                cached = next(miss_results)
+                # Windows上DirEntry.stat()不提供inode，此时不写入缓存
+                if cached[0] is not None and st.st_ino:
+                    cache_batch.append((st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size,
+                                        cached[0], cached[1], HASH_ALGORITHM))
+            yield file_path, filename, st, cached[0], cached[1]
+        
+        self.insert_batch(self.UPSERT_CACHE_SQL, cache_batch)
 
-    def is_image_file(self, file_path):
-        """判断文件是否为图片文件"""
-        image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'}
-        _, ext = os.path.splitext(file_path.lower())
-        
-        if ext not in image_extensions:
-            return False
-        
-        # 额外验证：尝试打开文件确认是否为有效图片
+    def iter_image_files(self, directory):
+        """
+        使用os.scandir递归遍历目录，返回图片文件的DirEntry
+        DirEntry自带路径和缓存的stat信息，避免额外的系统调用
+        """
         try:
-            with Image.open(file_path) as img:
-                img.verify()  # 验证图片是否损坏
-            return True
-        except Exception:
-            return False
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.error(f"无法读取目录: {directory}, 错误: {e}")
+            return
+        
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not self.should_skip_directory(entry.name):
+                        yield from self.iter_image_files(entry.path)
+                elif entry.is_file() and self.is_image_file(entry.name):
+                    yield entry
+            except OSError as e:
+                logger.error(f"无法访问: {entry.path}, 错误: {e}")
 
-    def should_skip_directory(self, dir_path):
-        """判断是否应该跳过该目录"""
-        skip_dirs = {'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail'}
-        dir_name = os.path.basename(dir_path)
-        return dir_name in skip_dirs or dir_name.startswith('.')
+    def collect_image_files(self, directory):
+        """收集目录中的图片文件，返回 (路径, 文件名, stat信息) 列表"""
+        image_files = []
+        for entry in self.iter_image_files(directory):
+            try:
+                image_files.append((entry.path, entry.name, entry.stat()))
+            except OSError as e:
+                logger.error(f"无法获取文件信息: {entry.path}, 错误: {e}")
+        return image_files
 
     def scan_source_directory(self, directory, use_content_hash=True):
         """
@@ -149,66 +364,44 @@ class ImageCleaner:
         """
         logger.info(f"正在扫描源目录: {directory}")
         
-        # 统计图片文件数量
-        image_count = 0
-        for root, dirs, files in os.walk(directory):
-            dirs[:] = [d for d in dirs if not self.should_skip_directory(os.path.join(root, d))]
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                if self.is_image_file(file_path):
-                    image_count += 1
+        processed_count = 0
         
-        logger.info(f"源目录中共有 {image_count} 张图片")
+        # 批量插入数据库
+        batch_data = []
         
-        processed_count = 0
-        cursor = self.conn.cursor()
+        # 单次遍历收集图片列表，总数直接取列表长度，无需额外的统计遍历
+        image_files = self.collect_image_files(directory)
+        image_count = len(image_files)
+        
+        logger.info(f"源目录中共有 {image_count} 张图片")
         
-        for root, dirs, files in os.walk(directory):
-            dirs[:] = [d for d in dirs if not self.should_skip_directory(os.path.join(root, d))]
+        # 哈希值由进程池并行计算，数据库写入保留在主进程
+        for file_path, filename, st, file_hash, content_hash in self.hash_images(image_files, use_content_hash):
+            processed_count += 1
             
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                
-                # 只处理图片文件
-                if not self.is_image_file(file_path):
+            # 显示进度
+            self.show_progress("正在处理", processed_count, image_count)
+            
+            try:
+                if file_hash is None:
+                    logger.warning(f"跳过无法处理的文件: {file_path}")
                     continue
                 
-                processed_count += 1
-                
-                # 显示进度
-                if processed_count % 100 == 0 or processed_count == image_count:
-                    logger.info(f"正在处理: {processed_count}/{image_count} ({processed_count/image_count*100:.1f}%)")
-                    # 强制垃圾回收以释放内存
-                    gc.collect()
+                # 添加到批处理列表
+                batch_data.append((file_path, filename, st.st_size,
+                                   file_hash, content_hash, True))
                 
-                try:
-                    file_size = os.path.getsize(file_path)
-                    
-                    # 计算哈希值
-                    file_hash, content_hash = self.calculate_image_hash(file_path, use_content_hash)
+                # 在单个事务中批量插入
+                if len(batch_data) >= self.BATCH_SIZE:
+                    self.insert_batch(self.INSERT_SOURCE_SQL, batch_data)
+                    batch_data = []
                     
-                    if file_hash is None:
-                        logger.warning(f"跳过无法处理的文件: {file_path}")
-                        continue
-                    
-                    # 存储到数据库
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO images 
-                        (path, filename, size, file_hash, content_hash, is_source)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (file_path, os.path.basename(filename), file_size, 
-                          file_hash, content_hash, True))
-                    
-                    # 每100个文件提交一次，减少内存使用
-                    if processed_count % 100 == 0:
-                        self.conn.commit()
-                        
-                except Exception as e:
-                    logger.error(f"处理文件失败: {file_path}, 错误: {e}")
-                    continue
+            except Exception as e:
+                logger.error(f"处理文件失败: {file_path}, 错误: {e}")
+                continue
         
-        # 最终提交
-        self.conn.commit()
+        # 处理剩余的批处理数据
+        self.insert_batch(self.INSERT_SOURCE_SQL, batch_data)
         
         logger.info(f"源目录扫描完成，共记录 {processed_count} 张图片")
         return processed_count
@@ -219,100 +412,84 @@ class ImageCleaner:
         """
         logger.info(f"正在扫描目标目录寻找重复图片: {target_directory}")
         
-        # 统计目标目录中的图片文件数量
-        target_image_count = 0
-        for root, dirs, files in os.walk(target_directory):
-            dirs[:] = [d for d in dirs if not self.should_skip_directory(os.path.join(root, d))]
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                if self.is_image_file(file_path):
-                    target_image_count += 1
-        
-        logger.info(f"目标目录中共有 {target_image_count} 张图片")
-        
         processed_count = 0
         deleted_count = 0
+        deleted_batch = []
         cursor = self.conn.cursor()
         
-        for root, dirs, files in os.walk(target_directory):
-            dirs[:] = [d for d in dirs if not self.should_skip_directory(os.path.join(root, d))]
+        # 一次性将源目录的哈希值加载到内存，避免逐个文件查询数据库
+        source_file_hashes = set()
+        source_content_hashes = set()
+        source_sizes = set()
+        cursor.execute('SELECT file_hash, content_hash, size FROM images WHERE is_source = TRUE')
+        for file_hash, content_hash, size in cursor:
+            source_file_hashes.add(file_hash)
+            source_sizes.add(size)
+            if content_hash:
+                source_content_hashes.add(content_hash)
+        
+        image_files = self.collect_image_files(target_directory)
+        target_image_count = len(image_files)
+        
+        logger.info(f"目标目录中共有 {target_image_count} 张图片")
+        
+        # 快速模式只按文件哈希匹配，大小与所有源图片都不同的文件不可能重复，
+        # 直接跳过，无需读取文件计算哈希
+        if not use_content_hash:
+            image_files = [item for item in image_files if item[2].st_size in source_sizes]
+            skipped_count = target_image_count - len(image_files)
+            target_image_count = len(image_files)
+            if skipped_count:
+                logger.info(f"按文件大小预筛选跳过 {skipped_count} 张不可能重复的图片")
+        
+        for file_path, filename, st, file_hash, content_hash in self.hash_images(image_files, use_content_hash):
+            processed_count += 1
             
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                
-                # 只处理图片文件
-                if not self.is_image_file(file_path):
+            # 显示进度
+            self.show_progress("正在检查", processed_count, target_image_count)
+            
+            try:
+                if file_hash is None:
+                    logger.warning(f"跳过无法处理的文件: {file_path}")
                     continue
                 
-                processed_count += 1
+                # 检查是否在源目录的记录中存在
+                found_in_source = False
                 
-                # 显示进度
-                if processed_count % 100 == 0 or processed_count == target_image_count:
-                    logger.info(f"正在检查: {processed_count}/{target_image_count} ({processed_count/target_image_count*100:.1f}%)")
-                    gc.collect()
+                # 首先按文件哈希查找
+                if file_hash in source_file_hashes:
+                    found_in_source = True
+                    match_type = "文件哈希"
+                elif content_hash and use_content_hash and content_hash in source_content_hashes:
+                    # 如果文件哈希没找到，再按内容哈希查找
+                    found_in_source = True
+                    match_type = "内容哈希"
                 
-                try:
-                    # 计算当前文件的哈希值
-                    file_hash, content_hash = self.calculate_image_hash(file_path, use_content_hash)
-                    
-                    if file_hash is None:
-                        logger.warning(f"跳过无法处理的文件: {file_path}")
-                        continue
-                    
-                    # 检查是否在源目录的记录中存在
-                    found_in_source = False
-                    
-                    # 首先按文件哈希查找
-                    cursor.execute('''
-                        SELECT COUNT(*) FROM images 
-                        WHERE file_hash = ? AND is_source = TRUE
-                    ''', (file_hash,))
-                    
-                    if cursor.fetchone()[0] > 0:
-                        found_in_source = True
-                        match_type = "文件哈希"
-                    elif content_hash and use_content_hash:
-                        # 如果文件哈希没找到，再按内容哈希查找
-                        cursor.execute('''
-                            SELECT COUNT(*) FROM images 
-                            WHERE content_hash = ? AND is_source = TRUE AND content_hash IS NOT NULL
-                        ''', (content_hash,))
-                        
-                        if cursor.fetchone()[0] > 0:
-                            found_in_source = True
-                            match_type = "内容哈希"
-                    
-                    if found_in_source:
-                        if dry_run:
-                            logger.info(f"[模拟] 将删除重复图片: {file_path} (匹配类型: {match_type})")
-                        else:
-                            try:
-                                os.remove(file_path)
-                                logger.info(f"删除重复图片: {file_path} (匹配类型: {match_type})")
-                                deleted_count += 1
-                                
-                                # 记录删除操作到数据库
-                                cursor.execute('''
-                                    INSERT OR IGNORE INTO images 
-                                    (path, filename, size, file_hash, content_hash, is_source, deleted)
-                                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                                ''', (file_path, os.path.basename(filename), 
-                                      os.path.getsize(file_path) if os.path.exists(file_path) else 0,
-                                      file_hash, content_hash, False, True))
-                                
-                            except Exception as e:
-                                logger.error(f"删除文件失败: {file_path}, 错误: {e}")
-                    
-                    # 每100个文件提交一次数据库更改
-                    if processed_count % 100 == 0:
-                        self.conn.commit()
-                        
-                except Exception as e:
-                    logger.error(f"处理文件失败: {file_path}, 错误: {e}")
-                    continue
+                if found_in_source:
+                    if dry_run:
+                        logger.info(f"[模拟] 将删除重复图片: {file_path} (匹配类型: {match_type})")
+                    else:
+                        try:
+                            os.remove(file_path)
+                            logger.info(f"删除重复图片: {file_path} (匹配类型: {match_type})")
+                            deleted_count += 1
+                            
+                            # 记录删除操作，批量写入数据库（大小取删除前扫描得到的stat，无需再次访问文件）
+                            deleted_batch.append((file_path, filename, st.st_size,
+                                                  file_hash, content_hash, False, True))
+                            if len(deleted_batch) >= self.BATCH_SIZE:
+                                self.insert_batch(self.INSERT_DELETED_SQL, deleted_batch)
+                                deleted_batch = []
+                            
+                        except Exception as e:
+                            logger.error(f"删除文件失败: {file_path}, 错误: {e}")
+                
+            except Exception as e:
+                logger.error(f"处理文件失败: {file_path}, 错误: {e}")
+                continue
         
-        # 最终提交
-        self.conn.commit()
+        # 写入剩余的删除记录
+        self.insert_batch(self.INSERT_DELETED_SQL, deleted_batch)
         
         action_text = "模拟删除" if dry_run else "删除"
         logger.info(f"目标目录处理完成，共{action_text}了 {deleted_count} 张重复图片")
@@ -350,7 +527,9 @@ def main():
     parser.add_argument('--fast', action='store_true', help='使用快速模式（仅文件哈希，不使用内容哈希）')
     parser.add_argument('--dry-run', action='store_true', help='模拟运行，不实际删除文件')
     parser.add_argument('--db', default='image_cleaner.db', help='数据库文件路径（默认：image_cleaner.db）')
-    parser.add_argument('--keep-db', action='store_true', help='保留数据库文件，不在完成后删除')
+    parser.add_argument('--keep-db', action='store_true', help='保留数据库文件，不在完成后删除（其中的哈希缓存可供下次运行复用）')
+    parser.add_argument('--workers', type=int, default=None, help='并行计算哈希的进程/线程数（默认：进程为CPU核心数，线程为其两倍）')
+    parser.add_argument('--threads', action='store_true', help='使用线程池代替进程池计算哈希（适合I/O为瓶颈的网络存储）')
     
     args = parser.parse_args()
     
@@ -364,7 +543,8 @@ def main():
         return 1
     
     # 创建图片清理器实例
-    cleaner = ImageCleaner(args.db)
+    cleaner = ImageCleaner(args.db, workers=args.workers, use_threads=args.threads,
+                           transient=not args.keep_db)
     
     try:
         logger.info("=== 图片清理工具启动 ===")
@@ -384,6 +564,9 @@ def main():
             logger.warning("源目录中没有找到图片文件")
             return 0
         
+        # 源目录写入完成后再建立索引
+        cleaner.build_indexes()
+        
         # 步骤2：在目标目录中寻找并删除重复图片
         deleted_count = cleaner.find_and_delete_from_target(args.target, not args.fast, args.dry_run)
         
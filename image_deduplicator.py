@@ -3,13 +3,52 @@
 
 import os
 import sys
+import io
+import math
 import hashlib
+import mmap
 import shutil
 import argparse
+import itertools
+import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from operator import itemgetter
 from datetime import datetime
 from PIL import Image
 import logging
 
+# fcntl仅在类Unix系统上可用，用于reflink复制
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# NumPy为可选依赖，用于向量化计算感知哈希
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Numba为可选依赖，用于将感知哈希内核编译为本地代码
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# BLAKE3为可选依赖，SIMD加速，比MD5快数倍
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+# xxHash为可选依赖，未安装BLAKE3时代替MD5（非加密哈希，仅用于判断文件内容是否相同）
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -21,177 +60,546 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def calculate_image_hash(image_path):
+# 支持的图片扩展名，元组可直接用于str.endswith，避免splitext拆分字符串
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif')
+
+# 需要跳过的系统目录（群晖缩略图、回收站等）
+SKIP_DIRS = frozenset({'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail'})
+
+# 哈希算法标识，写入哈希缓存以免不同算法的结果混用
+if blake3 is not None:
+    FILE_HASH_ALGORITHM = 'blake3'
+elif xxhash is not None:
+    FILE_HASH_ALGORITHM = 'xxh3_128'
+else:
+    FILE_HASH_ALGORITHM = 'md5'
+# 所有格式统一使用Pillow生成缩略图，同一图片的不同格式得到相同的感知哈希
+CONTENT_HASH_ALGORITHM = 'phash-dct32-r6'
+HASH_ALGORITHM = f"{FILE_HASH_ALGORITHM}+{CONTENT_HASH_ALGORITHM}"
+
+# 感知哈希参数：32x32灰度图做DCT，取左上角8x8低频系数
+PHASH_IMAGE_SIZE = 32
+PHASH_SIZE = 8
+# DCT系数先舍入到这么多位小数再与中位数比较：纯色或渐变图片接近0或接近中位数的系数在不同实现（Numba/NumPy/纯Python）
+# 的求和顺序下浮点误差不同，舍入后各实现得到相同的哈希
+PHASH_PRECISION = 6
+# 舍入按 rint(系数 * 10^PHASH_PRECISION) 取整，与NumPy的round实现相同，三种实现的结果一致
+_PHASH_SCALE = 10.0 ** PHASH_PRECISION
+
+def _dct_basis(n, k):
+    """DCT-II正交变换矩阵的前k行，只计算需要的低频部分"""
+    return [[math.sqrt((1 if u == 0 else 2) / n) * math.cos(math.pi * (2 * x + 1) * u / (2 * n))
+             for x in range(n)] for u in range(k)]
+
+_DCT_BASIS = _dct_basis(PHASH_IMAGE_SIZE, PHASH_SIZE)
+_DCT_BASIS_NP = np.array(_DCT_BASIS) if np is not None else None
+
+if njit is not None and np is not None:
+    @njit(cache=True)
+    def _phash_kernel(pixels, basis, scale):
+        """在一个编译后的函数内完成DCT低频投影、求中位数和逐位打包，避免多次调用NumPy的开销"""
+        size = basis.shape[1]
+        hash_size = basis.shape[0]
+        row_dct = np.empty((size, hash_size))
+        for y in range(size):
+            for v in range(hash_size):
+                acc = 0.0
+                for x in range(size):
+                    acc += basis[v, x] * pixels[y * size + x]
+                row_dct[y, v] = acc
+        dct = np.empty(hash_size * hash_size)
+        for u in range(hash_size):
+            for v in range(hash_size):
+                acc = 0.0
+                for y in range(size):
+                    acc += basis[u, y] * row_dct[y, v]
+                dct[u * hash_size + v] = np.rint(acc * scale)
+        median = np.median(dct[1:])
+        one = np.uint64(1)
+        bits = np.uint64(0)
+        for value in dct:
+            bits = bits << one
+            if value > median:
+                bits = bits | one
+        return bits
+else:
+    _phash_kernel = None
+
+# 不小于此大小的文件通过mmap读取，更小的文件直接read()开销更低
+MMAP_MIN_SIZE = 256 * 1024
+
+# Linux的FICLONE ioctl：在btrfs/XFS等文件系统上以写时复制方式克隆文件
+FICLONE = 0x40049409
+
+# 处理当前文件前，提前通知内核预读之后第几个文件（仅支持posix_fadvise的系统）
+PREFETCH_DISTANCE = 2
+
+# 快速模式下大小相同的文件再比较开头的字节数
+HEAD_SIZE = 4096
+
+# 哈希缓存默认位置，以 (路径, 修改时间, 大小) 判断文件是否变化
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'image_dedup.sqlite')
+CACHE_BATCH_SIZE = 500
+CACHE_SELECT_SQL = 'SELECT fhash, chash FROM h WHERE path=? AND mtime=? AND size=? AND algo=?'
+CACHE_UPSERT_SQL = 'INSERT OR REPLACE INTO h (path, mtime, size, fhash, chash, algo) VALUES (?, ?, ?, ?, ?, ?)'
+
+def calculate_file_hash(data):
+    """
+    计算文件哈希：优先使用BLAKE3（SIMD加速），其次xxh3_128，都未安装时回退到MD5
+    三者都输出128位十六进制字符串
+    """
+    if blake3 is not None:
+        return blake3(data).hexdigest(16)
+    if xxhash is not None:
+        return xxhash.xxh3_128(data).hexdigest()
+    return hashlib.md5(data).hexdigest()
+
+def _phash_from_pixels(pixels):
+    """
+    根据32x32灰度像素计算DCT感知哈希，返回64位十六进制字符串
+    系数舍入到 PHASH_PRECISION 位小数后再比较，Numba、NumPy和纯Python三种实现的结果相同
+    """
+    if _phash_kernel is not None:
+        # JIT编译的内核（首次调用的编译结果会缓存到磁盘）
+        return '%016x' % int(_phash_kernel(np.frombuffer(pixels, dtype=np.uint8), _DCT_BASIS_NP, _PHASH_SCALE))
+    if np is not None:
+        # 二维DCT的低频部分：C * A * C^T，只保留8x8系数
+        arr = np.frombuffer(pixels, dtype=np.uint8).reshape(PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE)
+        dct = np.rint((_DCT_BASIS_NP @ arr @ _DCT_BASIS_NP.T).ravel() * _PHASH_SCALE)
+        # 与中位数比较（排除直流分量）后打包为64位
+        return np.packbits(dct > np.median(dct[1:])).tobytes().hex()
+    # 先对每一行做DCT（只保留低频），再对列做DCT
+    rows = [pixels[y * PHASH_IMAGE_SIZE:(y + 1) * PHASH_IMAGE_SIZE] for y in range(PHASH_IMAGE_SIZE)]
+    row_dct = [[sum(c * p for c, p in zip(basis, row)) for basis in _DCT_BASIS] for row in rows]
+    # round()对浮点数按四舍六入五成双取整，与np.rint一致
+    dct = [round(sum(c * row[v] for c, row in zip(basis, row_dct)) * _PHASH_SCALE)
+           for basis in _DCT_BASIS for v in range(PHASH_SIZE)]
+    median = sorted(dct[1:])[(len(dct) - 1) // 2]
+    # 基于中位数直接按位累加，避免构造字符串再按二进制解析
+    bits = 0
+    for value in dct:
+        bits = (bits << 1) | (value > median)
+    return '%016x' % bits
+
+def _thumbnail_pixels_pil(data):
+    """
+    使用Pillow解码并缩放为32x32灰度图，返回像素数据
+    """
+    # mmap本身即可作为文件对象读取，bytes需要包装
+    img = Image.open(data if isinstance(data, mmap.mmap) else io.BytesIO(data))
+    # JPEG不使用draft()按DCT比例缩小解码：缩小解码（即使只缩小1/2）或直接解码为灰度的结果
+    # 与PNG等格式完整解码后缩放的结果略有差异，会使同一图片不同格式的感知哈希不一致
+    # 先转为灰度再缩放为32x32：单通道缩放工作量仅为RGB的1/3
+    return img.convert('L').resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.Resampling.BILINEAR).tobytes()
+
+def _is_valid_image(fp, image_path):
+    """
+    只解析文件头确认是有效图片，不解码像素
+    """
+    try:
+        with Image.open(fp):
+            return True
+    except Exception as e:
+        logger.debug(f"跳过非有效图片文件: {image_path}, 错误: {e}")
+        return False
+
+def _hash_image_data(image_path, data, file_hash=None, use_content_hash=True):
+    """
+    根据已读取的文件数据（bytes或mmap）计算文件哈希和内容哈希
+    """
+    # 文件哈希 - 更快但不能检测内容相同但编码/格式不同的图片
+    if file_hash is None:
+        file_hash = calculate_file_hash(data)
+    
+    if not use_content_hash:
+        # 快速模式不需要内容哈希，只验证是否为有效图片
+        fp = data if isinstance(data, mmap.mmap) else io.BytesIO(data)
+        return (file_hash, None) if _is_valid_image(fp, image_path) else (None, None)
+        
+    # 内容哈希 - 打开图片并调整大小以创建感知哈希
+    # 这可以检测到即使调整大小或格式不同但内容相同的图片
+    # 所有格式使用同一种缩略图实现，不同后端的缩放结果有差异，会使同一图片的JPEG和PNG版本哈希不同
+    try:
+        pixels = _thumbnail_pixels_pil(data)
+    except Exception as e:
+        # 能识别文件头但无法完整解码的图片（如截断的JPEG）仍按文件哈希处理，与快速模式的判断一致；
+        # 连文件头都无法识别的才视为无效图片
+        fp = data if isinstance(data, mmap.mmap) else io.BytesIO(data)
+        if not _is_valid_image(fp, image_path):
+            return None, None
+        logger.warning(f"无法计算图片内容哈希，仅使用文件哈希: {image_path}, 错误: {e}")
+        return file_hash, None
+    
+    return file_hash, _phash_from_pixels(pixels)
+
+def calculate_image_hash(image_path, file_hash=None, use_content_hash=True):
     """
-    计算图片的哈希值，用于图片去重
+    计算图片的哈希值，用于图片去重，同时验证图片是否有效
     支持两种模式：快速模式(文件哈希)和精确模式(图片内容哈希)
+    文件只读取一次，文件哈希和图片解码共用同一份数据；无法识别的文件视为无效图片，返回 (None, None)，
+    能识别但无法完整解码的图片返回 (file_hash, None)
+    file_hash 已知时（如大小唯一的文件）不再计算文件哈希，快速模式下只读取文件头
     """
     try:
-        # 文件哈希 - 更快但不能检测内容相同但编码/格式不同的图片
+        if file_hash is not None and not use_content_hash:
+            return (file_hash, None) if _is_valid_image(image_path, image_path) else (None, None)
+        
         with open(image_path, 'rb') as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-            
-        # 内容哈希 - 打开图片并调整大小以创建感知哈希
-        # 这可以检测到即使调整大小或格式不同但内容相同的图片
-        try:
-            img = Image.open(image_path)
-            # 转换为小缩略图并转为灰度
-            img = img.resize((8, 8), Image.Resampling.LANCZOS).convert('L')
-            # 计算像素平均值
-            pixels = list(img.getdata())
-            avg_pixel = sum(pixels) / len(pixels)
-            # 基于平均值生成位序列
-            bits = ''.join(['1' if pixel >= avg_pixel else '0' for pixel in pixels])
-            # 将位序列转换为十六进制字符串
-            content_hash = hex(int(bits, 2))[2:].zfill(16)
+            if hasattr(os, 'posix_fadvise'):
+                # 整个文件会被顺序读取，让内核加大预读窗口
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            if os.fstat(f.fileno()).st_size < MMAP_MIN_SIZE:
+                return _hash_image_data(image_path, f.read(), file_hash, use_content_hash)
             
-            return file_hash, content_hash
-        except Exception as e:
-            logger.warning(f"无法计算图片内容哈希，仅使用文件哈希: {image_path}, 错误: {e}")
-            return file_hash, None
+            # 大文件通过mmap直接使用内核页缓存，不再复制到与文件同样大小的用户空间缓冲区
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _hash_image_data(image_path, mm, file_hash, use_content_hash)
             
     except Exception as e:
         logger.error(f"计算图片哈希失败: {image_path}, 错误: {e}")
         return None, None
 
+def calculate_head_hash(file_path):
+    """
+    计算文件开头 HEAD_SIZE 字节的哈希，用于大小相同的文件进一步预筛选
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            return calculate_file_hash(f.read(HEAD_SIZE))
+    except OSError as e:
+        logger.error(f"读取文件开头失败: {file_path}, 错误: {e}")
+        return None
+
+def prefetch_file(file_path):
+    """
+    通知内核在后台预读整个文件，使其读取与当前文件的哈希计算重叠
+    """
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def _hash_one(task, use_content_hash=True):
+    """
+    计算单个文件的哈希值，定义在模块级别以便在子进程中执行
+    task 为 (path, size, known_hash, is_target, prefetch_path)，返回 (path, size, file_hash, content_hash, is_target)
+    prefetch_path 为随后将由同一进程处理的文件，先通知内核预读
+    """
+    file_path, file_size, known_hash, is_target, prefetch_path = task
+    if prefetch_path is not None:
+        prefetch_file(prefetch_path)
+    file_hash, content_hash = calculate_image_hash(file_path, known_hash, use_content_hash)
+    return file_path, file_size, file_hash, content_hash, is_target
+
+def parallel_map(func, items, workers=None, use_threads=False):
+    """
+    使用进程池（或线程池）并行执行 func，按输入顺序返回结果
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = workers or (cpu_count * 2 if use_threads else cpu_count)
+    if workers <= 1 or len(items) <= 1:
+        yield from map(func, items)
+        return
+    
+    if use_threads:
+        # 哈希计算和图片解码都会释放GIL，线程池没有进程启动和数据序列化的开销，适合I/O为瓶颈的场景
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(func, items)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(func, items, chunksize=32)
+
+def open_cache(cache_path=DEFAULT_CACHE_PATH):
+    """
+    打开哈希缓存数据库，多次运行时未变化的文件无需重新计算哈希
+    """
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    conn = sqlite3.connect(cache_path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS h (
+            path TEXT PRIMARY KEY,
+            mtime INTEGER,
+            size INTEGER,
+            fhash TEXT,
+            chash TEXT,
+            algo TEXT
+        )
+    ''')
+    conn.commit()
+    return conn
+
+def find_known_hashes(entries, size_counts, cached, use_content_hash=True, workers=None, use_threads=False):
+    """
+    找出不可能与其他文件字节相同的文件，返回 {path: 代替文件哈希的占位值}
+    大小唯一的文件无需计算文件哈希；快速模式下再对大小相同的文件比较开头 HEAD_SIZE 字节
+    """
+    # 大小唯一的文件以大小作为文件哈希，保证其不会与其他文件误判为重复
+    known_hashes = {}
+    size_groups = {}  # size -> [path]
+    for file_path, file_size, _, _ in entries:
+        if size_counts[file_size] == 1:
+            known_hashes[file_path] = f"SZ:{file_size}"
+        else:
+            size_groups.setdefault(file_size, []).append(file_path)
+    
+    # 精确模式需要解码整个文件计算内容哈希，读取开头再筛选没有意义
+    if use_content_hash:
+        return known_hashes
+    
+    # 组内所有文件都已有缓存的文件哈希时，无需读取开头
+    head_files = [(file_path, file_size) for file_size, paths in size_groups.items()
+                  if any(not cached.get(file_path, (None,))[0] for file_path in paths)
+                  for file_path in paths]
+    heads = list(parallel_map(calculate_head_hash, [file_path for file_path, _ in head_files], workers, use_threads))
+    head_keys = [(file_path, file_size, head) for (file_path, file_size), head in zip(head_files, heads)]
+    key_counts = Counter((file_size, head) for _, file_size, head in head_keys)
+    for file_path, file_size, head in head_keys:
+        if head is not None and key_counts[(file_size, head)] == 1:
+            known_hashes[file_path] = f"SZ:{file_size}:{head}"
+    return known_hashes
+
+def hash_images_cached(entries, size_counts, workers=None, cache=None, use_threads=False, use_content_hash=True):
+    """
+    计算图片哈希值，按输入顺序返回 (path, size, file_hash, content_hash, is_target)
+    entries 为 [(path, size, mtime_ns, is_target)]；cache 为哈希缓存数据库连接，未变化的文件直接使用缓存结果
+    """
+    cached = {}  # path -> (fhash, chash)，缓存中的字段可能为空
+    if cache is not None:
+        for file_path, file_size, mtime, _ in entries:
+            row = cache.execute(CACHE_SELECT_SQL, (os.path.abspath(file_path), mtime, file_size, HASH_ALGORITHM)).fetchone()
+            if row:
+                cached[file_path] = row
+    
+    known_hashes = find_known_hashes(entries, size_counts, cached, use_content_hash, workers, use_threads)
+    logger.info(f"需计算完整文件哈希的图片: {len(entries) - len(known_hashes)}/{len(entries)}")
+    
+    hits = {}
+    tasks = []
+    for file_path, file_size, mtime, is_target in entries:
+        file_hash, content_hash = cached.get(file_path, (None, None))
+        file_hash = file_hash or known_hashes.get(file_path)
+        # 缓存中缺少本次需要的哈希（如上次大小唯一、或上次为快速模式）时，只计算缺少的部分
+        if file_path in cached and file_hash and (content_hash or not use_content_hash):
+            hits[file_path] = (file_hash, content_hash)
+        else:
+            tasks.append((file_path, file_size, file_hash, is_target))
+    
+    if cache is not None:
+        logger.info(f"哈希缓存命中 {len(hits)} 个文件, 需要计算 {len(tasks)} 个文件")
+    
+    # 进程池按块分配任务，同一块内之后的文件通常由同一进程处理；只读取文件头的文件无需预读
+    can_prefetch = hasattr(os, 'posix_fadvise')
+    tasks = [task + ((tasks[i + PREFETCH_DISTANCE][0]
+                      if can_prefetch and i + PREFETCH_DISTANCE < len(tasks)
+                      and (use_content_hash or tasks[i + PREFETCH_DISTANCE][2] is None) else None),)
+             for i, task in enumerate(tasks)]
+    computed = parallel_map(partial(_hash_one, use_content_hash=use_content_hash), tasks, workers, use_threads)
+    batch = []
+    for file_path, file_size, mtime, is_target in entries:
+        if file_path in hits:
+            yield (file_path, file_size) + hits[file_path] + (is_target,)
+            continue
+        
+        result = next(computed)
+        file_hash, content_hash = result[2], result[3]
+        # 无效图片不写入缓存；以大小代替的文件哈希与本次扫描相关，不写入缓存；保留缓存中已有的内容哈希
+        if cache is not None and file_hash is not None:
+            batch.append((os.path.abspath(file_path), mtime, file_size,
+                          None if file_hash.startswith('SZ:') else file_hash,
+                          content_hash or cached.get(file_path, (None, None))[1], HASH_ALGORITHM))
+            if len(batch) >= CACHE_BATCH_SIZE:
+                with cache:
+                    cache.executemany(CACHE_UPSERT_SQL, batch)
+                batch.clear()
+        yield result
+    computed.close()
+    
+    if batch:
+        with cache:
+            cache.executemany(CACHE_UPSERT_SQL, batch)
+
 def is_image_file(file_path):
     """判断文件是否为图片文件"""
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'}
-    _, ext = os.path.splitext(file_path.lower())
-    if ext not in image_extensions:
-        return False
+    # 图片是否有效在计算哈希时一并验证，避免重复打开和解码
+    return file_path.lower().endswith(IMAGE_EXTENSIONS)
+
+def should_skip_directory(dir_name):
+    """判断是否应该跳过该目录（参数为目录名，不含路径）"""
+    return dir_name in SKIP_DIRS or dir_name.startswith('.')
+
+def iter_image_files(directory):
+    """
+    使用os.scandir递归遍历目录，返回图片文件的DirEntry
+    DirEntry自带路径和缓存的类型信息，避免额外的系统调用
+    与os.walk顺序一致：先返回当前目录的文件，再进入子目录
+    """
+    try:
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError as e:
+        logger.error(f"无法读取目录: {directory}, 错误: {e}")
+        return
+    
+    subdirs = []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                # 跳过系统目录
+                if not should_skip_directory(entry.name):
+                    subdirs.append(entry.path)
+            elif entry.is_file() and is_image_file(entry.name):
+                yield entry
+        except OSError as e:
+            logger.error(f"无法访问: {entry.path}, 错误: {e}")
+    
+    for subdir in subdirs:
+        yield from iter_image_files(subdir)
+
+def collect_image_files(directory):
+    """收集目录中的图片文件，返回 (路径, 大小, 修改时间ns) 列表"""
+    image_files = []
+    for entry in iter_image_files(directory):
+        try:
+            st = entry.stat()
+            image_files.append((entry.path, st.st_size, st.st_mtime_ns))
+        except OSError as e:
+            logger.error(f"无法获取文件信息: {entry.path}, 错误: {e}")
+    return image_files
+
+def _copy_in_kernel(fsrc, fdst):
+    """
+    在内核中复制文件内容：优先reflink，其次copy_file_range，均不支持时返回False
+    """
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError:
+            pass
     
-    # 额外验证：尝试打开文件确认是否为有效图片
+    if hasattr(os, 'copy_file_range'):
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                if copied == 0:
+                    # 部分文件系统（网络、FUSE等）不支持时直接返回0，此时内容并未复制完整
+                    break
+                offset += copied
+        except OSError:
+            pass
+        if offset == size:
+            return True
+        # 丢弃已复制的部分，由调用方改用普通复制
+        fdst.truncate(0)
+    return False
+
+def unique_open(dirpath, filename):
+    """
+    在目录中以独占方式创建文件，重名时依次添加 _1、_2 ... 后缀，返回 (fd, 路径)
+    O_EXCL使检查和创建成为同一个原子操作，不需要先逐个调用os.path.exists探测
+    """
+    name, ext = os.path.splitext(filename)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    for counter in itertools.count():
+        candidate = os.path.join(dirpath, filename if counter == 0 else f"{name}_{counter}{ext}")
+        try:
+            return os.open(candidate, flags, 0o644), candidate
+        except FileExistsError:
+            continue
+
+def fast_copy(src, target_dir):
+    """
+    复制文件到目标目录并保留元数据，重名时自动添加数字后缀，返回实际的目标路径
+    同一文件系统上reflink为O(1)操作，copy_file_range不经过用户空间，都不支持时回退到普通复制
+    """
+    fd, dst = unique_open(target_dir, os.path.basename(src))
     try:
-        with Image.open(file_path) as img:
-            img.verify()  # 验证图片是否损坏
-        return True
+        with os.fdopen(fd, 'wb') as fdst, open(src, 'rb') as fsrc:
+            if not _copy_in_kernel(fsrc, fdst):
+                shutil.copyfileobj(fsrc, fdst)
+        shutil.copystat(src, dst)
     except Exception:
-        # 如果无法打开或验证失败，说明不是有效图片文件
-        return False
-
-def should_skip_directory(dir_path):
-    """判断是否应该跳过该目录"""
-    skip_dirs = {'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail'}
-    dir_name = os.path.basename(dir_path)
-    return dir_name in skip_dirs or dir_name.startswith('.')
+        # 复制失败时删除已创建的不完整文件
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        raise
+    return dst
 
-def process_images(source_dir, target_dir, use_content_hash=True):
+def process_images(source_dir, target_dir, use_content_hash=True, workers=None, cache=None, use_threads=False):
     """
     处理图片：找出所有图片，去重，并保留最大的文件
     完全重写以修复逻辑问题
+    workers 为并行计算哈希的进程/线程数；cache 为哈希缓存数据库连接；use_threads 使用线程池代替进程池
     """
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
         logger.info(f"创建目标目录: {target_dir}")
 
-    # 收集所有图片信息，包括源目录和目标目录
-    all_images = {}  # filename -> [{'path': str, 'size': int, 'hash': str, 'content_hash': str}]
+    # 按哈希值分组处理重复项（真正的去重），扫描时直接分组
+    hash_groups = {}  # hash -> [{'path': str, 'size': int, 'hash': str, 'content_hash': str, 'is_target': bool}]
       # 扫描目标目录
     logger.info(f"正在扫描目标目录: {target_dir}")
-    target_count = 0
-    for root, dirs, files in os.walk(target_dir):
-        # 跳过系统目录
-        dirs[:] = [d for d in dirs if not should_skip_directory(os.path.join(root, d))]
-        
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            if is_image_file(file_path):
-                target_count += 1
-                file_hash, content_hash = calculate_image_hash(file_path)
-                file_size = os.path.getsize(file_path)
-                
-                base_filename = os.path.basename(filename)
-                if base_filename not in all_images:
-                    all_images[base_filename] = []
-                
-                all_images[base_filename].append({
-                    'path': file_path,
-                    'size': file_size,
-                    'hash': file_hash,
-                    'content_hash': content_hash,
-                    'is_target': True
-                })
+    target_images = collect_image_files(target_dir)  # [(path, size, mtime_ns)]
+    logger.info(f"目标目录中共有 {len(target_images)} 个可能的图片文件")
     
-    logger.info(f"目标目录中找到 {target_count} 张图片")
       # 扫描源目录
     logger.info(f"正在扫描源目录: {source_dir}")
-    source_count = 0
-    processed_files = 0
-    total_files = 0
+    source_images = collect_image_files(source_dir)  # [(path, size, mtime_ns)]
+    logger.info(f"源目录中共有 {len(source_images)} 个可能的图片文件")
     
-    # 先统计总文件数以便显示进度
-    logger.info("正在统计源目录中的文件数量...")
-    for root, dirs, files in os.walk(source_dir):
-        dirs[:] = [d for d in dirs if not should_skip_directory(os.path.join(root, d))]
-        for filename in files:
-            _, ext = os.path.splitext(filename.lower())
-            if ext in {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'}:
-                total_files += 1
+    # 按文件大小预筛选：大小唯一的文件不可能与其他文件字节相同，无需读取全部内容计算文件哈希
+    size_counts = Counter(size for _, size, _ in target_images)
+    size_counts.update(size for _, size, _ in source_images)
     
-    logger.info(f"源目录中共有 {total_files} 个可能的图片文件")
+    entries = [(file_path, file_size, mtime, is_target)
+               for images, is_target in ((target_images, True), (source_images, False))
+               for file_path, file_size, mtime in images]
     
-    # 扫描源目录
-    for root, dirs, files in os.walk(source_dir):
-        # 跳过系统目录
-        dirs[:] = [d for d in dirs if not should_skip_directory(os.path.join(root, d))]
+    target_count = 0
+    source_count = 0
+    processed_files = 0
+    total_files = len(entries)
+    for file_path, file_size, file_hash, content_hash, is_target in hash_images_cached(entries, size_counts, workers, cache, use_threads, use_content_hash):
+        processed_files += 1
         
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            _, ext = os.path.splitext(filename.lower())
-            
-            # 只处理可能的图片文件扩展名
-            if ext in {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'}:
-                processed_files += 1
-                
-                # 显示进度
-                if processed_files % 100 == 0 or processed_files == total_files:
-                    logger.info(f"正在处理: {processed_files}/{total_files} ({processed_files/total_files*100:.1f}%)")
-                
-                # 验证是否为有效图片
-                if is_image_file(file_path):
-                    source_count += 1
-                    file_hash, content_hash = calculate_image_hash(file_path)
-                    if file_hash is None:  # 如果计算哈希失败，跳过该文件
-                        logger.warning(f"跳过无法处理的文件: {file_path}")
-                        continue
-                        
-                    file_size = os.path.getsize(file_path)
-                    
-                    base_filename = os.path.basename(filename)
-                    if base_filename not in all_images:
-                        all_images[base_filename] = []
-                    
-                    all_images[base_filename].append({
-                        'path': file_path,
-                        'size': file_size,
-                        'hash': file_hash,
-                        'content_hash': content_hash,
-                        'is_target': False                    })
-                else:
-                    logger.debug(f"跳过非有效图片文件: {file_path}")
-    
-    logger.info(f"源目录中找到 {source_count} 张图片")
+        # 显示进度
+        if processed_files % 100 == 0 or processed_files == total_files:
+            logger.info(f"正在处理: {processed_files}/{total_files} ({processed_files/total_files*100:.1f}%)")
+        
+        if file_hash is None:  # 如果计算哈希失败或不是有效图片，跳过该文件（原因已在计算时记录）
+            logger.debug(f"跳过无法处理的文件: {file_path}")
+            continue
+        
+        if is_target:
+            target_count += 1
+        else:
+            source_count += 1
+        
+        file_info = {
+            'path': file_path,
+            'size': file_size,
+            'hash': file_hash,
+            'content_hash': content_hash,
+            'is_target': is_target
+        }
+        # 使用文件哈希作为主要去重依据
+        hash_groups.setdefault(file_hash, []).append(file_info)
+        # 如果启用内容哈希且与文件哈希不同，也加入分组（同一个字典，后续按路径去重）
+        if use_content_hash and content_hash and content_hash != file_hash:
+            hash_groups.setdefault(content_hash, []).append(file_info)
     
-    # 按哈希值分组处理重复项（真正的去重）
-    hash_groups = {}  # hash -> [file_info, ...]
+    logger.info(f"目标目录中找到 {target_count} 张图片, 源目录中找到 {source_count} 张图片")
     
-    # 将所有图片按哈希值分组
-    for filename, file_list in all_images.items():
-        for file_info in file_list:
-            # 使用文件哈希作为主要去重依据
-            primary_hash = file_info['hash']
-            if primary_hash:
-                if primary_hash not in hash_groups:
-                    hash_groups[primary_hash] = []
-                hash_groups[primary_hash].append(file_info)
-            
-            # 如果启用内容哈希且与文件哈希不同，也加入分组
-            if use_content_hash and file_info['content_hash'] and file_info['content_hash'] != primary_hash:
-                content_hash = file_info['content_hash']
-                if content_hash not in hash_groups:
-                    hash_groups[content_hash] = []
-                hash_groups[content_hash].append(file_info)
     # 处理每个哈希组
     copied_count = 0
     skipped_count = 0
@@ -201,12 +609,11 @@ def process_images(source_dir, target_dir, use_content_hash=True):
     
     for hash_value, file_list in hash_groups.items():
         # 去除重复的文件引用（同一文件可能被文件哈希和内容哈希都引用）
-        unique_files = []
-        seen_paths = set()
-        for file_info in file_list:
-            if file_info['path'] not in seen_paths:
-                unique_files.append(file_info)
-                seen_paths.add(file_info['path'])
+        # 绝大多数分组只有一个文件，无需去重；多个文件时用字典按路径去重并保持原顺序
+        if len(file_list) == 1:
+            unique_files = file_list
+        else:
+            unique_files = list({file_info['path']: file_info for file_info in file_list}.values())
         
         if len(unique_files) <= 1:
             # 没有重复文件
@@ -214,18 +621,9 @@ def process_images(source_dir, target_dir, use_content_hash=True):
                 file_info = unique_files[0]
                 if not file_info['is_target'] and file_info['path'] not in processed_files:
                     # 源目录中的唯一文件，复制到目标目录
-                    target_path = os.path.join(target_dir, os.path.basename(file_info['path']))
-                    
-                    # 处理文件名冲突
-                    original_target_path = target_path
-                    counter = 1
-                    while os.path.exists(target_path):
-                        name, ext = os.path.splitext(os.path.basename(file_info['path']))
-                        target_path = os.path.join(target_dir, f"{name}_{counter}{ext}")
-                        counter += 1
-                    
                     try:
-                        shutil.copy2(file_info['path'], target_path)
+                        # 处理文件名冲突：重名时自动添加数字后缀
+                        target_path = fast_copy(file_info['path'], target_dir)
                         logger.info(f"复制唯一文件: {file_info['path']} -> {target_path}")
                         copied_count += 1
                         processed_files.add(file_info['path'])
@@ -233,16 +631,19 @@ def process_images(source_dir, target_dir, use_content_hash=True):
                         logger.error(f"复制文件失败: {file_info['path']}, 错误: {e}")
         else:
             # 有重复文件，选择最大的
-            largest_file = max(unique_files, key=lambda x: x['size'])
+            largest_file = max(unique_files, key=itemgetter('size'))
             
-            # 检查最大文件是否已经在目标目录中
-            target_files = [f for f in unique_files if f['is_target']]
-            source_files = [f for f in unique_files if not f['is_target']]            
+            # 检查最大文件是否已经在目标目录中（一次遍历分出目标目录和源目录的文件）
+            target_files = []
+            source_files = []
+            for file_info in unique_files:
+                (target_files if file_info['is_target'] else source_files).append(file_info)
+
             if largest_file['is_target']:
                 # 最大文件已在目标目录中
                 # 删除目标目录中其他较小的重复文件
                 for file_info in target_files:
-                    if file_info != largest_file and file_info['path'] not in processed_files:
+                    if file_info is not largest_file and file_info['path'] not in processed_files:
                         try:
                             os.remove(file_info['path'])
                             logger.info(f"删除较小的重复文件: {file_info['path']} ({file_info['size']} bytes)")
@@ -271,17 +672,9 @@ def process_images(source_dir, target_dir, use_content_hash=True):
                 
                 # 复制最大的文件
                 if largest_file['path'] not in processed_files:
-                    target_path = os.path.join(target_dir, os.path.basename(largest_file['path']))
-                    
-                    # 处理文件名冲突
-                    counter = 1
-                    while os.path.exists(target_path):
-                        name, ext = os.path.splitext(os.path.basename(largest_file['path']))
-                        target_path = os.path.join(target_dir, f"{name}_{counter}{ext}")
-                        counter += 1
-                    
                     try:
-                        shutil.copy2(largest_file['path'], target_path)
+                        # 处理文件名冲突：重名时自动添加数字后缀
+                        target_path = fast_copy(largest_file['path'], target_dir)
                         logger.info(f"复制最大文件: {largest_file['path']} ({largest_file['size']} bytes) -> {target_path}")
                         replaced_count += 1
                         processed_files.add(largest_file['path'])
@@ -289,7 +682,7 @@ def process_images(source_dir, target_dir, use_content_hash=True):
                         logger.error(f"复制文件失败: {largest_file['path']}, 错误: {e}")
                   # 跳过源目录中其他较小的重复文件
                 for file_info in source_files:
-                    if file_info != largest_file and file_info['path'] not in processed_files:
+                    if file_info is not largest_file and file_info['path'] not in processed_files:
                         logger.debug(f"跳过较小的重复文件: {file_info['path']} ({file_info['size']} bytes)")
                         skipped_count += 1
                         processed_files.add(file_info['path'])
@@ -302,6 +695,10 @@ def main():
     parser.add_argument('--source', '-s', required=True, nargs='+', help='源图片目录（可指定多个）')
     parser.add_argument('--target', '-t', required=True, nargs='+', help='目标图片目录（可指定多个）')
     parser.add_argument('--fast', action='store_true', help='使用快速模式（仅文件哈希，不检测内容相似性）')
+    parser.add_argument('--workers', type=int, default=None, help='并行计算哈希的进程/线程数（默认：进程为CPU核心数，线程为其两倍）')
+    parser.add_argument('--threads', action='store_true', help='使用线程池代替进程池计算哈希（适合网络存储等I/O为瓶颈的场景）')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help=f'哈希缓存数据库路径（默认：{DEFAULT_CACHE_PATH}）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用哈希缓存，每次重新计算所有文件')
     
     args = parser.parse_args()
     
@@ -325,6 +722,7 @@ def main():
     total_copied = 0
     total_skipped = 0
     total_deleted = 0
+    cache = None if args.no_cache else open_cache(args.cache)
     
     for i, source_dir in enumerate(args.source):
         # 确定对应的目标目录
@@ -334,10 +732,12 @@ def main():
             target_dir = args.target[i]
         
         logger.info(f"\n处理第 {i+1}/{len(args.source)} 个任务: {source_dir} -> {target_dir}")
-        copied, skipped, deleted = process_images(source_dir, target_dir, not args.fast)
+        copied, skipped, deleted = process_images(source_dir, target_dir, not args.fast, args.workers, cache, args.threads)
         total_copied += copied
         total_skipped += skipped
         total_deleted += deleted
+    if cache is not None:
+        cache.close()
     logger.info("=== 图片去重和整理工具完成 ===")
     logger.info(f"总计复制了 {total_copied} 张新图片")
     logger.info(f"总计跳过了 {total_skipped} 张重复图片")
@@ -3,12 +3,37 @@
 
 import os
 import sys
+import math
 import hashlib
 import shutil
+import sqlite3
 import argparse
+import threading
+from array import array
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from PIL import Image
 import logging
+import logging.handlers
+import queue
+
+# NumPy为可选依赖，用于向量化计算图片感知哈希（DCT）
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 # 设置日志
 logging.basicConfig(
@@ -21,41 +46,207 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def calculate_file_hash(file_path):
+# 后台写日志的监听线程，由 start_log_listener 启动
+_log_listener = None
+
+def start_log_listener():
+    """
+    将根日志记录器的处理器移到后台线程：处理文件时只把日志记录放入队列，写文件和终端在QueueListener线程中完成
+    """
+    global _log_listener
+    root = logging.getLogger()
+    log_queue = queue.Queue(-1)
+    _log_listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    _log_listener.start()
+
+def stop_log_listener():
+    """写完队列中剩余的日志并恢复原处理器"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        logging.getLogger().handlers = list(_log_listener.handlers)
+        _log_listener = None
+
+def _init_worker():
+    """
+    子进程初始化：fork继承的日志队列在子进程中没有监听线程，改回直接写入原处理器
+    """
+    if _log_listener is not None:
+        logging.getLogger().handlers = list(_log_listener.handlers)
+
+# 分块读取文件计算哈希的缓冲区大小
+HASH_CHUNK_SIZE = 1 << 20
+
+# 各类文件的扩展名，模块加载时构建一次
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'})
+VIDEO_EXTENSIONS = frozenset({'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg'})
+# 只比较最后一段扩展名，.tar.gz/.tar.bz2/.tar.xz 分别按 .gz/.bz2/.xz 识别
+ARCHIVE_EXTENSIONS = frozenset({'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz'})
+# 扩展名到文件类型的映射，一次字典查找即可完成分类
+EXTENSION_TYPES = {
+    **dict.fromkeys(IMAGE_EXTENSIONS, 'image'),
+    **dict.fromkeys(VIDEO_EXTENSIONS, 'video'),
+    **dict.fromkeys(ARCHIVE_EXTENSIONS, 'archive'),
+}
+
+# 遍历时跳过的系统目录（以点开头的目录另外跳过）；mp4和zip为分类保存视频和压缩文件的子目录
+SKIP_DIRECTORIES = frozenset({'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail', 'mp4', 'zip'})
+
+# 预筛选时读取文件开头和末尾的字节数；不超过两倍该大小的文件直接计算完整哈希
+HEAD_TAIL_SIZE = 64 * 1024
+
+# 文件哈希仅用作去重键，不需要密码学强度：优先使用BLAKE3（SIMD加速），其次xxh3_128，最后回退到MD5
+FILE_HASH_ALGORITHMS = ('blake3', 'xxh3', 'md5')
+DEFAULT_FILE_HASH_ALGORITHM = 'blake3' if blake3 is not None else ('xxh3' if xxhash is not None else 'md5')
+
+# 感知哈希参数：32x32灰度图做DCT，取左上角8x8低频系数
+PHASH_IMAGE_SIZE = 32
+PHASH_SIZE = 8
+PHASH_PRECISION = 6
+# 内容哈希算法标识，与文件哈希算法一起写入缓存，算法变化时缓存的哈希自动失效
+CONTENT_HASH_ALGORITHM = 'phash-dct32'
+
+# 处理当前文件前，提前通知内核预读之后第几个文件（仅支持posix_fadvise的系统）
+PREFETCH_DISTANCE = 2
+
+# 并行执行删除和复制的线程数：这些操作都是释放GIL的系统调用，在网络存储上主要受往返延迟限制
+FILE_OP_WORKERS = 32
+
+# 用户空间复制（内核复制均不可用时）的缓冲区大小
+COPY_BUFFER_SIZE = 4 << 20
+
+# 哈希缓存默认位置，以 (设备号, inode) 标识文件，修改时间和大小不变时直接使用缓存的哈希
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'image2out', 'hashes.sqlite')
+CACHE_BATCH_SIZE = 512
+CACHE_SELECT_SQL = 'SELECT file_hash, content_hash FROM hashes WHERE dev=? AND ino=? AND mtime_ns=? AND size=? AND algo=?'
+CACHE_UPSERT_SQL = 'INSERT OR REPLACE INTO hashes (dev, ino, mtime_ns, size, file_hash, content_hash, algo) VALUES (?, ?, ?, ?, ?, ?, ?)'
+
+# 每个线程复用同一块读取缓冲区，避免每个文件重新分配
+_read_buffer = threading.local()
+
+def is_hash_algorithm_available(algo):
+    """判断文件哈希算法所需的库是否已安装"""
+    if algo == 'blake3':
+        return blake3 is not None
+    if algo == 'xxh3':
+        return xxhash is not None
+    return algo == 'md5'
+
+def _new_file_hasher(algo):
+    """创建文件哈希对象"""
+    if algo == 'blake3':
+        return blake3()
+    if algo == 'xxh3':
+        return xxhash.xxh3_128()
+    return hashlib.md5()
+
+def _hash_file(file_path, algo=DEFAULT_FILE_HASH_ALGORITHM):
+    """
+    分块读取文件计算哈希，内存占用固定为一个缓冲区而不是整个文件
+    各算法均输出128位（32个十六进制字符）的摘要
+    """
+    buf = getattr(_read_buffer, 'buf', None)
+    if buf is None:
+        buf = _read_buffer.buf = bytearray(HASH_CHUNK_SIZE)
+    mv = memoryview(buf)
+    hasher = _new_file_hasher(algo)
+    # 无缓冲读取，直接读入复用的缓冲区，避免双重缓冲
+    with open(file_path, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            # 整个文件会被顺序读取，让内核加大预读窗口
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(mv[:n])
+    return hasher.hexdigest(16) if algo == 'blake3' else hasher.hexdigest()
+
+def calculate_file_hash(file_path, algo=DEFAULT_FILE_HASH_ALGORITHM):
     """
     计算文件的哈希值，用于文件去重
     """
     try:
-        with open(file_path, 'rb') as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-        return file_hash
+        return _hash_file(file_path, algo)
     except Exception as e:
         logger.error(f"计算文件哈希失败: {file_path}, 错误: {e}")
         return None
 
-def calculate_image_hash(image_path):
+def _dct_basis(n, k):
+    """DCT-II正交变换矩阵的前k行，只计算需要的低频部分"""
+    return [[math.sqrt((1 if u == 0 else 2) / n) * math.cos(math.pi * (2 * x + 1) * u / (2 * n))
+             for x in range(n)] for u in range(k)]
+
+_DCT_BASIS = _dct_basis(PHASH_IMAGE_SIZE, PHASH_SIZE)
+_DCT_BASIS_NP = np.array(_DCT_BASIS) if np is not None else None
+
+def perceptual_hash(img):
+    """
+    计算32x32灰度缩略图的DCT感知哈希：取8x8低频系数与其中位数（排除直流分量）比较，
+    按行优先、高位在前组成64位，返回16位十六进制字符串
+    相比平均哈希，对大面积纯色或构图居中的图片误判更少
+    系数先舍入到 PHASH_PRECISION 位小数，避免纯色图片接近0的系数因浮点误差在不同实现间得到不同结果
+    """
+    pixels = img.tobytes()
+    if np is not None:
+        # 二维DCT的低频部分：C * A * C^T，只保留8x8系数
+        arr = np.frombuffer(pixels, dtype=np.uint8).reshape(PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE)
+        dct = np.round((_DCT_BASIS_NP @ arr @ _DCT_BASIS_NP.T).ravel(), PHASH_PRECISION)
+        return np.packbits(dct > np.median(dct[1:])).tobytes().hex()
+    
+    # 先对每一行做DCT（只保留低频），再对列做DCT
+    rows = [pixels[y * PHASH_IMAGE_SIZE:(y + 1) * PHASH_IMAGE_SIZE] for y in range(PHASH_IMAGE_SIZE)]
+    row_dct = [[sum(c * p for c, p in zip(basis, row)) for basis in _DCT_BASIS] for row in rows]
+    dct = [round(sum(c * row[v] for c, row in zip(basis, row_dct)), PHASH_PRECISION)
+           for basis in _DCT_BASIS for v in range(PHASH_SIZE)]
+    median = sorted(dct[1:])[(len(dct) - 1) // 2]
+    bits = 0
+    for value in dct:
+        bits = (bits << 1) | (value > median)
+    return '%016x' % bits
+
+def calculate_head_tail_hash(file_path, file_size, algo=DEFAULT_FILE_HASH_ALGORITHM):
+    """
+    计算文件开头和末尾各 HEAD_TAIL_SIZE 字节的哈希，用于在计算完整哈希前廉价地排除不可能重复的文件
+    """
+    hasher = xxhash.xxh3_64() if xxhash is not None else _new_file_hasher(algo)
+    try:
+        with open(file_path, 'rb') as f:
+            hasher.update(f.read(HEAD_TAIL_SIZE))
+            f.seek(max(HEAD_TAIL_SIZE, file_size - HEAD_TAIL_SIZE))
+            hasher.update(f.read(HEAD_TAIL_SIZE))
+    except Exception as e:
+        logger.error(f"计算文件头尾哈希失败: {file_path}, 错误: {e}")
+        return None
+    return hasher.hexdigest()
+
+def calculate_image_hash(image_path, use_content_hash=True, algo=DEFAULT_FILE_HASH_ALGORITHM, file_hash=None, img=None):
     """
     计算图片的哈希值，用于图片去重
     支持两种模式：快速模式(文件哈希)和精确模式(图片内容哈希)
+    快速模式下不使用内容哈希，直接返回 (file_hash, None)
+    file_hash 已知时（预筛选已确定不可能与其他文件字节相同）不再读取文件计算文件哈希
+    img 为调用方已打开的图片对象，传入时直接用于计算内容哈希，避免再次打开文件
     """
     try:
         # 文件哈希 - 更快但不能检测内容相同但编码/格式不同的图片
-        with open(image_path, 'rb') as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
+        if file_hash is None:
+            file_hash = _hash_file(image_path, algo)
+        
+        if not use_content_hash:
+            return file_hash, None
             
         # 内容哈希 - 打开图片并调整大小以创建感知哈希
         # 这可以检测到即使调整大小或格式不同但内容相同的图片
         try:
-            img = Image.open(image_path)
-            # 转换为小缩略图并转为灰度
-            img = img.resize((8, 8), Image.Resampling.LANCZOS).convert('L')
-            # 计算像素平均值
-            pixels = list(img.getdata())
-            avg_pixel = sum(pixels) / len(pixels)
-            # 基于平均值生成位序列
-            bits = ''.join(['1' if pixel >= avg_pixel else '0' for pixel in pixels])
-            # 将位序列转换为十六进制字符串
-            content_hash = hex(int(bits, 2))[2:].zfill(16)
+            if img is None:
+                img = Image.open(image_path)
+            # JPEG不使用draft()按DCT比例缩小解码：缩小解码或直接解码为灰度的结果与PNG等格式
+            # 完整解码后缩放的结果略有差异，会使同一图片不同格式的感知哈希不一致
+            # 转换为小缩略图并转为灰度；感知哈希只取低频系数，双线性插值已足够
+            img = img.convert('L').resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.Resampling.BILINEAR)
+            content_hash = perceptual_hash(img)
             
             return file_hash, content_hash
         except Exception as e:
@@ -66,24 +257,17 @@ def calculate_image_hash(image_path):
         logger.error(f"计算图片哈希失败: {image_path}, 错误: {e}")
         return None, None
 
-def get_file_type(file_path):
+def get_file_type(file_name):
     """
     判断文件类型：图片、视频、压缩文件或其他
+    file_name 传入文件名（如DirEntry.name）即可，也可以传入完整路径；只对扩展名部分转小写
     """
-    _, ext = os.path.splitext(file_path.lower())
-    
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'}
-    video_extensions = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg'}
-    archive_extensions = {'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz', '.tar.gz', '.tar.bz2', '.tar.xz'}
-    
-    if ext in image_extensions:
-        return 'image'
-    elif ext in video_extensions:
-        return 'video'
-    elif ext in archive_extensions:
-        return 'archive'
-    else:
+    start = file_name.rfind(os.sep) + 1
+    dot = file_name.rfind('.', start)
+    # 与os.path.splitext一致：以点开头的文件名（如 .jpg）视为没有扩展名
+    if dot <= start:
         return 'other'
+    return EXTENSION_TYPES.get(file_name[dot:].lower(), 'other')
 
 def is_image_file(file_path):
     """判断文件是否为图片文件"""
@@ -100,10 +284,56 @@ def is_image_file(file_path):
         return False
 
 def should_skip_directory(dir_path):
-    """判断是否应该跳过该目录"""
-    skip_dirs = {'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail', 'mp4', 'zip'}
+    """判断是否应该跳过该目录；dir_path 也可以直接传入目录名（如DirEntry.name）"""
     dir_name = os.path.basename(dir_path)
-    return dir_name in skip_dirs or dir_name.startswith('.')
+    return dir_name in SKIP_DIRECTORIES or dir_name.startswith('.')
+
+def iter_files(directory):
+    """
+    使用os.scandir递归遍历目录，返回文件的DirEntry
+    DirEntry自带路径和缓存的类型信息，避免os.walk和os.path.getsize额外的stat调用
+    与os.walk顺序一致：先返回当前目录的文件，再进入子目录
+    """
+    try:
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError as e:
+        logger.error(f"无法读取目录: {directory}, 错误: {e}")
+        return
+    
+    subdirs = []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                # 跳过系统目录
+                if not should_skip_directory(entry.name):
+                    subdirs.append(entry.path)
+            elif entry.is_file():
+                yield entry
+        except OSError as e:
+            logger.error(f"无法访问: {entry.path}, 错误: {e}")
+    
+    for subdir in subdirs:
+        yield from iter_files(subdir)
+
+def collect_files(directory, media_only=False):
+    """
+    收集目录中的文件，返回 [(路径, 文件类型, 大小, 文件标识)]
+    文件标识为 (设备号, inode, 修改时间ns)，用于查询哈希缓存；系统不提供inode时为 None
+    media_only 为 True 时只收集图片、视频和压缩文件
+    """
+    collected = []
+    for entry in iter_files(directory):
+        file_type = get_file_type(entry.name)
+        if media_only and file_type == 'other':
+            continue
+        try:
+            st = entry.stat()
+            file_id = (st.st_dev, st.st_ino, st.st_mtime_ns) if st.st_ino else None
+            collected.append((entry.path, file_type, st.st_size, file_id))
+        except OSError as e:
+            logger.error(f"无法获取文件信息: {entry.path}, 错误: {e}")
+    return collected
 
 def get_target_directory(target_dir, file_type):
     """
@@ -124,127 +354,398 @@ def ensure_directory_exists(dir_path):
         os.makedirs(dir_path)
         logger.info(f"创建目录: {dir_path}")
 
-def process_media_files(source_dir, target_dir, use_content_hash=True):
+def _copy_in_kernel(fsrc, fdst, size):
+    """
+    在内核中复制文件内容：优先copy_file_range（XFS/Btrfs上为reflink），其次sendfile，均不支持时返回False
+    """
+    for copy in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, copy):
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if copy == 'copy_file_range':
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                else:
+                    copied = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                if copied == 0:
+                    # 部分文件系统（网络、FUSE等）不支持时直接返回0，此时内容并未复制完整
+                    break
+                offset += copied
+        except OSError:
+            pass
+        if offset == size:
+            return True
+        # 不支持或未复制完整时丢弃已复制的部分，从头改用下一种方式
+        fdst.seek(0)
+        fdst.truncate()
+    return False
+
+def fast_copy(src, dst):
+    """
+    复制文件并保留元数据（等同于shutil.copy2），数据在内核中复制，不经过用户空间缓冲区
+    目标文件以独占方式创建，已存在时抛出FileExistsError，不会覆盖已有文件
+    """
+    with open(src, 'rb') as fsrc:
+        fdst = open(dst, 'xb')
+        try:
+            with fdst:
+                if not _copy_in_kernel(fsrc, fdst, os.fstat(fsrc.fileno()).st_size):
+                    shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+            shutil.copystat(src, dst)
+        except Exception:
+            # 复制失败时删除已创建的不完整文件
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+            raise
+
+def reserve_target_path(src, dir_path, existing_names):
+    """
+    为复制到目录的文件选择不冲突的文件名，重名时自动添加数字后缀，登记到 existing_names 并返回目标路径
+    existing_names 为目录中已有文件名的集合（每种文件类型处理前读取一次），在内存中解决重名，
+    不再为每个候选名调用os.path.exists
+    """
+    filename = os.path.basename(src)
+    name, ext = os.path.splitext(filename)
+    candidate = filename
+    counter = 1
+    while candidate in existing_names:
+        candidate = f"{name}_{counter}{ext}"
+        counter += 1
+    existing_names.add(candidate)
+    return os.path.join(dir_path, candidate)
+
+def release_target_name(file_path, dir_path, existing_names):
+    """文件将从 dir_path 中删除时，从已有文件名集合中移除，使该文件名可以被重新使用"""
+    if os.path.normpath(os.path.dirname(file_path)) == os.path.normpath(dir_path):
+        existing_names.discard(os.path.basename(file_path))
+
+def copy_to_directory(src, dir_path, existing_names, target_path, names_lock):
+    """
+    复制文件到预先选定的目标路径，返回实际的目标路径
+    集合与磁盘不一致（如大小写不敏感的文件系统、删除失败的文件）时由独占创建兜底，改用下一个可用的文件名
+    """
+    while True:
+        try:
+            fast_copy(src, target_path)
+            return target_path
+        except FileExistsError:
+            with names_lock:
+                existing_names.add(os.path.basename(target_path))
+                target_path = reserve_target_path(src, dir_path, existing_names)
+
+def run_file_operations(to_delete, to_copy, dir_path, existing_names):
+    """
+    使用线程池批量执行删除和复制，使各个系统调用的等待时间相互重叠
+    先完成全部删除再开始复制（被删除文件的文件名可能已分配给要复制的文件）
+    返回与输入对齐的结果：删除为异常或None，复制为 (实际目标路径, 异常或None)
+    """
+    names_lock = threading.Lock()
+    
+    def delete(file_path):
+        try:
+            os.remove(file_path)
+            return None
+        except Exception as e:
+            return e
+    
+    def copy(item):
+        src, target_path = item
+        try:
+            return copy_to_directory(src, dir_path, existing_names, target_path, names_lock), None
+        except Exception as e:
+            return target_path, e
+    
+    with ThreadPoolExecutor(max_workers=FILE_OP_WORKERS) as executor:
+        delete_results = list(executor.map(delete, [file_path for file_path, _ in to_delete]))
+        copy_results = list(executor.map(copy, [(src, target_path) for src, target_path, _, _ in to_copy]))
+    return delete_results, copy_results
+
+def prefetch_file(file_path):
+    """
+    通知内核在后台预读整个文件，使其读取与当前文件的哈希计算重叠
+    """
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def _hash_one(task):
+    """
+    验证并计算单个文件的哈希值，定义在模块级别以便在子进程中执行
+    task 为 (path, file_type, size, use_content_hash, algo, known_hash, prefetch_path)，返回 (path, file_type, is_valid, file_hash, content_hash, file_size)
+    known_hash 不为 None 时直接作为文件哈希，无需读取文件；prefetch_path 为随后将由同一进程处理的文件，先通知内核预读
+    """
+    file_path, file_type, file_size, use_content_hash, algo, known_hash, prefetch_path = task
+    if prefetch_path is not None:
+        prefetch_file(prefetch_path)
+    
+    if file_type == 'image':
+        # 打开图片只解析文件头，无法识别的即为无效图片；同一个图片对象直接用于计算内容哈希，
+        # 不再单独调用 is_image_file 做 verify()，每张图片只打开和解码一次
+        try:
+            img = Image.open(file_path)
+        except Exception:
+            return file_path, file_type, False, None, None, file_size
+        with img:
+            file_hash, content_hash = calculate_image_hash(file_path, use_content_hash, algo, known_hash, img)
+    else:
+        file_hash = known_hash or calculate_file_hash(file_path, algo)
+        content_hash = None
+    
+    return file_path, file_type, True, file_hash, content_hash, file_size
+
+def _head_tail_hash_one(task):
+    """计算单个文件的头尾哈希，定义在模块级别以便在子进程中执行"""
+    file_path, file_size, algo = task
+    return calculate_head_tail_hash(file_path, file_size, algo)
+
+def find_known_hashes(files, cached=None, workers=None, algo=DEFAULT_FILE_HASH_ALGORITHM):
+    """
+    两级预筛选：先按 (类型, 大小) 分组，大小唯一的文件不可能与其他文件字节相同；
+    大小相同的较大文件再比较开头和末尾的字节，头尾哈希唯一的同样不可能重复
+    files 为 [(path, file_type, size, file_id)]，返回与之对齐的列表，无法排除的文件为 None（需要计算完整哈希）
+    这些文件使用唯一的占位键代替文件哈希，后续分组逻辑不变
+    cached 为 file_id -> (file_hash, content_hash)，所有文件均已缓存文件哈希的分组无需计算头尾哈希
+    """
+    cached = cached or {}
+    size_counts = Counter((file_type, size) for _, file_type, size, _ in files)
+    known = [f"SZ:{size}" if size_counts[(file_type, size)] == 1 else None
+             for _, file_type, size, _ in files]
+    pending_groups = {(file_type, size) for _, file_type, size, file_id in files
+                      if cached.get(file_id, (None, None))[0] is None}
+    
+    # 不超过两倍 HEAD_TAIL_SIZE 的文件读取头尾就等于读取整个文件，直接计算完整哈希
+    candidates = [i for i, (_, file_type, size, _) in enumerate(files)
+                  if known[i] is None and size > 2 * HEAD_TAIL_SIZE and (file_type, size) in pending_groups]
+    if not candidates:
+        return known
+    
+    tasks = [(files[i][0], files[i][2], algo) for i in candidates]
+    head_tails = list(parallel_map(_head_tail_hash_one, tasks, workers))
+    head_tail_counts = Counter((files[i][1], files[i][2], head_tail)
+                               for i, head_tail in zip(candidates, head_tails) if head_tail is not None)
+    for i, head_tail in zip(candidates, head_tails):
+        if head_tail is not None and head_tail_counts[(files[i][1], files[i][2], head_tail)] == 1:
+            known[i] = f"HT:{files[i][2]}:{head_tail}"
+    return known
+
+def parallel_map(func, items, workers=None):
+    """
+    使用进程池并行执行 func，按输入顺序返回结果
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(items) <= 1:
+        yield from map(func, items)
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        yield from executor.map(func, items, chunksize=64)
+
+def open_cache(cache_path=DEFAULT_CACHE_PATH):
+    """
+    打开哈希缓存数据库，多次运行时未变化的文件无需重新计算哈希
+    """
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    conn = sqlite3.connect(cache_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS hashes (
+            dev INTEGER,
+            ino INTEGER,
+            mtime_ns INTEGER,
+            size INTEGER,
+            file_hash TEXT,
+            content_hash TEXT,
+            algo TEXT,
+            PRIMARY KEY (dev, ino)
+        )
+    ''')
+    conn.commit()
+    return conn
+
+def load_cached_hashes(cache, files, algo=DEFAULT_FILE_HASH_ALGORITHM):
+    """
+    查询文件的缓存哈希，返回 file_id -> (file_hash, content_hash)，字段可能为空
+    """
+    cached = {}
+    if cache is None:
+        return cached
+    for _, _, file_size, file_id in files:
+        if file_id is None:
+            continue
+        row = cache.execute(CACHE_SELECT_SQL, file_id + (file_size, f"{algo}+{CONTENT_HASH_ALGORITHM}")).fetchone()
+        if row:
+            cached[file_id] = row
+    return cached
+
+def _needs_full_read(task):
+    """判断哈希任务是否需要读取文件全部内容（计算文件哈希或解码图片）"""
+    _, file_type, _, use_content_hash, _, known_hash = task
+    return known_hash is None or (file_type == 'image' and use_content_hash)
+
+def hash_files_cached(files, known_hashes, cached, cache=None, use_content_hash=True, workers=None, algo=DEFAULT_FILE_HASH_ALGORITHM):
+    """
+    验证并计算文件哈希，按输入顺序返回 (path, file_type, is_valid, file_hash, content_hash, file_size)
+    缓存中哈希齐全的文件直接使用缓存结果，其余文件多进程并行计算，并将结果批量写回缓存
+    """
+    hits = {}
+    tasks = []
+    for i, (file_path, file_type, file_size, file_id) in enumerate(files):
+        file_hash, content_hash = cached.get(file_id, (None, None))
+        file_hash = file_hash or known_hashes[i]
+        # 缓存中缺少本次需要的哈希（如上次为快速模式）时，只计算缺少的部分
+        if file_id in cached and file_hash and (content_hash or file_type != 'image' or not use_content_hash):
+            hits[i] = (file_path, file_type, True, file_hash, content_hash, file_size)
+        else:
+            tasks.append((file_path, file_type, file_size, use_content_hash, algo, file_hash))
+    
+    # 进程池按块分配任务，同一块内之后的文件通常由同一进程处理；不需要读取全部内容的文件无需预读
+    can_prefetch = hasattr(os, 'posix_fadvise')
+    tasks = [task + ((tasks[i + PREFETCH_DISTANCE][0]
+                      if can_prefetch and i + PREFETCH_DISTANCE < len(tasks)
+                      and _needs_full_read(tasks[i + PREFETCH_DISTANCE]) else None),)
+             for i, task in enumerate(tasks)]
+    computed = parallel_map(_hash_one, tasks, workers)
+    batch = []
+    for i, (file_path, file_type, file_size, file_id) in enumerate(files):
+        if i in hits:
+            yield hits[i]
+            continue
+        
+        result = next(computed)
+        is_valid, file_hash, content_hash = result[2:5]
+        # 无效文件不写入缓存；占位键与本次扫描相关，不写入缓存；保留缓存中已有的内容哈希
+        if cache is not None and file_id is not None and is_valid and file_hash is not None:
+            batch.append(file_id + (file_size,
+                                    None if file_hash.startswith(('SZ:', 'HT:')) else file_hash,
+                                    content_hash or cached.get(file_id, (None, None))[1], f"{algo}+{CONTENT_HASH_ALGORITHM}"))
+            if len(batch) >= CACHE_BATCH_SIZE:
+                with cache:
+                    cache.executemany(CACHE_UPSERT_SQL, batch)
+                batch.clear()
+        yield result
+    computed.close()
+    
+    if batch:
+        with cache:
+            cache.executemany(CACHE_UPSERT_SQL, batch)
+
+class FileTable:
+    """
+    按列存储同一类型文件的信息（结构数组），每个文件以整数编号索引
+    相比每个文件一个字典，大量文件时显著减少Python对象的内存开销
+    """
+    __slots__ = ('paths', 'sizes', 'hashes', 'content_hashes', 'is_target')
+    
+    def __init__(self):
+        self.paths = []
+        self.sizes = array('q')
+        self.hashes = []
+        self.content_hashes = []
+        self.is_target = bytearray()
+    
+    def __len__(self):
+        return len(self.paths)
+    
+    def add(self, path, size, file_hash, content_hash, is_target):
+        """添加一个文件，返回其编号"""
+        self.paths.append(path)
+        self.sizes.append(size)
+        self.hashes.append(file_hash)
+        self.content_hashes.append(content_hash)
+        self.is_target.append(is_target)
+        return len(self.paths) - 1
+    
+    def ordered_ids(self):
+        """
+        按文件名分组的顺序返回文件编号：同名文件相邻，各文件名按首次出现的顺序排列，同名文件内保持扫描顺序
+        """
+        first_seen = {}
+        keys = [first_seen.setdefault(os.path.basename(path), i) for i, path in enumerate(self.paths)]
+        return sorted(range(len(self.paths)), key=keys.__getitem__)
+
+def process_media_files(source_dir, target_dir, use_content_hash=True, workers=None, algo=DEFAULT_FILE_HASH_ALGORITHM, cache=None):
     """
     处理媒体文件：找出所有文件，按类型分类存储，去重，并保留最大的文件
+    workers 为并行计算哈希的进程数；algo 为文件哈希算法；cache 为哈希缓存数据库连接
     """
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
         logger.info(f"创建目标目录: {target_dir}")
 
-    # 收集所有文件信息，按类型分组
+    # 收集所有文件信息，按类型分表存储（其他类型的文件不会被处理，扫描时直接跳过）
     all_files = {
-        'image': {},  # filename -> [{'path': str, 'size': int, 'hash': str, 'content_hash': str}]
-        'video': {},
-        'archive': {},
-        'other': {}
+        'image': FileTable(),
+        'video': FileTable(),
+        'archive': FileTable()
     }
     
     # 扫描目标目录（包括子目录）
     logger.info(f"正在扫描目标目录: {target_dir}")
-    target_counts = {'image': 0, 'video': 0, 'archive': 0, 'other': 0}
-    
-    for root, dirs, files in os.walk(target_dir):
-        # 跳过系统目录
-        dirs[:] = [d for d in dirs if not should_skip_directory(os.path.join(root, d))]
-        
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            file_type = get_file_type(file_path)
-            
-            # 验证图片文件
-            if file_type == 'image' and not is_image_file(file_path):
-                continue
-                
-            target_counts[file_type] += 1
-            file_size = os.path.getsize(file_path)
-            
-            if file_type == 'image':
-                file_hash, content_hash = calculate_image_hash(file_path)
-            else:
-                file_hash = calculate_file_hash(file_path)
-                content_hash = None
-            
-            base_filename = os.path.basename(filename)
-            if base_filename not in all_files[file_type]:
-                all_files[file_type][base_filename] = []
-            
-            all_files[file_type][base_filename].append({
-                'path': file_path,
-                'size': file_size,
-                'hash': file_hash,
-                'content_hash': content_hash,
-                'is_target': True,
-                'file_type': file_type
-            })
-    
-    logger.info(f"目标目录中找到: 图片 {target_counts['image']} 张, 视频 {target_counts['video']} 个, 压缩文件 {target_counts['archive']} 个, 其他 {target_counts['other']} 个")
+    target_counts = {'image': 0, 'video': 0, 'archive': 0}
+    target_files = collect_files(target_dir, media_only=True)  # [(path, file_type, size, file_id)]
 
     # 扫描源目录
     logger.info(f"正在扫描源目录: {source_dir}")
-    source_counts = {'image': 0, 'video': 0, 'archive': 0, 'other': 0}
+    source_counts = {'image': 0, 'video': 0, 'archive': 0}
     processed_files = 0
-    total_files = 0
     
-    # 先统计总文件数以便显示进度
-    logger.info("正在统计源目录中的文件数量...")
-    for root, dirs, files in os.walk(source_dir):
-        dirs[:] = [d for d in dirs if not should_skip_directory(os.path.join(root, d))]
-        for filename in files:
-            file_type = get_file_type(os.path.join(root, filename))
-            if file_type in ['image', 'video', 'archive']:
-                total_files += 1
+    # 一次遍历收集待处理的文件（只处理图片、视频和压缩文件），总文件数即列表长度，无需单独统计
+    source_files = collect_files(source_dir, media_only=True)  # [(path, file_type, size, file_id)]
     
+    total_files = len(source_files)
     logger.info(f"源目录中共有 {total_files} 个可处理的文件")
     
-    # 扫描源目录
-    for root, dirs, files in os.walk(source_dir):
-        # 跳过系统目录
-        dirs[:] = [d for d in dirs if not should_skip_directory(os.path.join(root, d))]
+    # 按大小和头尾字节预筛选，只有可能重复的文件才需要读取全部内容计算文件哈希
+    cached = load_cached_hashes(cache, target_files + source_files, algo)
+    if cache is not None:
+        logger.info(f"哈希缓存中找到 {len(cached)}/{len(target_files) + len(source_files)} 个文件")
+    known_hashes = find_known_hashes(target_files + source_files, cached, workers, algo)
+    logger.info(f"大小或头尾唯一、无需计算完整文件哈希的文件: {sum(h is not None for h in known_hashes)}/{len(known_hashes)}")
+    
+    # 多进程并行计算哈希，结果按扫描顺序返回
+    for file_path, file_type, is_valid, file_hash, content_hash, file_size in hash_files_cached(
+            target_files, known_hashes, cached, cache, use_content_hash, workers, algo):
+        if not is_valid:
+            continue
+            
+        target_counts[file_type] += 1
+        all_files[file_type].add(file_path, file_size, file_hash, content_hash, True)
+    
+    logger.info(f"目标目录中找到: 图片 {target_counts['image']} 张, 视频 {target_counts['video']} 个, 压缩文件 {target_counts['archive']} 个")
+    
+    # 多进程并行计算哈希，结果按扫描顺序返回
+    start_time = time.monotonic()
+    for file_path, file_type, is_valid, file_hash, content_hash, file_size in hash_files_cached(
+            source_files, known_hashes[len(target_files):], cached, cache, use_content_hash, workers, algo):
+        processed_files += 1
+        
+        # 显示进度和处理速度
+        if processed_files % 100 == 0 or processed_files == total_files:
+            elapsed = max(time.monotonic() - start_time, 1e-6)
+            logger.info(f"正在处理: {processed_files}/{total_files} ({processed_files/total_files*100:.1f}%, {processed_files/elapsed:.0f} files/s)")
         
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            file_type = get_file_type(file_path)
+        if not is_valid:
+            logger.debug(f"跳过非有效图片文件: {file_path}")
+            continue
             
-            # 只处理图片、视频和压缩文件
-            if file_type in ['image', 'video', 'archive']:
-                processed_files += 1
-                
-                # 显示进度
-                if processed_files % 100 == 0 or processed_files == total_files:
-                    logger.info(f"正在处理: {processed_files}/{total_files} ({processed_files/total_files*100:.1f}%)")
-                
-                # 验证图片文件
-                if file_type == 'image' and not is_image_file(file_path):
-                    logger.debug(f"跳过非有效图片文件: {file_path}")
-                    continue
-                    
-                source_counts[file_type] += 1
-                
-                if file_type == 'image':
-                    file_hash, content_hash = calculate_image_hash(file_path)
-                else:
-                    file_hash = calculate_file_hash(file_path)
-                    content_hash = None
-                    
-                if file_hash is None:  # 如果计算哈希失败，跳过该文件
-                    logger.warning(f"跳过无法处理的文件: {file_path}")
-                    continue
-                        
-                file_size = os.path.getsize(file_path)
-                
-                base_filename = os.path.basename(filename)
-                if base_filename not in all_files[file_type]:
-                    all_files[file_type][base_filename] = []
-                
-                all_files[file_type][base_filename].append({
-                    'path': file_path,
-                    'size': file_size,
-                    'hash': file_hash,
-                    'content_hash': content_hash,
-                    'is_target': False,
-                    'file_type': file_type
-                })
+        source_counts[file_type] += 1
+            
+        if file_hash is None:  # 如果计算哈希失败，跳过该文件
+            logger.warning(f"跳过无法处理的文件: {file_path}")
+            continue
+        
+        all_files[file_type].add(file_path, file_size, file_hash, content_hash, False)
     
     logger.info(f"源目录中找到: 图片 {source_counts['image']} 张, 视频 {source_counts['video']} 个, 压缩文件 {source_counts['archive']} 个")
     
@@ -255,7 +756,8 @@ def process_media_files(source_dir, target_dir, use_content_hash=True):
     total_deleted = 0
     
     for file_type in ['image', 'video', 'archive']:
-        if not all_files[file_type]:
+        table = all_files[file_type]
+        if not table:
             continue
             
         logger.info(f"\n开始处理 {file_type} 文件...")
@@ -263,131 +765,139 @@ def process_media_files(source_dir, target_dir, use_content_hash=True):
         # 确保目标目录存在
         type_target_dir = get_target_directory(target_dir, file_type)
         ensure_directory_exists(type_target_dir)
+        # 目标目录中已有的文件名，用于解决复制时的文件名冲突
+        existing_names = set(os.listdir(type_target_dir))
         
         # 按哈希值分组处理重复项
-        hash_groups = {}  # hash -> [file_info, ...]
+        hash_groups = {}  # hash -> [file_id, ...]
+        paths = table.paths
+        sizes = table.sizes
+        is_target = table.is_target
         
         # 将所有文件按哈希值分组
-        for filename, file_list in all_files[file_type].items():
-            for file_info in file_list:
-                # 使用文件哈希作为主要去重依据
-                primary_hash = file_info['hash']
-                if primary_hash:
-                    if primary_hash not in hash_groups:
-                        hash_groups[primary_hash] = []
-                    hash_groups[primary_hash].append(file_info)
-                
-                # 如果是图片且启用内容哈希且与文件哈希不同，也加入分组
-                if (file_type == 'image' and use_content_hash and 
-                    file_info['content_hash'] and file_info['content_hash'] != primary_hash):
-                    content_hash = file_info['content_hash']
-                    if content_hash not in hash_groups:
-                        hash_groups[content_hash] = []
-                    hash_groups[content_hash].append(file_info)
+        for file_id in table.ordered_ids():
+            # 使用文件哈希作为主要去重依据
+            primary_hash = table.hashes[file_id]
+            if primary_hash:
+                hash_groups.setdefault(primary_hash, []).append(file_id)
+            
+            # 如果是图片且启用内容哈希且与文件哈希不同，也加入分组
+            content_hash = table.content_hashes[file_id]
+            if (file_type == 'image' and use_content_hash and 
+                content_hash and content_hash != primary_hash):
+                hash_groups.setdefault(content_hash, []).append(file_id)
         
-        # 处理每个哈希组
+        # 处理每个哈希组：先规划删除和复制操作，再批量执行
         copied_count = 0
         skipped_count = 0
         replaced_count = 0
         deleted_count = 0
         processed_files_set = set()  # 避免重复处理同一个文件
+        to_delete = []  # [(path, size)]
+        to_copy = []  # [(src, target_path, size, is_unique)]
         
-        for hash_value, file_list in hash_groups.items():
-            # 去除重复的文件引用（同一文件可能被文件哈希和内容哈希都引用）
-            unique_files = []
+        for hash_value, file_ids in hash_groups.items():
+            if len(file_ids) == 1:
+                # 没有重复文件（绝大多数哈希组），无需去重和比较大小
+                file_id = file_ids[0]
+                file_path = paths[file_id]
+                if not is_target[file_id] and file_path not in processed_files_set:
+                    # 源目录中的唯一文件，复制到目标目录（处理文件名冲突）
+                    target_path = reserve_target_path(file_path, type_target_dir, existing_names)
+                    to_copy.append((file_path, target_path, sizes[file_id], True))
+                    processed_files_set.add(file_path)
+                continue
+            
+            # 一次遍历完成：去除重复的文件引用（同一文件可能被文件哈希和内容哈希都引用）、
+            # 找出最大的文件（大小相同时取先出现的），并按所在目录拆分
             seen_paths = set()
-            for file_info in file_list:
-                if file_info['path'] not in seen_paths:
-                    unique_files.append(file_info)
-                    seen_paths.add(file_info['path'])
+            target_ids = []
+            source_ids = []
+            largest_id = file_ids[0]
+            largest_size = -1
+            for file_id in file_ids:
+                file_path = paths[file_id]
+                if file_path in seen_paths:
+                    continue
+                seen_paths.add(file_path)
+                if sizes[file_id] > largest_size:
+                    largest_id = file_id
+                    largest_size = sizes[file_id]
+                if is_target[file_id]:
+                    target_ids.append(file_id)
+                else:
+                    source_ids.append(file_id)
             
-            if len(unique_files) <= 1:
-                # 没有重复文件
-                if len(unique_files) == 1:
-                    file_info = unique_files[0]
-                    if not file_info['is_target'] and file_info['path'] not in processed_files_set:
-                        # 源目录中的唯一文件，复制到目标目录
-                        target_path = os.path.join(type_target_dir, os.path.basename(file_info['path']))
-                        
-                        # 处理文件名冲突
-                        counter = 1
-                        while os.path.exists(target_path):
-                            name, ext = os.path.splitext(os.path.basename(file_info['path']))
-                            target_path = os.path.join(type_target_dir, f"{name}_{counter}{ext}")
-                            counter += 1
-                        
-                        try:
-                            shutil.copy2(file_info['path'], target_path)
-                            logger.info(f"复制唯一文件: {file_info['path']} -> {target_path}")
-                            copied_count += 1
-                            processed_files_set.add(file_info['path'])
-                        except Exception as e:
-                            logger.error(f"复制文件失败: {file_info['path']}, 错误: {e}")
+            if len(seen_paths) == 1:
+                # 去重后没有重复文件
+                file_id = largest_id
+                file_path = paths[file_id]
+                if not is_target[file_id] and file_path not in processed_files_set:
+                    target_path = reserve_target_path(file_path, type_target_dir, existing_names)
+                    to_copy.append((file_path, target_path, sizes[file_id], True))
+                    processed_files_set.add(file_path)
             else:
-                # 有重复文件，选择最大的
-                largest_file = max(unique_files, key=lambda x: x['size'])
+                # 有重复文件，保留最大的
+                largest_path = paths[largest_id]
                 
-                # 检查最大文件是否已经在目标目录中
-                target_files = [f for f in unique_files if f['is_target']]
-                source_files = [f for f in unique_files if not f['is_target']]
-                
-                if largest_file['is_target']:
+                if is_target[largest_id]:
                     # 最大文件已在目标目录中
                     # 删除目标目录中其他较小的重复文件
-                    for file_info in target_files:
-                        if file_info != largest_file and file_info['path'] not in processed_files_set:
-                            try:
-                                os.remove(file_info['path'])
-                                logger.info(f"删除较小的重复文件: {file_info['path']} ({file_info['size']} bytes)")
-                                deleted_count += 1
-                                processed_files_set.add(file_info['path'])
-                            except Exception as e:
-                                logger.error(f"删除文件失败: {file_info['path']}, 错误: {e}")
+                    for file_id in target_ids:
+                        file_path = paths[file_id]
+                        if file_path != largest_path and file_path not in processed_files_set:
+                            release_target_name(file_path, type_target_dir, existing_names)
+                            to_delete.append((file_path, sizes[file_id]))
+                            processed_files_set.add(file_path)
                     
                     # 跳过源目录中的重复文件
-                    for file_info in source_files:
-                        if file_info['path'] not in processed_files_set:
-                            logger.debug(f"跳过重复文件: {file_info['path']} ({file_info['size']} bytes)")
+                    for file_id in source_ids:
+                        file_path = paths[file_id]
+                        if file_path not in processed_files_set:
+                            logger.debug(f"跳过重复文件: {file_path} ({sizes[file_id]} bytes)")
                             skipped_count += 1
-                            processed_files_set.add(file_info['path'])
+                            processed_files_set.add(file_path)
                 else:
                     # 最大文件在源目录中，需要复制并替换
                     # 删除目标目录中的所有重复文件
-                    for file_info in target_files:
-                        if file_info['path'] not in processed_files_set:
-                            try:
-                                os.remove(file_info['path'])
-                                logger.info(f"删除较小的重复文件: {file_info['path']} ({file_info['size']} bytes)")
-                                deleted_count += 1
-                                processed_files_set.add(file_info['path'])
-                            except Exception as e:
-                                logger.error(f"删除文件失败: {file_info['path']}, 错误: {e}")
+                    for file_id in target_ids:
+                        file_path = paths[file_id]
+                        if file_path not in processed_files_set:
+                            release_target_name(file_path, type_target_dir, existing_names)
+                            to_delete.append((file_path, sizes[file_id]))
+                            processed_files_set.add(file_path)
                     
-                    # 复制最大的文件
-                    if largest_file['path'] not in processed_files_set:
-                        target_path = os.path.join(type_target_dir, os.path.basename(largest_file['path']))
-                        
-                        # 处理文件名冲突
-                        counter = 1
-                        while os.path.exists(target_path):
-                            name, ext = os.path.splitext(os.path.basename(largest_file['path']))
-                            target_path = os.path.join(type_target_dir, f"{name}_{counter}{ext}")
-                            counter += 1
-                        
-                        try:
-                            shutil.copy2(largest_file['path'], target_path)
-                            logger.info(f"复制最大文件: {largest_file['path']} ({largest_file['size']} bytes) -> {target_path}")
-                            replaced_count += 1
-                            processed_files_set.add(largest_file['path'])
-                        except Exception as e:
-                            logger.error(f"复制文件失败: {largest_file['path']}, 错误: {e}")
+                    # 复制最大的文件（处理文件名冲突）
+                    if largest_path not in processed_files_set:
+                        target_path = reserve_target_path(largest_path, type_target_dir, existing_names)
+                        to_copy.append((largest_path, target_path, sizes[largest_id], False))
+                        processed_files_set.add(largest_path)
                     
                     # 跳过源目录中其他较小的重复文件
-                    for file_info in source_files:
-                        if file_info != largest_file and file_info['path'] not in processed_files_set:
-                            logger.debug(f"跳过较小的重复文件: {file_info['path']} ({file_info['size']} bytes)")
+                    for file_id in source_ids:
+                        file_path = paths[file_id]
+                        if file_path != largest_path and file_path not in processed_files_set:
+                            logger.debug(f"跳过较小的重复文件: {file_path} ({sizes[file_id]} bytes)")
                             skipped_count += 1
-                            processed_files_set.add(file_info['path'])
+                            processed_files_set.add(file_path)
+        
+        # 批量执行删除和复制，按规划顺序记录结果
+        delete_results, copy_results = run_file_operations(to_delete, to_copy, type_target_dir, existing_names)
+        for (file_path, file_size), error in zip(to_delete, delete_results):
+            if error is None:
+                logger.info(f"删除较小的重复文件: {file_path} ({file_size} bytes)")
+                deleted_count += 1
+            else:
+                logger.error(f"删除文件失败: {file_path}, 错误: {error}")
+        for (src, _, file_size, is_unique), (target_path, error) in zip(to_copy, copy_results):
+            if error is not None:
+                logger.error(f"复制文件失败: {src}, 错误: {error}")
+            elif is_unique:
+                logger.info(f"复制唯一文件: {src} -> {target_path}")
+                copied_count += 1
+            else:
+                logger.info(f"复制最大文件: {src} ({file_size} bytes) -> {target_path}")
+                replaced_count += 1
         
         logger.info(f"{file_type} 处理完成! 源目录: {source_counts[file_type]} 个, 复制: {copied_count}, 替换: {replaced_count}, 跳过: {skipped_count}, 删除重复: {deleted_count}")
         
@@ -403,13 +913,23 @@ def main():
     parser.add_argument('--source', '-s', required=True, nargs='+', help='源文件目录（可指定多个）')
     parser.add_argument('--target', '-t', required=True, nargs='+', help='目标文件目录（可指定多个）')
     parser.add_argument('--fast', action='store_true', help='使用快速模式（仅文件哈希，不检测图片内容相似性）')
+    parser.add_argument('--workers', type=int, default=None, help='并行计算哈希的进程数（默认：CPU核心数）')
+    parser.add_argument('--algo', choices=FILE_HASH_ALGORITHMS, default=DEFAULT_FILE_HASH_ALGORITHM,
+                        help=f'文件哈希算法（默认：{DEFAULT_FILE_HASH_ALGORITHM}，blake3需安装blake3，xxh3需安装xxhash）')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help=f'哈希缓存数据库路径（默认：{DEFAULT_CACHE_PATH}）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用哈希缓存，每次重新计算所有文件')
     
     args = parser.parse_args()
     
+    if not is_hash_algorithm_available(args.algo):
+        logger.error(f"文件哈希算法 {args.algo} 所需的库未安装")
+        return 1
+    
     logger.info("=== 媒体文件去重和整理工具启动 ===")
     logger.info(f"源目录: {', '.join(args.source)}")
     logger.info(f"目标目录: {', '.join(args.target)}")
     logger.info(f"模式: {'快速模式' if args.fast else '精确模式(包含图片内容比较)'}")
+    logger.info(f"文件哈希算法: {args.algo}")
     logger.info("文件分类规则:")
     logger.info("- 图片文件: 保存在主目录")
     logger.info("- 视频文件: 保存在 mp4/ 子目录")
@@ -430,6 +950,7 @@ def main():
     total_copied = 0
     total_skipped = 0
     total_deleted = 0
+    cache = None if args.no_cache else open_cache(args.cache)
     
     for i, source_dir in enumerate(args.source):
         # 确定对应的目标目录
@@ -439,11 +960,14 @@ def main():
             target_dir = args.target[i]
         
         logger.info(f"\n处理第 {i+1}/{len(args.source)} 个任务: {source_dir} -> {target_dir}")
-        copied, skipped, deleted = process_media_files(source_dir, target_dir, not args.fast)
+        copied, skipped, deleted = process_media_files(source_dir, target_dir, not args.fast, args.workers, args.algo, cache)
         total_copied += copied
         total_skipped += skipped
         total_deleted += deleted
     
+    if cache is not None:
+        cache.close()
+    
     logger.info("=== 媒体文件去重和整理工具完成 ===")
     logger.info(f"总计处理了 {total_copied} 个文件")
     logger.info(f"总计跳过了 {total_skipped} 个重复文件")
@@ -452,4 +976,8 @@ def main():
     return 0
 
 if __name__ == "__main__":
-    sys.exit(main())
+    start_log_listener()
+    try:
+        sys.exit(main())
+    finally:
+        stop_log_listener()
@@ -8,10 +8,56 @@ import shutil
 import argparse
 import sqlite3
 import gc
+import threading
+import time
+import mmap
+import errno
+from array import array
+from contextlib import nullcontext
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from PIL import Image
 import logging
 
+# fcntl仅在类Unix系统上可用，用于reflink复制
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# macOS的clonefile(2)：在APFS上以写时复制方式克隆文件
+_clonefile = None
+if sys.platform == 'darwin':
+    try:
+        import ctypes
+        _clonefile = ctypes.CDLL(None, use_errno=True).clonefile
+        _clonefile.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint32)
+    except (OSError, AttributeError):
+        _clonefile = None
+
+# NumPy为可选依赖，用于向量化计算图片平均哈希
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Numba为可选依赖，用于将平均哈希内核编译为本地代码
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -23,9 +69,159 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 各类文件的扩展名，模块加载时构建一次
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'})
+VIDEO_EXTENSIONS = frozenset({'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg'})
+# 只比较最后一段扩展名，.tar.gz/.tar.bz2/.tar.xz 分别按 .gz/.bz2/.xz 识别
+ARCHIVE_EXTENSIONS = frozenset({'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz'})
+# 扩展名到文件类型的映射，一次字典查找即可完成分类
+EXTENSION_TYPES = {
+    **dict.fromkeys(IMAGE_EXTENSIONS, 'image'),
+    **dict.fromkeys(VIDEO_EXTENSIONS, 'video'),
+    **dict.fromkeys(ARCHIVE_EXTENSIONS, 'archive'),
+}
+
+# 打开图片时只尝试这些格式（与IMAGE_EXTENSIONS对应），不必逐个探测Pillow支持的所有格式
+# 多图JPEG（MPO）由JPEG插件识别；Pillow本身不能解码HEIC/HEIF，这类文件与之前一样视为无效图片
+IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'BMP', 'TIFF', 'WEBP')
+
+# 遍历时跳过的系统目录（以点开头的目录另外跳过）；mp4和zip为分类保存视频和压缩文件的子目录
+SKIP_DIRECTORIES = frozenset({'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail', 'mp4', 'zip'})
+
+# 文件哈希仅用作去重键，不需要密码学强度：优先使用BLAKE3（SIMD加速），其次xxh3_128，最后回退到MD5
+FILE_HASH_ALGORITHMS = ('blake3', 'xxh3', 'md5')
+DEFAULT_FILE_HASH_ALGORITHM = 'blake3' if blake3 is not None else ('xxh3' if xxhash is not None else 'md5')
+
+# 计算文件哈希时每次读入的字节数；超过 HASH_MMAP_THRESHOLD 的文件改为内存映射后整体计算
+HASH_CHUNK_SIZE = 1 << 20
+HASH_MMAP_THRESHOLD = 64 << 20
+
+# 每个线程复用同一块读取缓冲区，避免每个文件重新分配
+_read_buffer = threading.local()
+
+# Linux的FICLONE ioctl：在btrfs/XFS等文件系统上以写时复制方式克隆文件
+FICLONE = 0x40049409
+
+# 用户空间复制（克隆和内核复制均不可用时）的缓冲区大小
+COPY_BUFFER_SIZE = 4 << 20
+
+# 每个工作进程任务计算文件哈希的文件数；同样数量的图片缩略图一次向量化计算平均哈希
+HASH_BATCH_SIZE = 64
+
+# 每批写入数据库的行数（扫描结果插入和已处理标记更新）
+DB_BATCH_SIZE = 10000
+# 扫描和计算哈希时各在一个事务中写入，每写入这么多行提交一次以限制WAL文件大小
+DB_COMMIT_ROWS = 50000
+
+# 文件信息表的索引 (名称, 列)，数据全部写入后统一创建
+DB_INDEXES = (
+    ('idx_file_hash', 'file_hash'),
+    ('idx_content_hash', 'content_hash'),
+    ('idx_filename', 'filename'),
+    ('idx_file_type', 'file_type'),
+    # 按类型和哈希值有序扫描重复文件组
+    ('idx_dup', 'file_type, file_hash, size DESC, is_target DESC'),
+)
+
+def is_hash_algorithm_available(algo):
+    """判断文件哈希算法所需的库是否已安装"""
+    if algo == 'blake3':
+        return blake3 is not None
+    if algo == 'xxh3':
+        return xxhash is not None
+    return algo == 'md5'
+
+def _new_file_hasher(algo):
+    """创建文件哈希对象"""
+    if algo == 'blake3':
+        return blake3()
+    if algo == 'xxh3':
+        return xxhash.xxh3_128()
+    return hashlib.md5()
+
+if njit is not None and np is not None:
+    @njit(cache=True)
+    def _ahash_kernel(thumbnails):
+        """
+        批量计算平均哈希，thumbnails 为 (N, 64) 的uint8数组，返回 N 个64位整数
+        像素与平均值的比较改为整数比较 pixel * 64 >= 总和，结果与浮点比较完全相同；
+        不使用 parallel=True，各工作进程已占满所有CPU核心
+        """
+        count, pixel_count = thumbnails.shape
+        out = np.empty(count, np.uint64)
+        one = np.uint64(1)
+        for i in range(count):
+            total = 0
+            for k in range(pixel_count):
+                total += thumbnails[i, k]
+            bits = np.uint64(0)
+            for k in range(pixel_count):
+                bits = bits << one
+                if thumbnails[i, k] * pixel_count >= total:
+                    bits = bits | one
+            out[i] = bits
+        return out
+else:
+    _ahash_kernel = None
+
+def _copy_in_kernel(fsrc, fdst):
+    """
+    在内核中复制文件内容：优先reflink，其次copy_file_range，均不支持时返回False
+    """
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError:
+            pass
+    
+    if hasattr(os, 'copy_file_range'):
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                if copied == 0:
+                    # 部分文件系统（网络、FUSE等）不支持时直接返回0，此时内容并未复制完整
+                    break
+                offset += copied
+        except OSError:
+            pass
+        if offset == size:
+            return True
+        # 不支持或未复制完整时丢弃已复制的部分，从头改用普通复制
+        fdst.seek(0)
+        fdst.truncate()
+    return False
+
+def _hash_batch(tasks):
+    """
+    在工作进程中计算一批文件的文件哈希
+    每个 task 为 (路径, 文件哈希算法)，返回与输入对齐的文件哈希列表，无法读取的文件为 None
+    """
+    return [MediaOrganizer.calculate_file_hash(file_path, algo) for file_path, algo in tasks]
+
+def _decode_image(task):
+    """
+    在线程中验证图片：精确模式下解码为8x8灰度缩略图即完成验证，快速模式不需要像素，只解析文件头
+    task 为 (路径, 是否计算内容哈希)，返回 (是否有效, 8x8灰度像素或 None)
+    Pillow解码和缩放时释放GIL，多个线程可以同时解码
+    """
+    file_path, use_content_hash = task
+    if use_content_hash:
+        pixels = MediaOrganizer.load_thumbnail(file_path)
+        if pixels is not None:
+            return True, pixels
+    # 能识别文件头但无法完整解码的图片（如截断的JPEG）仍然有效，只是没有内容哈希，与快速模式的判断一致
+    return MediaOrganizer.is_image_file(file_path), None
+
 class MediaOrganizer:
-    def __init__(self, db_path="media_organizer.db"):
+    def __init__(self, db_path="media_organizer.db", workers=None, algo=DEFAULT_FILE_HASH_ALGORITHM):
         self.db_path = db_path
+        # 并行计算哈希的进程数，默认为CPU核心数
+        self.workers = workers or os.cpu_count() or 1
+        # 文件哈希算法
+        self.algo = algo
         self.init_database()
         
     def init_database(self):
@@ -33,6 +229,13 @@ class MediaOrganizer:
         self.conn = sqlite3.connect(self.db_path)
         cursor = self.conn.cursor()
         
+        # 数据库仅作为本次运行的临时存储：使用WAL并降低同步级别，避免频繁fsync
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-262144')
+        cursor.execute('PRAGMA mmap_size=30000000000')
+        
         # 创建文件信息表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS files (
@@ -48,12 +251,21 @@ class MediaOrganizer:
             )
         ''')
         
-        # 创建索引以提高查询性能
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_hash ON files(file_hash)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_content_hash ON files(content_hash)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_filename ON files(filename)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_type ON files(file_type)')
-        
+        # 索引在扫描和计算哈希完成后再创建（create_indexes），避免写入每一行时都更新索引
+        self.conn.commit()
+
+    def create_indexes(self):
+        """创建索引以提高查询性能"""
+        cursor = self.conn.cursor()
+        for index_name, columns in DB_INDEXES:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON files({columns})')
+        self.conn.commit()
+
+    def drop_indexes(self):
+        """删除索引，批量写入前调用"""
+        cursor = self.conn.cursor()
+        for index_name, _ in DB_INDEXES:
+            cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
         self.conn.commit()
         
     def close_database(self):
@@ -62,50 +274,94 @@ class MediaOrganizer:
             self.conn.close()
             
     def clear_database(self):
-        """清空数据库表"""
+        """清空数据库表，并删除索引以便重新批量写入"""
+        self.drop_indexes()
         cursor = self.conn.cursor()
         cursor.execute('DELETE FROM files')
         self.conn.commit()
         
-    def calculate_file_hash(self, file_path, chunk_size=8192):
+    @staticmethod
+    def calculate_file_hash(file_path, algo=DEFAULT_FILE_HASH_ALGORITHM, chunk_size=HASH_CHUNK_SIZE):
         """
-        计算文件的MD5哈希值，使用流式读取减少内存使用
+        计算文件的哈希值，使用流式读取减少内存使用
+        读入当前线程复用的缓冲区，不为每个文件或分块分配新对象；大文件直接对内存映射计算
+        各算法均输出128位（32个十六进制字符）的摘要
         """
         try:
-            hash_md5 = hashlib.md5()
-            with open(file_path, 'rb') as f:
-                while chunk := f.read(chunk_size):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+            hasher = _new_file_hasher(algo)
+            with open(file_path, 'rb', buffering=0) as f:
+                if os.fstat(f.fileno()).st_size > HASH_MMAP_THRESHOLD:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                        hasher.update(m)
+                else:
+                    buf = getattr(_read_buffer, 'buf', None)
+                    if buf is None or len(buf) != chunk_size:
+                        buf = _read_buffer.buf = bytearray(chunk_size)
+                    mv = memoryview(buf)
+                    while n := f.readinto(buf):
+                        hasher.update(mv[:n])
+            return hasher.hexdigest(16) if algo == 'blake3' else hasher.hexdigest()
         except Exception as e:
             logger.error(f"计算文件哈希失败: {file_path}, 错误: {e}")
             return None
 
-    def calculate_image_hash(self, image_path):
+    @staticmethod
+    def load_thumbnail(image_path):
+        """
+        将图片缩小为8x8灰度图，返回64字节的像素数据；无法解码时返回 None
+        """
+        try:
+            with Image.open(image_path, formats=IMAGE_FORMATS) as img:
+                # JPEG不使用draft()按DCT比例缩小解码：缩小解码或直接解码为灰度的结果与PNG等格式
+                # 完整解码后缩放的结果略有差异，会使同一图片不同格式的内容哈希不一致
+                # 先转为灰度再缩小；缩到8x8时双线性插值与LANCZOS对哈希结果几乎没有区别，但快得多
+                return img.convert('L').resize((8, 8), Image.Resampling.BILINEAR).tobytes()
+        except Exception as e:
+            logger.debug(f"无法计算图片内容哈希: {image_path}, 错误: {e}")
+            return None
+
+    @staticmethod
+    def average_hashes(thumbnails):
+        """
+        批量计算平均哈希：每个8x8灰度图的像素与其平均值比较，得到16位十六进制字符串
+        """
+        if not thumbnails:
+            return []
+        
+        if np is not None:
+            # 整批放入一个 (N, 64) 数组
+            arr = np.frombuffer(b''.join(thumbnails), dtype=np.uint8).reshape(len(thumbnails), 64)
+            if _ahash_kernel is not None:
+                return ['%016x' % int(bits) for bits in _ahash_kernel(arr)]
+            # 向量化比较像素与各自的平均值并打包为每行8字节
+            packed = np.packbits(arr >= arr.mean(axis=1, keepdims=True), axis=1)
+            return [row.tobytes().hex() for row in packed]
+        
+        content_hashes = []
+        for pixels in thumbnails:
+            # 计算像素平均值
+            avg_pixel = sum(pixels) / len(pixels)
+            # 基于平均值逐位生成64位整数，不构造位字符串再转换
+            bits = 0
+            for pixel in pixels:
+                bits = (bits << 1) | (pixel >= avg_pixel)
+            content_hashes.append(f'{bits:016x}')
+        return content_hashes
+
+    @staticmethod
+    def calculate_image_hash(image_path, algo=DEFAULT_FILE_HASH_ALGORITHM):
         """
         计算图片的哈希值，先计算文件哈希，只在需要时计算内容哈希
         """
         try:
             # 文件哈希
-            file_hash = self.calculate_file_hash(image_path)
+            file_hash = MediaOrganizer.calculate_file_hash(image_path, algo)
             if file_hash is None:
                 return None, None
                 
-            # 内容哈希 - 仅在精确模式下计算
-            content_hash = None
-            try:
-                with Image.open(image_path) as img:
-                    # 转换为小缩略图并转为灰度
-                    img = img.resize((8, 8), Image.Resampling.LANCZOS).convert('L')
-                    # 计算像素平均值
-                    pixels = list(img.getdata())
-                    avg_pixel = sum(pixels) / len(pixels)
-                    # 基于平均值生成位序列
-                    bits = ''.join(['1' if pixel >= avg_pixel else '0' for pixel in pixels])
-                    # 将位序列转换为十六进制字符串
-                    content_hash = hex(int(bits, 2))[2:].zfill(16)
-            except Exception as e:
-                logger.debug(f"无法计算图片内容哈希: {image_path}, 错误: {e}")
+            # 内容哈希
+            pixels = MediaOrganizer.load_thumbnail(image_path)
+            content_hash = MediaOrganizer.average_hashes([pixels])[0] if pixels is not None else None
                 
             return file_hash, content_hash
             
@@ -113,43 +369,65 @@ class MediaOrganizer:
             logger.error(f"计算图片哈希失败: {image_path}, 错误: {e}")
             return None, None
 
-    def get_file_type(self, file_path):
+    @staticmethod
+    def get_file_type(file_name):
         """
         判断文件类型：图片、视频、压缩文件或其他
+        file_name 传入文件名（如DirEntry.name）即可，也可以传入完整路径；只对扩展名部分转小写
         """
-        _, ext = os.path.splitext(file_path.lower())
-        
-        image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'}
-        video_extensions = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg'}
-        archive_extensions = {'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz', '.tar.gz', '.tar.bz2', '.tar.xz'}
-        
-        if ext in image_extensions:
-            return 'image'
-        elif ext in video_extensions:
-            return 'video'
-        elif ext in archive_extensions:
-            return 'archive'
-        else:
+        start = file_name.rfind(os.sep) + 1
+        dot = file_name.rfind('.', start)
+        # 与os.path.splitext一致：以点开头的文件名（如 .jpg）视为没有扩展名
+        if dot <= start:
             return 'other'
+        return EXTENSION_TYPES.get(file_name[dot:].lower(), 'other')
 
-    def is_image_file(self, file_path):
+    @staticmethod
+    def is_image_file(file_path):
         """判断文件是否为图片文件"""
-        if self.get_file_type(file_path) != 'image':
+        if MediaOrganizer.get_file_type(file_path) != 'image':
             return False
         
         # 额外验证：尝试打开文件确认是否为有效图片
+        # Image.open只解析文件头，不像verify()那样读取整个文件（之后还需要重新打开才能使用）
         try:
-            with Image.open(file_path) as img:
-                img.verify()  # 验证图片是否损坏
-            return True
+            with Image.open(file_path, formats=IMAGE_FORMATS):
+                return True
         except Exception:
             return False
 
     def should_skip_directory(self, dir_path):
-        """判断是否应该跳过该目录"""
-        skip_dirs = {'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail', 'mp4', 'zip'}
+        """判断是否应该跳过该目录；dir_path 也可以直接传入目录名（如DirEntry.name）"""
         dir_name = os.path.basename(dir_path)
-        return dir_name in skip_dirs or dir_name.startswith('.')
+        return dir_name in SKIP_DIRECTORIES or dir_name.startswith('.')
+
+    def iter_files(self, directory):
+        """
+        使用os.scandir递归遍历目录，返回文件的DirEntry
+        DirEntry自带路径和缓存的类型信息，获取大小时无需再按路径stat
+        与os.walk顺序一致：先返回当前目录的文件，再进入子目录
+        """
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.error(f"无法读取目录: {directory}, 错误: {e}")
+            return
+        
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    # 跳过系统目录
+                    if not self.should_skip_directory(entry.name):
+                        subdirs.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+            except OSError as e:
+                logger.error(f"无法访问: {entry.path}, 错误: {e}")
+        
+        for subdir in subdirs:
+            yield from self.iter_files(subdir)
 
     def get_target_directory(self, target_dir, file_type):
         """
@@ -170,83 +448,187 @@ class MediaOrganizer:
             os.makedirs(dir_path)
             logger.info(f"创建目录: {dir_path}")
 
-    def scan_directory(self, directory, is_target=False, use_content_hash=True):
+    def create_hash_pool(self, batch_count):
+        """
+        创建计算文件哈希的进程池，每批文件逐个分发给工作进程；只用一个工作进程或只有一批时返回 None，在当前进程中计算
+        """
+        if self.workers <= 1 or batch_count <= 1:
+            return None
+        return ProcessPoolExecutor(max_workers=self.workers)
+
+    def insert_files(self, cursor, rows):
+        """批量插入文件信息，哈希值在之后计算"""
+        cursor.executemany('''
+            INSERT OR IGNORE INTO files 
+            (path, filename, file_type, size, is_target)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+
+    def update_hashes(self, cursor, rows):
+        """批量写入计算得到的哈希值，rows 为 [(文件哈希, 内容哈希, 文件编号)]"""
+        cursor.executemany('UPDATE files SET file_hash = ?, content_hash = ? WHERE id = ?', rows)
+
+    def delete_files(self, cursor, file_ids):
+        """批量删除无效或无法处理的文件记录"""
+        cursor.executemany('DELETE FROM files WHERE id = ?', ((file_id,) for file_id in file_ids))
+
+    def mark_processed(self, cursor, paths):
+        """批量将文件标记为已处理"""
+        cursor.executemany('UPDATE files SET processed = TRUE WHERE path = ?', ((path,) for path in paths))
+
+    def scan_directory(self, directory, is_target=False):
         """
-        扫描目录并将文件信息存储到数据库
+        扫描目录并将文件信息存储到数据库，只记录路径、类型和大小，哈希值由 hash_files 计算
         """
         logger.info(f"正在扫描{'目标' if is_target else '源'}目录: {directory}")
         
-        # 统计文件数量
+        cursor = self.conn.cursor()
         file_count = 0
-        for root, dirs, files in os.walk(directory):
-            dirs[:] = [d for d in dirs if not self.should_skip_directory(os.path.join(root, d))]
-            for filename in files:
-                file_type = self.get_file_type(os.path.join(root, filename))
-                if file_type in ['image', 'video', 'archive']:
-                    file_count += 1
+        pending = []
+        uncommitted_rows = 0
         
-        logger.info(f"{'目标' if is_target else '源'}目录中共有 {file_count} 个可处理的文件")
+        # 一次遍历写入待处理的文件（只处理图片、视频和压缩文件），整个扫描在一个事务中写入
+        # 不预先遍历统计总数（那样会把目录读取翻倍），进度以已扫描数量和速度显示
+        start_time = time.monotonic()
+        self.conn.execute('BEGIN IMMEDIATE')
+        for entry in self.iter_files(directory):
+            file_type = self.get_file_type(entry.name)
+            if file_type == 'other':
+                continue
+            try:
+                file_size = entry.stat().st_size
+            except OSError as e:
+                logger.error(f"无法获取文件信息: {entry.path}, 错误: {e}")
+                continue
+            
+            file_count += 1
+            if file_count % 1000 == 0:
+                elapsed = time.monotonic() - start_time
+                logger.info(f"已扫描: {file_count} 个文件, {file_count/max(elapsed, 1e-6):.0f} 个/秒, 用时 {elapsed:.1f} 秒")
+            pending.append((entry.path, entry.name, file_type, file_size, is_target))
+            if len(pending) >= DB_BATCH_SIZE:
+                self.insert_files(cursor, pending)
+                uncommitted_rows += len(pending)
+                pending.clear()
+                if uncommitted_rows >= DB_COMMIT_ROWS:
+                    self.conn.commit()
+                    self.conn.execute('BEGIN IMMEDIATE')
+                    uncommitted_rows = 0
         
-        processed_count = 0
+        if pending:
+            self.insert_files(cursor, pending)
+        self.conn.commit()
+        
+        logger.info(f"{'目标' if is_target else '源'}目录中共有 {file_count} 个可处理的文件")
+
+    def hash_files(self, use_content_hash=True):
+        """
+        计算已扫描文件的哈希值
+        只有大小相同的文件才可能重复：同类型中大小唯一的文件不读取内容，以大小作为文件哈希；
+        图片仍需验证（精确模式下同时计算内容哈希），其他大小唯一的文件不需要任何处理
+        """
         cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT f.id, f.path, f.file_type, f.size, s.n FROM files f
+            JOIN (SELECT file_type, size, COUNT(*) AS n FROM files GROUP BY file_type, size) s
+            ON f.file_type = s.file_type AND f.size = s.size
+            WHERE f.file_hash IS NULL
+            ORDER BY f.id
+        ''')
         
-        for root, dirs, files in os.walk(directory):
-            dirs[:] = [d for d in dirs if not self.should_skip_directory(os.path.join(root, d))]
-            
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                file_type = self.get_file_type(file_path)
-                
-                # 只处理图片、视频和压缩文件
-                if file_type not in ['image', 'video', 'archive']:
-                    continue
-                
-                # 验证图片文件
-                if file_type == 'image' and not self.is_image_file(file_path):
+        entries = []  # [(文件编号, 路径, 文件类型, 已知文件哈希)]
+        updates = []  # [(文件哈希, 内容哈希, 文件编号)]
+        size_unique = 0
+        total_files = 0
+        for file_id, file_path, file_type, file_size, same_size_count in cursor.fetchall():
+            total_files += 1
+            known_hash = None
+            if same_size_count == 1:
+                known_hash = f"SZ:{file_size}"
+                size_unique += 1
+                if file_type != 'image':
+                    updates.append((known_hash, None, file_id))
                     continue
-                
+            entries.append((file_id, file_path, file_type, known_hash))
+        
+        logger.info(f"大小唯一、无需计算文件哈希的文件: {size_unique}/{total_files}")
+        
+        # 图片解码在线程池中进行，文件哈希在进程池中计算，两者同时进行、互相掩盖等待时间
+        decode_tasks = [(file_path, use_content_hash) for _, file_path, file_type, _ in entries if file_type == 'image']
+        hash_tasks = [(file_path, self.algo) for _, file_path, _, known_hash in entries if known_hash is None]
+        batches = [hash_tasks[i:i + HASH_BATCH_SIZE] for i in range(0, len(hash_tasks), HASH_BATCH_SIZE)]
+        
+        invalid_ids = []
+        thumbnails = []  # [(文件编号, 文件哈希, 8x8灰度像素)]
+        processed_count = 0
+        file_count = len(entries)
+        
+        # 数据库只在主线程中写入
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.update_hashes(cursor, updates)
+        updates.clear()
+        uncommitted_rows = 0
+        start_time = time.monotonic()
+        hash_pool = self.create_hash_pool(len(batches))
+        with hash_pool or nullcontext(), ThreadPoolExecutor(max_workers=self.workers) as decoder:
+            # 先向进程池提交全部任务：进程池在第一次提交时fork出工作进程，此时解码线程尚未启动。
+            # 在已有其他线程运行的进程中fork，子进程可能继承被这些线程持有的锁而死锁
+            hashed = chain.from_iterable(hash_pool.map(_hash_batch, batches) if hash_pool is not None
+                                         else map(_hash_batch, batches))
+            # 两个结果序列都按 entries 的顺序返回，依次取出即可对应到同一个文件
+            decoded = decoder.map(_decode_image, decode_tasks)
+            for file_id, file_path, file_type, known_hash in entries:
+                is_valid, pixels = next(decoded) if file_type == 'image' else (True, None)
+                file_hash = next(hashed) if known_hash is None else known_hash
                 processed_count += 1
                 
                 # 显示进度
                 if processed_count % 1000 == 0 or processed_count == file_count:
-                    logger.info(f"正在处理: {processed_count}/{file_count} ({processed_count/file_count*100:.1f}%)")
+                    elapsed = time.monotonic() - start_time
+                    logger.info(f"正在处理: {processed_count}/{file_count} ({processed_count/file_count*100:.1f}%), "
+                                f"{processed_count/max(elapsed, 1e-6):.0f} 个/秒, 用时 {elapsed:.1f} 秒")
                     # 强制垃圾回收以释放内存
                     gc.collect()
                 
-                try:
-                    file_size = os.path.getsize(file_path)
-                    
-                    # 计算哈希值
-                    if file_type == 'image' and use_content_hash:
-                        file_hash, content_hash = self.calculate_image_hash(file_path)
-                    else:
-                        file_hash = self.calculate_file_hash(file_path)
-                        content_hash = None
-                    
-                    if file_hash is None:
-                        logger.warning(f"跳过无法处理的文件: {file_path}")
-                        continue
-                    
-                    # 存储到数据库
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO files 
-                        (path, filename, file_type, size, file_hash, content_hash, is_target)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (file_path, os.path.basename(filename), file_type, file_size, 
-                          file_hash, content_hash, is_target))
-                    
-                    # 每1000个文件提交一次，减少内存使用
-                    if processed_count % 1000 == 0:
+                if not is_valid:
+                    # 无效的图片文件
+                    invalid_ids.append(file_id)
+                elif file_hash is None:
+                    logger.warning(f"跳过无法处理的文件: {file_path}")
+                    invalid_ids.append(file_id)
+                elif pixels is not None:
+                    thumbnails.append((file_id, file_hash, pixels))
+                else:
+                    updates.append((file_hash, None, file_id))
+                
+                # 缩略图攒够一批后一次计算平均哈希
+                if len(thumbnails) >= HASH_BATCH_SIZE:
+                    self.add_content_hashes(updates, thumbnails)
+                
+                if len(updates) >= DB_BATCH_SIZE:
+                    self.update_hashes(cursor, updates)
+                    uncommitted_rows += len(updates)
+                    updates.clear()
+                    if uncommitted_rows >= DB_COMMIT_ROWS:
                         self.conn.commit()
-                        
-                except Exception as e:
-                    logger.error(f"处理文件失败: {file_path}, 错误: {e}")
-                    continue
+                        self.conn.execute('BEGIN IMMEDIATE')
+                        uncommitted_rows = 0
         
-        # 最终提交
+        self.add_content_hashes(updates, thumbnails)
+        self.update_hashes(cursor, updates)
+        self.delete_files(cursor, invalid_ids)
         self.conn.commit()
-        
-        # 统计结果
+
+    def add_content_hashes(self, updates, thumbnails):
+        """一次计算一批缩略图的平均哈希，连同文件哈希加入待写入列表，并清空 thumbnails"""
+        content_hashes = self.average_hashes([pixels for _, _, pixels in thumbnails])
+        for (file_id, file_hash, _), content_hash in zip(thumbnails, content_hashes):
+            updates.append((file_hash, content_hash, file_id))
+        thumbnails.clear()
+
+    def log_scan_summary(self, is_target):
+        """统计并输出目录中有效文件的数量"""
+        cursor = self.conn.cursor()
         cursor.execute('''
             SELECT file_type, COUNT(*) FROM files 
             WHERE is_target = ? 
@@ -261,6 +643,63 @@ class MediaOrganizer:
                    f"视频 {type_counts.get('video', 0)} 个, "
                    f"压缩文件 {type_counts.get('archive', 0)} 个")
 
+    @staticmethod
+    def clone_or_copy(src, dst):
+        """
+        复制文件并保留元数据（等同于shutil.copy2），目标文件以独占方式创建，已存在时抛出FileExistsError
+        同一文件系统上优先写时复制克隆（Linux FICLONE、macOS clonefile），为O(1)操作且不占用额外空间；
+        其次copy_file_range在内核中复制，都不支持时回退到普通复制
+        """
+        if _clonefile is not None:
+            if _clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+                return
+            err = ctypes.get_errno()
+            if err == errno.EEXIST:
+                raise FileExistsError(err, os.strerror(err), dst)
+        
+        with open(src, 'rb') as fsrc:
+            fdst = open(dst, 'xb')
+            try:
+                with fdst:
+                    if not _copy_in_kernel(fsrc, fdst):
+                        shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+                shutil.copystat(src, dst)
+            except Exception:
+                # 复制失败时删除已创建的不完整文件
+                try:
+                    os.remove(dst)
+                except OSError:
+                    pass
+                raise
+
+    def copy_to_target(self, src, dir_path, existing_names):
+        """
+        复制文件到目录，重名时自动添加数字后缀，返回实际的目标路径
+        existing_names 为目录中已有文件名的集合，在内存中解决重名；
+        集合与磁盘不一致（如大小写不敏感的文件系统）时由独占创建兜底，改用下一个文件名
+        """
+        filename = os.path.basename(src)
+        name, ext = os.path.splitext(filename)
+        candidate = filename
+        counter = 1
+        while True:
+            while candidate in existing_names:
+                candidate = f"{name}_{counter}{ext}"
+                counter += 1
+            target_path = os.path.join(dir_path, candidate)
+            try:
+                self.clone_or_copy(src, target_path)
+                existing_names.add(candidate)
+                return target_path
+            except FileExistsError:
+                existing_names.add(candidate)
+
+    def remove_target_file(self, file_path, dir_path, existing_names):
+        """删除文件；文件位于 dir_path 中时同时从已有文件名集合中移除，使该文件名可以被重新使用"""
+        os.remove(file_path)
+        if os.path.normpath(os.path.dirname(file_path)) == os.path.normpath(dir_path):
+            existing_names.discard(os.path.basename(file_path))
+
     def process_duplicates(self, target_dir):
         """
         处理重复文件，批量处理以减少内存使用
@@ -278,133 +717,109 @@ class MediaOrganizer:
             
             type_target_dir = self.get_target_directory(target_dir, file_type)
             self.ensure_directory_exists(type_target_dir)
+            # 目标目录中已有的文件名，用于在内存中解决复制时的文件名冲突
+            with os.scandir(type_target_dir) as it:
+                existing_names = {entry.name for entry in it}
             
             copied_count = 0
             skipped_count = 0
             replaced_count = 0
             deleted_count = 0
+            processed_paths = []  # 待标记为已处理的文件，批量更新
             
-            # 获取所有文件哈希值（分批处理）
+            # 一次有序查询取出所有文件，同一哈希值的文件相邻且按大小降序排列
+            # 按列存放（结构数组），避免逐行构造和解包元组
             cursor.execute('''
-                SELECT DISTINCT file_hash FROM files 
+                SELECT file_hash, path, size, is_target FROM files 
                 WHERE file_type = ? AND file_hash IS NOT NULL
+                ORDER BY file_hash, size DESC, is_target DESC, id
             ''', (file_type,))
+            rows = cursor.fetchall()
+            hashes, paths, sizes, is_target = zip(*rows) if rows else ((), (), (), ())
+            del rows
+            sizes = array('q', sizes)
+            is_target = bytes(is_target)
             
-            hash_values = [row[0] for row in cursor.fetchall()]
+            # 各哈希组的起始位置：哈希值与前一个文件不同的位置
+            group_starts = [i for i in range(len(hashes)) if i == 0 or hashes[i] != hashes[i - 1]]
+            group_starts.append(len(hashes))
+            group_count = len(group_starts) - 1
             
-            logger.info(f"处理 {len(hash_values)} 个不同的{file_type}文件哈希组...")
+            logger.info(f"处理 {group_count} 个不同的{file_type}文件哈希组...")
             
-            for i, hash_value in enumerate(hash_values):
-                if i % 1000 == 0:
-                    logger.info(f"处理进度: {i}/{len(hash_values)} ({i/len(hash_values)*100:.1f}%)")
-                    gc.collect()  # 强制垃圾回收
-                
-                # 获取具有相同哈希值的所有文件
-                cursor.execute('''
-                    SELECT path, size, is_target, processed FROM files 
-                    WHERE file_hash = ? AND file_type = ?
-                    ORDER BY size DESC, is_target DESC
-                ''', (hash_value, file_type))
+            # 先规划所有操作，再按顺序执行：('delete', 编号) 或 ('copy', 编号, 是否唯一文件)
+            actions = []
+            for g in range(group_count):
+                if g % 1000 == 0:
+                    logger.info(f"处理进度: {g}/{group_count} ({g/group_count*100:.1f}%)")
                 
-                duplicate_files = cursor.fetchall()
+                start, end = group_starts[g], group_starts[g + 1]
+                if end - start == 1:
+                    # 没有重复文件；源目录中的唯一文件复制到目标目录
+                    if not is_target[start]:
+                        actions.append(('copy', start, True))
+                    continue
                 
-                if len(duplicate_files) <= 1:
-                    # 没有重复文件
-                    if len(duplicate_files) == 1:
-                        path, size, is_target, processed = duplicate_files[0]
-                        if not is_target and not processed:
-                            # 源目录中的唯一文件，复制到目标目录
-                            target_path = os.path.join(type_target_dir, os.path.basename(path))
-                            
-                            # 处理文件名冲突
-                            counter = 1
-                            while os.path.exists(target_path):
-                                name, ext = os.path.splitext(os.path.basename(path))
-                                target_path = os.path.join(type_target_dir, f"{name}_{counter}{ext}")
-                                counter += 1
-                            
-                            try:
-                                shutil.copy2(path, target_path)
-                                logger.info(f"复制唯一文件: {path} -> {target_path}")
-                                copied_count += 1
-                                
-                                # 标记为已处理
-                                cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
-                                
-                            except Exception as e:
-                                logger.error(f"复制文件失败: {path}, 错误: {e}")
+                # 有重复文件，组内第一个文件最大（已按大小降序排列）
+                largest = start
+                if is_target[largest]:
+                    # 最大文件已在目标目录中：删除目标目录中其他较小的重复文件，跳过源目录中的重复文件
+                    for i in range(start + 1, end):
+                        if is_target[i]:
+                            actions.append(('delete', i))
+                    for i in range(start, end):
+                        if not is_target[i]:
+                            logger.debug(f"跳过重复文件: {paths[i]} ({sizes[i]} bytes)")
+                            skipped_count += 1
+                            processed_paths.append(paths[i])
+                    processed_paths.append(paths[largest])
+                else:
+                    # 最大文件在源目录中：删除目标目录中的所有重复文件，复制最大的文件，跳过其他较小的文件
+                    for i in range(start, end):
+                        if is_target[i]:
+                            actions.append(('delete', i))
+                    actions.append(('copy', largest, False))
+                    for i in range(start + 1, end):
+                        if not is_target[i]:
+                            logger.debug(f"跳过较小的重复文件: {paths[i]} ({sizes[i]} bytes)")
+                            skipped_count += 1
+                            processed_paths.append(paths[i])
+            
+            gc.collect()  # 强制垃圾回收
+            
+            for action in actions:
+                i = action[1]
+                path = paths[i]
+                if action[0] == 'delete':
+                    try:
+                        self.remove_target_file(path, type_target_dir, existing_names)
+                        logger.info(f"删除较小的重复文件: {path} ({sizes[i]} bytes)")
+                        deleted_count += 1
+                        processed_paths.append(path)
+                    except Exception as e:
+                        logger.error(f"删除文件失败: {path}, 错误: {e}")
                 else:
-                    # 有重复文件，选择最大的
-                    largest_file = duplicate_files[0]  # 已按大小降序排列
-                    largest_path, largest_size, largest_is_target, largest_processed = largest_file
-                    
-                    if largest_is_target:
-                        # 最大文件已在目标目录中
-                        # 删除目标目录中其他较小的重复文件
-                        for path, size, is_target, processed in duplicate_files[1:]:
-                            if is_target and not processed:
-                                try:
-                                    os.remove(path)
-                                    logger.info(f"删除较小的重复文件: {path} ({size} bytes)")
-                                    deleted_count += 1
-                                    cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
-                                except Exception as e:
-                                    logger.error(f"删除文件失败: {path}, 错误: {e}")
-                        
-                        # 跳过源目录中的重复文件
-                        for path, size, is_target, processed in duplicate_files:
-                            if not is_target and not processed:
-                                logger.debug(f"跳过重复文件: {path} ({size} bytes)")
-                                skipped_count += 1
-                                cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
-                        
-                        # 标记最大文件为已处理
-                        cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (largest_path,))
-                        
-                    else:
-                        # 最大文件在源目录中，需要复制并替换
-                        # 删除目标目录中的所有重复文件
-                        for path, size, is_target, processed in duplicate_files:
-                            if is_target and not processed:
-                                try:
-                                    os.remove(path)
-                                    logger.info(f"删除较小的重复文件: {path} ({size} bytes)")
-                                    deleted_count += 1
-                                    cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
-                                except Exception as e:
-                                    logger.error(f"删除文件失败: {path}, 错误: {e}")
-                        
-                        # 复制最大的文件
-                        if not largest_processed:
-                            target_path = os.path.join(type_target_dir, os.path.basename(largest_path))
-                            
-                            # 处理文件名冲突
-                            counter = 1
-                            while os.path.exists(target_path):
-                                name, ext = os.path.splitext(os.path.basename(largest_path))
-                                target_path = os.path.join(type_target_dir, f"{name}_{counter}{ext}")
-                                counter += 1
-                            
-                            try:
-                                shutil.copy2(largest_path, target_path)
-                                logger.info(f"复制最大文件: {largest_path} ({largest_size} bytes) -> {target_path}")
-                                replaced_count += 1
-                                cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (largest_path,))
-                            except Exception as e:
-                                logger.error(f"复制文件失败: {largest_path}, 错误: {e}")
-                        
-                        # 跳过源目录中其他较小的重复文件
-                        for path, size, is_target, processed in duplicate_files[1:]:
-                            if not is_target and not processed:
-                                logger.debug(f"跳过较小的重复文件: {path} ({size} bytes)")
-                                skipped_count += 1
-                                cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
+                    try:
+                        # 复制到目标目录（处理文件名冲突）
+                        target_path = self.copy_to_target(path, type_target_dir, existing_names)
+                        if action[2]:
+                            logger.info(f"复制唯一文件: {path} -> {target_path}")
+                            copied_count += 1
+                        else:
+                            logger.info(f"复制最大文件: {path} ({sizes[i]} bytes) -> {target_path}")
+                            replaced_count += 1
+                        processed_paths.append(path)
+                    except Exception as e:
+                        logger.error(f"复制文件失败: {path}, 错误: {e}")
                 
-                # 定期提交数据库更改
-                if i % 100 == 0:
+                # 定期批量提交数据库更改
+                if len(processed_paths) >= DB_BATCH_SIZE:
+                    self.mark_processed(cursor, processed_paths)
                     self.conn.commit()
+                    processed_paths.clear()
             
             # 最终提交
+            self.mark_processed(cursor, processed_paths)
             self.conn.commit()
             
             logger.info(f"{file_type} 处理完成! 复制: {copied_count}, 替换: {replaced_count}, 跳过: {skipped_count}, 删除重复: {deleted_count}")
@@ -428,10 +843,18 @@ class MediaOrganizer:
         self.clear_database()
         
         # 扫描目标目录
-        self.scan_directory(target_dir, is_target=True, use_content_hash=use_content_hash)
+        self.scan_directory(target_dir, is_target=True)
         
         # 扫描源目录
-        self.scan_directory(source_dir, is_target=False, use_content_hash=use_content_hash)
+        self.scan_directory(source_dir, is_target=False)
+        
+        # 按大小预筛选后计算哈希
+        self.hash_files(use_content_hash)
+        
+        # 数据写入完成后再创建索引
+        self.create_indexes()
+        self.log_scan_summary(is_target=True)
+        self.log_scan_summary(is_target=False)
         
         # 处理重复文件
         return self.process_duplicates(target_dir)
@@ -442,18 +865,26 @@ def main():
     parser.add_argument('--target', '-t', required=True, nargs='+', help='目标文件目录（可指定多个）')
     parser.add_argument('--fast', action='store_true', help='使用快速模式（仅文件哈希，不检测图片内容相似性）')
     parser.add_argument('--db', default='media_organizer.db', help='数据库文件路径（默认：media_organizer.db）')
+    parser.add_argument('--workers', type=int, default=None, help='并行计算哈希的进程数（默认：CPU核心数）')
+    parser.add_argument('--algo', choices=FILE_HASH_ALGORITHMS, default=DEFAULT_FILE_HASH_ALGORITHM,
+                        help=f'文件哈希算法（默认：{DEFAULT_FILE_HASH_ALGORITHM}，blake3需安装blake3，xxh3需安装xxhash）')
     parser.add_argument('--keep-db', action='store_true', help='保留数据库文件，不在完成后删除（用于调试或增量处理）')
     
     args = parser.parse_args()
     
+    if not is_hash_algorithm_available(args.algo):
+        logger.error(f"文件哈希算法 {args.algo} 所需的库未安装")
+        return 1
+    
     # 创建媒体整理器实例
-    organizer = MediaOrganizer(args.db)
+    organizer = MediaOrganizer(args.db, args.workers, args.algo)
     
     try:
         logger.info("=== 媒体文件去重和整理工具启动（优化版）===")
         logger.info(f"源目录: {', '.join(args.source)}")
         logger.info(f"目标目录: {', '.join(args.target)}")
         logger.info(f"模式: {'快速模式' if args.fast else '精确模式(包含图片内容比较)'}")
+        logger.info(f"文件哈希算法: {args.algo}")
         logger.info(f"数据库文件: {args.db}")
         logger.info(f"数据库保留: {'是' if args.keep_db else '否（完成后删除）'}")
         logger.info("文件分类规则:")
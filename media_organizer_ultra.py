@@ -10,10 +10,35 @@ import sqlite3
 import gc
 import threading
 import time
+import mmap
+import queue
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby, repeat
+from operator import itemgetter
 from datetime import datetime
-from PIL import Image
+from PIL import Image, ImageStat
 import logging
 
+# NumPy为可选依赖，用于向量化缩小图片以计算内容哈希
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# xxhash为可选依赖，用于快速计算文件开头部分的哈希
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Numba为可选依赖，用于将平均哈希的位打包循环编译为本地代码
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -25,9 +50,79 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 文件类型名称（驻留的字符串常量）；数据库中以其在 FILE_TYPES 中的下标存储：0=图片, 1=视频, 2=压缩文件
+IMAGE, VIDEO, ARCHIVE = sys.intern('image'), sys.intern('video'), sys.intern('archive')
+FILE_TYPES = (IMAGE, VIDEO, ARCHIVE)
+FILE_TYPE_CODES = {file_type: code for code, file_type in enumerate(FILE_TYPES)}
+
+# 扩展名到文件类型的映射，模块加载时构建一次
+# 只比较最后一段扩展名，.tar.gz/.tar.bz2/.tar.xz 分别按 .gz/.bz2/.xz 识别
+EXTENSION_TYPES = {
+    **dict.fromkeys(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'), IMAGE),
+    **dict.fromkeys(('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg'), VIDEO),
+    **dict.fromkeys(('.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz'), ARCHIVE),
+}
+
+# 遍历时跳过的系统目录（以点开头的目录另外跳过）；mp4和zip为分类保存视频和压缩文件的子目录
+SKIP_DIRECTORIES = frozenset({'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail', 'mp4', 'zip'})
+
+# 每批写入数据库的行数；扫描时遍历线程最多领先写入 WALK_QUEUE_BATCHES 批
+DB_BATCH_SIZE = 1000
+WALK_QUEUE_BATCHES = 4
+
+# 并行复制和删除文件的线程数
+FILE_OP_WORKERS = 8
+
+# 计算文件哈希时每次读取的字节数；超过 HASH_MMAP_THRESHOLD 的文件改为内存映射后整体计算
+HASH_CHUNK_SIZE = 1 << 20
+HASH_MMAP_THRESHOLD = 1 << 20
+# 超过该大小的文件映射时预先读入全部页面（仅Linux支持MAP_POPULATE）
+HASH_POPULATE_THRESHOLD = 16 << 20
+# 大小相同的文件先比较开头的这么多字节，不同时不必计算完整哈希
+PREFIX_HASH_SIZE = 4096
+# 分代GC阈值：提高第0代阈值，避免解码图片时的大量临时分配频繁触发回收
+GC_THRESHOLD = (100000, 10, 10)
+
+if njit is not None and np is not None:
+    @njit(cache=True)
+    def _ahash_pack(pixels):
+        """
+        计算64个uint8灰度像素的平均哈希：像素不小于平均值时置位，第i个像素对应第i位
+        """
+        total = 0
+        for i in range(64):
+            total += pixels[i]
+        avg_pixel = total >> 6
+        bits = np.uint64(0)
+        for i in range(64):
+            if pixels[i] >= avg_pixel:
+                bits |= np.uint64(1) << np.uint64(i)
+        return bits
+else:
+    _ahash_pack = None
+
+@contextmanager
+def gc_paused():
+    """
+    批量处理期间关闭循环垃圾回收（处理的数据只有字符串、元组和列表，不会形成循环引用），结束后恢复并统一回收一次；
+    也可作为方法的装饰器使用
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+        gc.collect()
+
 class MediaOrganizer:
-    def __init__(self, db_path="media_organizer.db"):
+    def __init__(self, db_path="media_organizer.db", workers=None):
         self.db_path = db_path
+        # 哈希计算以IO为主，线程数可以多于CPU核心数；NAS上可适当调大
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        # 复制线程遇到文件名冲突、重新分配文件名时使用
+        self.names_lock = threading.Lock()
         self.init_database()
         self.processed_count = 0
         self.start_time = None
@@ -37,9 +132,9 @@ class MediaOrganizer:
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         cursor = self.conn.cursor()
         
-        # 优化SQLite设置
-        cursor.execute('PRAGMA journal_mode = WAL')
-        cursor.execute('PRAGMA synchronous = NORMAL')
+        # 优化SQLite设置：数据库只是临时文件（结束后删除，内容可重新扫描得到），不需要落盘保证
+        cursor.execute('PRAGMA journal_mode = MEMORY')
+        cursor.execute('PRAGMA synchronous = OFF')
         cursor.execute('PRAGMA cache_size = 10000')
         cursor.execute('PRAGMA temp_store = MEMORY')
         
@@ -49,12 +144,12 @@ class MediaOrganizer:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 path TEXT UNIQUE,
                 filename TEXT,
-                file_type TEXT,
+                file_type INTEGER,  -- FILE_TYPES 中的下标
                 size INTEGER,
-                file_hash TEXT,
+                file_hash TEXT,  -- SHA-256
                 content_hash TEXT,
-                is_target BOOLEAN,
-                processed BOOLEAN DEFAULT FALSE
+                is_target INTEGER,  -- 0/1
+                processed INTEGER DEFAULT 0
             )
         ''')
         
@@ -78,20 +173,103 @@ class MediaOrganizer:
         cursor.execute('DELETE FROM files')
         self.conn.commit()
         
-    def calculate_file_hash(self, file_path, chunk_size=65536):
+    def calculate_file_hash(self, file_path, chunk_size=HASH_CHUNK_SIZE, drop_cache=False):
         """
-        计算文件的MD5哈希值，使用更大的块大小提高性能
+        计算文件的SHA-256哈希值，使用更大的块大小提高性能
+        OpenSSL在支持SHA扩展指令的CPU上使用硬件加速，比软件实现的MD5更快
+        Python 3.11+ 由 hashlib.file_digest 在C层复用缓冲区读取，不为每个分块创建bytes对象
+        大文件直接对内存映射计算，一次update即可，不把数据复制到用户态缓冲区
+        drop_cache 为True时，计算完成后让内核丢弃该文件的页缓存（之后不会再读取的文件）
         """
         try:
-            hash_md5 = hashlib.md5()
             with open(file_path, 'rb') as f:
-                while chunk := f.read(chunk_size):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+                if hasattr(os, 'posix_fadvise'):
+                    # 整个文件会被顺序读取：加大预读窗口，并让内核立即开始异步预读
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                file_size = os.fstat(f.fileno()).st_size
+                if file_size > HASH_MMAP_THRESHOLD:
+                    if file_size > HASH_POPULATE_THRESHOLD and hasattr(mmap, 'MAP_POPULATE'):
+                        # 一次系统调用预先填充整个映射，计算哈希时不再逐页触发缺页异常
+                        mm = mmap.mmap(f.fileno(), 0, flags=mmap.MAP_PRIVATE | mmap.MAP_POPULATE, prot=mmap.PROT_READ)
+                    else:
+                        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    with mm:
+                        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                            mm.madvise(mmap.MADV_SEQUENTIAL)
+                        hash_sha256 = hashlib.sha256(mm)
+                elif hasattr(hashlib, 'file_digest'):
+                    hash_sha256 = hashlib.file_digest(f, 'sha256')
+                else:
+                    hash_sha256 = hashlib.sha256()
+                    while chunk := f.read(chunk_size):
+                        hash_sha256.update(chunk)
+                if drop_cache and hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            return hash_sha256.hexdigest()
         except Exception as e:
             logger.error(f"计算文件哈希失败: {file_path}, 错误: {e}")
             return None
 
+    def downsample_8x8(self, img):
+        """
+        用NumPy把灰度图缩小为8x8：裁剪为8的倍数后按块求平均（四舍五入），返回64个像素的uint8数组
+        """
+        block_h, block_w = img.size[1] // 8, img.size[0] // 8
+        block_area = block_h * block_w
+        arr = np.asarray(img, dtype=np.uint8)[:block_h * 8, :block_w * 8]
+        sums = arr.reshape(8, block_h, 8, block_w).sum(axis=(1, 3), dtype=np.uint32)
+        return ((sums + block_area // 2) // block_area).astype(np.uint8).reshape(-1)
+
+    def calculate_content_hash(self, image_path):
+        """
+        快速计算图片的内容哈希（平均哈希），无法解码的图片返回None
+        """
+        try:
+            with Image.open(image_path) as img:
+                # JPEG不使用draft()按DCT比例缩小解码：缩小解码的结果与PNG等格式完整解码后缩放的结果略有差异，
+                # 会使同一图片不同格式的内容哈希不一致
+                img = img.convert('L')
+                width, height = img.size
+                if width >= 8 and height >= 8:
+                    if np is not None:
+                        pixels = self.downsample_8x8(img)
+                    else:
+                        # 与 downsample_8x8 相同：裁剪为8的倍数后按块求平均并四舍五入，有无NumPy得到相同的内容哈希
+                        # （Image.reduce的定点运算在平均值接近x.5时与精确结果差1，不能代替）
+                        block_w, block_h = width // 8, height // 8
+                        block_area = block_w * block_h
+                        pixels = []
+                        for y in range(0, block_h * 8, block_h):
+                            for x in range(0, block_w * 8, block_w):
+                                block = img.crop((x, y, x + block_w, y + block_h))
+                                block_sum = int(ImageStat.Stat(block).sum[0])
+                                pixels.append((block_sum + block_area // 2) // block_area)
+                else:
+                    # 不足8像素的边无法按块求平均，使用最快的重采样方法
+                    img = img.resize((8, 8), Image.Resampling.NEAREST)
+                    pixels = np.frombuffer(img.tobytes(), dtype=np.uint8) if np is not None else list(img.getdata())
+                
+                if _ahash_pack is not None:
+                    return f"{int(_ahash_pack(pixels)):016x}"
+                
+                if np is not None:
+                    # 没有Numba时由NumPy一次比较全部像素并按位打包，第i个像素对应整数的第i位
+                    avg_pixel = int(pixels.sum()) >> 6
+                    packed = np.packbits(pixels >= avg_pixel, bitorder='little')
+                    return f"{int.from_bytes(packed.tobytes(), 'little'):016x}"
+                
+                avg_pixel = sum(pixels) >> 6  # 除以64的快速方法
+                
+                # 使用位操作快速生成哈希
+                bits = 0
+                for i, pixel in enumerate(pixels):
+                    if pixel >= avg_pixel:
+                        bits |= (1 << i)
+                return f"{bits:016x}"
+        except Exception:
+            return None
+
     def calculate_image_hash_fast(self, image_path):
         """
         快速计算图片的感知哈希值，优化性能
@@ -103,69 +281,116 @@ class MediaOrganizer:
                 return None, None
                 
             # 内容哈希 - 使用最快的算法
-            content_hash = None
-            try:
-                with Image.open(image_path) as img:
-                    # 使用最快的重采样方法和最小尺寸
-                    img = img.convert('L').resize((8, 8), Image.Resampling.NEAREST)
-                    pixels = list(img.getdata())
-                    avg_pixel = sum(pixels) >> 6  # 除以64的快速方法
-                    
-                    # 使用位操作快速生成哈希
-                    bits = 0
-                    for i, pixel in enumerate(pixels):
-                        if pixel >= avg_pixel:
-                            bits |= (1 << i)
-                    content_hash = f"{bits:016x}"
-            except Exception:
-                pass
-                
-            return file_hash, content_hash
+            return file_hash, self.calculate_content_hash(image_path)
             
         except Exception as e:
             logger.error(f"计算图片哈希失败: {image_path}, 错误: {e}")
             return None, None
 
+    def calculate_prefix_hash(self, file_path):
+        """
+        计算文件开头 PREFIX_HASH_SIZE 字节的哈希值，用于在计算完整哈希前排除大小相同但内容不同的文件
+        已安装xxhash时使用xxh3_64，否则使用blake2b；无法读取时返回None，由完整哈希计算时报告错误
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                head = f.read(PREFIX_HASH_SIZE)
+        except OSError:
+            return None
+        if xxhash is not None:
+            return xxhash.xxh3_64_hexdigest(head)
+        return hashlib.blake2b(head, digest_size=8).hexdigest()
+
+    def _hash_one(self, task):
+        """
+        在线程池中计算单个文件的哈希值，返回 (文件哈希, 内容哈希, 文件编号)，无法处理的文件返回None
+        task 为 (文件编号, 路径, 文件类型, 是否为目标目录, 已知的文件哈希, 是否计算内容哈希)，
+        已知文件哈希不为None时不再读取完整文件
+        """
+        file_id, file_path, file_type, is_target, known_hash, use_content_hash = task
+        decode = file_type == IMAGE and use_content_hash
+        
+        file_hash = known_hash
+        if file_hash is None:
+            # 目标目录中的文件之后只会被保留或删除，计算哈希后即可丢弃其页缓存；
+            # 源文件之后可能被复制，需要解码的图片还要再次读取，保留缓存
+            file_hash = self.calculate_file_hash(file_path, drop_cache=is_target and not decode)
+            if file_hash is None:
+                logger.warning(f"跳过无法处理的文件: {file_path}")
+                return None
+        
+        content_hash = self.calculate_content_hash(file_path) if decode else None
+        return file_hash, content_hash, file_id
+
     def get_file_type(self, file_path):
         """
         判断文件类型：图片、视频、压缩文件或其他
+        file_path 传入文件名（如DirEntry.name）即可，也可以传入完整路径；只对扩展名部分转小写，一次字典查找完成分类
         """
-        _, ext = os.path.splitext(file_path.lower())
-        
-        image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.heif'}
-        video_extensions = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp', '.mpg', '.mpeg'}
-        archive_extensions = {'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz', '.tar.gz', '.tar.bz2', '.tar.xz'}
-        
-        if ext in image_extensions:
-            return 'image'
-        elif ext in video_extensions:
-            return 'video'
-        elif ext in archive_extensions:
-            return 'archive'
-        else:
+        start = file_path.rfind(os.sep) + 1
+        dot = file_path.rfind('.', start)
+        # 与os.path.splitext一致：以点开头的文件名（如 .jpg）视为没有扩展名
+        if dot <= start:
             return 'other'
+        return EXTENSION_TYPES.get(file_path[dot:].lower(), 'other')
 
     def is_image_file_fast(self, file_path):
         """快速判断文件是否为图片文件，减少IO操作"""
-        if self.get_file_type(file_path) != 'image':
+        if self.get_file_type(file_path) != IMAGE:
             return False
         
         # 跳过额外验证以提高速度，仅依赖扩展名
         return True
 
     def should_skip_directory(self, dir_path):
-        """判断是否应该跳过该目录"""
-        skip_dirs = {'@eaDir', '.DS_Store', 'Thumbs.db', '@Recycle', '#recycle', '.thumbnail', 'mp4', 'zip'}
+        """判断是否应该跳过该目录；dir_path 也可以直接传入目录名（如DirEntry.name）"""
         dir_name = os.path.basename(dir_path)
-        return dir_name in skip_dirs or dir_name.startswith('.')
+        return dir_name in SKIP_DIRECTORIES or dir_name.startswith('.')
+
+    def iter_files(self, directory):
+        """
+        使用os.scandir和显式栈遍历目录，返回图片、视频和压缩文件的 (路径, 文件名, 大小, 文件类型)
+        DirEntry自带文件名和类型信息，按文件名判断类型，只对需要的文件获取大小
+        与os.walk顺序一致：先返回当前目录的文件，再依次进入子目录；不进入指向目录的符号链接
+        """
+        stack = [directory]
+        while stack:
+            dir_path = stack.pop()
+            try:
+                with os.scandir(dir_path) as it:
+                    entries = list(it)
+            except OSError as e:
+                logger.error(f"无法读取目录: {dir_path}, 错误: {e}")
+                continue
+            
+            subdirs = []
+            for entry in entries:
+                if entry.is_dir():
+                    # 跳过系统目录
+                    if not entry.is_symlink() and not self.should_skip_directory(entry.name):
+                        subdirs.append(entry.path)
+                    continue
+                
+                file_type = self.get_file_type(entry.name)
+                if file_type == 'other':
+                    continue
+                try:
+                    file_size = entry.stat().st_size
+                except OSError as e:
+                    logger.error(f"处理文件失败: {entry.path}, 错误: {e}")
+                    continue
+                yield entry.path, entry.name, file_size, file_type
+            
+            # 逆序入栈，出栈时按目录列表的顺序处理子目录
+            stack.extend(reversed(subdirs))
 
     def get_target_directory(self, target_dir, file_type):
         """
         根据文件类型获取目标目录
         """
-        if file_type == 'video':
+        if file_type == VIDEO:
             return os.path.join(target_dir, 'mp4')
-        elif file_type == 'archive':
+        elif file_type == ARCHIVE:
             return os.path.join(target_dir, 'zip')
         else:
             return target_dir
@@ -178,6 +403,86 @@ class MediaOrganizer:
             os.makedirs(dir_path)
             logger.info(f"创建目录: {dir_path}")
 
+    def get_unique_target_path(self, dir_path, filename, existing_names):
+        """
+        在目录中为文件选择不冲突的目标路径，重名时自动添加数字后缀
+        existing_names 为目录中已有及已分配给待复制文件的文件名集合，在内存中判断重名，不再逐个调用os.path.exists；
+        选中的文件名会加入其中
+        """
+        candidate = filename
+        if candidate in existing_names:
+            # 只在重名时拆分一次文件名
+            name, ext = os.path.splitext(filename)
+            counter = 1
+            while candidate in existing_names:
+                candidate = f"{name}_{counter}{ext}"
+                counter += 1
+        existing_names.add(candidate)
+        return os.path.join(dir_path, candidate)
+
+    def copy_file(self, src, dst):
+        """
+        复制文件并保留元数据（等同于shutil.copy2），目标文件以独占方式创建，已存在时抛出FileExistsError
+        Linux上用copy_file_range在内核中复制数据，不经过用户态缓冲区；不支持时回退到普通复制
+        """
+        with open(src, 'rb') as fsrc:
+            fdst = open(dst, 'xb')
+            try:
+                with fdst:
+                    copied_in_kernel = False
+                    if hasattr(os, 'copy_file_range'):
+                        size = os.fstat(fsrc.fileno()).st_size
+                        offset = 0
+                        try:
+                            while offset < size:
+                                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                                if copied == 0:
+                                    # 部分文件系统（网络、FUSE等）不支持时直接返回0，此时内容并未复制完整
+                                    break
+                                offset += copied
+                        except OSError:
+                            pass
+                        copied_in_kernel = offset == size
+                        if not copied_in_kernel:
+                            # 不支持或未复制完整时从头改用普通复制（指定偏移量时文件位置不会移动）
+                            fdst.truncate(0)
+                    if not copied_in_kernel:
+                        shutil.copyfileobj(fsrc, fdst)
+                shutil.copystat(src, dst)
+            except Exception:
+                # 复制失败时删除已创建的不完整文件，避免重试时在目标目录留下残缺文件
+                try:
+                    os.remove(dst)
+                except OSError:
+                    pass
+                raise
+
+    def copy_file_safe(self, task):
+        """
+        在线程池中复制文件，task 为 (源路径, 文件名, 目标路径, 目标目录的文件名集合)，成功返回None，失败返回异常
+        文件名集合与磁盘不一致（如大小写不敏感的文件系统）时由独占创建兜底，改用下一个文件名
+        """
+        src, filename, target_path, existing_names = task
+        try:
+            while True:
+                try:
+                    self.copy_file(src, target_path)
+                    return None
+                except FileExistsError:
+                    with self.names_lock:
+                        target_path = self.get_unique_target_path(
+                            os.path.dirname(target_path), filename, existing_names)
+        except Exception as e:
+            return e
+
+    def remove_file(self, path):
+        """在线程池中删除文件，成功返回None，失败返回异常"""
+        try:
+            os.remove(path)
+            return None
+        except Exception as e:
+            return e
+
     def show_progress(self, processed, total, start_time=None):
         """显示进度信息"""
         percentage = processed / total * 100
@@ -193,109 +498,175 @@ class MediaOrganizer:
         else:
             logger.info(f"正在处理: {processed}/{total} ({percentage:.1f}%)")
 
-    def scan_directory(self, directory, is_target=False, use_content_hash=True):
+    @gc_paused()
+    def scan_directory(self, directory, is_target=False):
         """
         扫描目录并将文件信息存储到数据库
         """
         logger.info(f"正在扫描{'目标' if is_target else '源'}目录: {directory}")
         
-        # 统计文件数量
-        file_count = 0
-        file_list = []
-        
-        logger.info("正在统计文件数量...")
-        for root, dirs, files in os.walk(directory):
-            dirs[:] = [d for d in dirs if not self.should_skip_directory(os.path.join(root, d))]
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                file_type = self.get_file_type(file_path)
-                if file_type in ['image', 'video', 'archive']:
-                    file_list.append((file_path, file_type))
-                    file_count += 1
-        
-        logger.info(f"{'目标' if is_target else '源'}目录中共有 {file_count} 个可处理的文件")
-        
-        if file_count == 0:
-            return
-        
-        processed_count = 0
         cursor = self.conn.cursor()
-        start_time = time.time()
+        file_count = 0
         
-        # 批量处理文件
-        batch_size = 1000
-        batch_data = []
+        # 整个目录的扫描结果在一个事务中写入，批量插入之间不再提交
+        cursor.execute('BEGIN IMMEDIATE')
         
-        for file_path, file_type in file_list:
-            # 验证图片文件
-            if file_type == 'image' and not self.is_image_file_fast(file_path):
-                continue
-            
-            processed_count += 1
-            
-            # 显示进度
-            if processed_count % 500 == 0 or processed_count == file_count:
-                self.show_progress(processed_count, file_count, start_time)
-                gc.collect()
-            
+        # 一次遍历写入文件：只记录路径、类型和大小，哈希值在源目录和目标目录都扫描完后由 hash_files 计算
+        # 后台线程遍历目录，主线程同时把已遍历到的批次写入数据库；队列有界，遍历不会远超写入
+        batches = queue.Queue(maxsize=WALK_QUEUE_BATCHES)
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=1) as walker:
+            walk = walker.submit(self._walk_into, directory, batches, stop)
             try:
-                file_size = os.path.getsize(file_path)
-                
-                # 计算哈希值
-                if file_type == 'image' and use_content_hash:
-                    file_hash, content_hash = self.calculate_image_hash_fast(file_path)
-                else:
-                    file_hash = self.calculate_file_hash(file_path)
-                    content_hash = None
-                
-                if file_hash is None:
-                    logger.warning(f"跳过无法处理的文件: {file_path}")
-                    continue
-                
-                # 添加到批处理列表
-                batch_data.append((
-                    file_path, os.path.basename(file_path), file_type, 
-                    file_size, file_hash, content_hash, is_target
-                ))
-                
-                # 批量插入数据库
-                if len(batch_data) >= batch_size:
-                    cursor.executemany('''
-                        INSERT OR IGNORE INTO files 
-                        (path, filename, file_type, size, file_hash, content_hash, is_target)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', batch_data)
-                    self.conn.commit()
-                    batch_data = []
-                    
-            except Exception as e:
-                logger.error(f"处理文件失败: {file_path}, 错误: {e}")
-                continue
+                while (batch := batches.get()) is not None:
+                    file_count += len(batch[0])
+                    self.insert_files(cursor, *batch, is_target)
+            except BaseException:
+                # 写入出错时通知遍历线程停止，并取走队列中剩余的批次，避免其阻塞在put上使线程池无法退出
+                stop.set()
+                while batches.get() is not None:
+                    pass
+                raise
+            # 遍历线程中的异常在这里重新抛出
+            walk.result()
+        self.conn.commit()
         
-        # 处理剩余的批处理数据
-        if batch_data:
-            cursor.executemany('''
-                INSERT OR IGNORE INTO files 
-                (path, filename, file_type, size, file_hash, content_hash, is_target)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', batch_data)
-            self.conn.commit()
+        logger.info(f"{'目标' if is_target else '源'}目录中共有 {file_count} 个可处理的文件")
         
         # 统计结果
         cursor.execute('''
             SELECT file_type, COUNT(*) FROM files 
             WHERE is_target = ? 
             GROUP BY file_type
-        ''', (is_target,))
+        ''', (int(is_target),))
         
         results = cursor.fetchall()
-        type_counts = {file_type: count for file_type, count in results}
+        type_counts = {FILE_TYPES[code]: count for code, count in results}
         
         logger.info(f"{'目标' if is_target else '源'}目录扫描完成: "
-                   f"图片 {type_counts.get('image', 0)} 张, "
-                   f"视频 {type_counts.get('video', 0)} 个, "
-                   f"压缩文件 {type_counts.get('archive', 0)} 个")
+                   f"图片 {type_counts.get(IMAGE, 0)} 张, "
+                   f"视频 {type_counts.get(VIDEO, 0)} 个, "
+                   f"压缩文件 {type_counts.get(ARCHIVE, 0)} 个")
+
+    def _walk_into(self, directory, batches, stop):
+        """
+        在后台线程中遍历目录，把待插入的文件按列分批放入队列（结构数组，不为每个文件保留一个元组），结束时放入None
+        stop 被设置时（写入数据库出错）不再继续遍历
+        """
+        paths, names, types, sizes = [], [], [], []
+        try:
+            for file_path, file_name, file_size, file_type in self.iter_files(directory):
+                # 验证图片文件
+                if file_type == IMAGE and not self.is_image_file_fast(file_path):
+                    continue
+                
+                paths.append(file_path)
+                names.append(file_name)
+                types.append(FILE_TYPE_CODES[file_type])
+                sizes.append(file_size)
+                if len(paths) >= DB_BATCH_SIZE:
+                    if stop.is_set():
+                        return
+                    batches.put((paths, names, types, sizes))
+                    paths, names, types, sizes = [], [], [], []
+            
+            if paths:
+                batches.put((paths, names, types, sizes))
+        finally:
+            batches.put(None)
+
+    def insert_files(self, cursor, paths, names, types, sizes, is_target):
+        """
+        批量插入扫描到的文件，各列分别以列表传入，由 executemany 逐行读取 zip 生成的数据；插入后清空各列表
+        types 为文件类型代码，is_target 以整数0/1存储
+        """
+        cursor.executemany('''
+            INSERT OR IGNORE INTO files 
+            (path, filename, file_type, size, is_target)
+            VALUES (?, ?, ?, ?, ?)
+        ''', zip(paths, names, types, sizes, repeat(int(is_target))))
+        for column in (paths, names, types, sizes):
+            column.clear()
 
+    @gc_paused()
+    def hash_files(self, use_content_hash=True):
+        """
+        计算已扫描文件的哈希值，只有可能重复的文件才读取完整内容：
+        同类型中大小唯一的文件不可能与其他文件重复，以大小作为文件哈希；大小相同的文件先比较开头部分的哈希，
+        （大小, 开头哈希）仍相同的文件才计算完整的SHA-256
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT f.id, f.path, f.file_type, f.size, f.is_target, s.n FROM files f
+            JOIN (SELECT file_type, size, COUNT(*) AS n FROM files GROUP BY file_type, size) s
+            ON f.file_type = s.file_type AND f.size = s.size
+            ORDER BY f.id
+        ''')
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        
+        # 按列存储（结构数组），每个文件以下标对应各列
+        file_ids, file_paths, file_types, sizes, targets, same_size_counts = zip(*rows)
+        del rows
+        file_count = len(file_ids)
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as hash_pool:
+            # 大小相同的文件只读取开头部分计算哈希
+            same_size = [i for i in range(file_count) if same_size_counts[i] > 1]
+            prefix_hashes = [None] * file_count
+            for i, prefix_hash in zip(same_size, hash_pool.map(self.calculate_prefix_hash, [file_paths[i] for i in same_size])):
+                prefix_hashes[i] = prefix_hash
+            prefix_counts = Counter((file_types[i], sizes[i], prefix_hashes[i]) for i in same_size)
+            
+            updates = []  # [(文件哈希, 内容哈希, 文件编号)]
+            tasks = []
+            for i in range(file_count):
+                type_code, size = file_types[i], sizes[i]
+                file_type = FILE_TYPES[type_code]
+                # 大小或开头哈希已能与其他文件区分时以其作为文件哈希，加上前缀与完整哈希区分
+                if same_size_counts[i] == 1:
+                    known_hash = f"SZ:{size}"
+                else:
+                    prefix_hash = prefix_hashes[i]
+                    if prefix_hash is not None and prefix_counts[(type_code, size, prefix_hash)] == 1:
+                        known_hash = f"PF:{size}:{prefix_hash}"
+                    else:
+                        known_hash = None
+                
+                if known_hash is not None and not (file_type == IMAGE and use_content_hash):
+                    updates.append((known_hash, None, file_ids[i]))
+                else:
+                    tasks.append((file_ids[i], file_paths[i], file_type, targets[i], known_hash, use_content_hash))
+            
+            full_hash_count = sum(1 for task in tasks if task[4] is None)
+            logger.info(f"需要计算完整文件哈希的文件: {full_hash_count}/{file_count}")
+            
+            # 哈希在线程池中并行计算（hashlib和PIL计算时释放GIL），结果按输入顺序返回，数据库只在主线程中写入
+            cursor.execute('BEGIN IMMEDIATE')
+            processed_count = 0
+            task_count = len(tasks)
+            start_time = time.time()
+            for result in hash_pool.map(self._hash_one, tasks):
+                processed_count += 1
+                
+                # 显示进度
+                if processed_count % 500 == 0 or processed_count == task_count:
+                    self.show_progress(processed_count, task_count, start_time)
+                
+                if result is not None:
+                    updates.append(result)
+                
+                # 批量更新数据库
+                if len(updates) >= DB_BATCH_SIZE:
+                    cursor.executemany('UPDATE files SET file_hash = ?, content_hash = ? WHERE id = ?', updates)
+                    updates = []
+        
+        if updates:
+            cursor.executemany('UPDATE files SET file_hash = ?, content_hash = ? WHERE id = ?', updates)
+        self.conn.commit()
+
+    @gc_paused()
     def process_duplicates(self, target_dir):
         """
         处理重复文件，批量处理以减少内存使用
@@ -308,7 +679,7 @@ class MediaOrganizer:
         total_deleted = 0
         
         # 按文件类型处理
-        for file_type in ['image', 'video', 'archive']:
+        for file_type in FILE_TYPES:
             logger.info(f"\n开始处理 {file_type} 文件...")
             
             type_target_dir = self.get_target_directory(target_dir, file_type)
@@ -319,115 +690,105 @@ class MediaOrganizer:
             replaced_count = 0
             deleted_count = 0
             
-            # 获取所有文件哈希值（分批处理）
+            # 哈希组数量只用于显示进度
             cursor.execute('''
-                SELECT DISTINCT file_hash FROM files 
+                SELECT COUNT(DISTINCT file_hash) FROM files 
                 WHERE file_type = ? AND file_hash IS NOT NULL
-            ''', (file_type,))
+            ''', (FILE_TYPE_CODES[file_type],))
+            group_count = cursor.fetchone()[0]
             
-            hash_values = [row[0] for row in cursor.fetchall()]
+            logger.info(f"处理 {group_count} 个不同的{file_type}文件哈希组...")
             
-            logger.info(f"处理 {len(hash_values)} 个不同的{file_type}文件哈希组...")
+            # 一次查询取出该类型的所有文件，由SQLite排序：同一哈希的文件相邻，
+            # 组内按大小、是否在目标目录降序排列，第一个即为要保留的文件，不再每个哈希查询一次
+            rows = self.conn.execute('''
+                SELECT file_hash, path, filename, size, is_target, processed FROM files 
+                WHERE file_type = ? AND file_hash IS NOT NULL
+                ORDER BY file_hash, size DESC, is_target DESC, id
+            ''', (FILE_TYPE_CODES[file_type],))
             
+            to_copy = []  # [(源文件路径, 文件名, 是否替换目标目录中的重复文件)]
+            to_delete = []
+            processed_paths = []
+            
+            # 先按哈希组决定要复制、删除和跳过的文件，再统一执行文件操作
             start_time = time.time()
-            for i, hash_value in enumerate(hash_values):
+            for i, (_, group) in enumerate(groupby(rows, key=itemgetter(0))):
                 if i % 500 == 0 and i > 0:
-                    self.show_progress(i, len(hash_values), start_time)
-                    gc.collect()
-                
-                # 获取具有相同哈希值的所有文件
-                cursor.execute('''
-                    SELECT path, size, is_target, processed FROM files 
-                    WHERE file_hash = ? AND file_type = ?
-                    ORDER BY size DESC, is_target DESC
-                ''', (hash_value, file_type))
+                    self.show_progress(i, group_count, start_time)
                 
-                duplicate_files = cursor.fetchall()
+                # 具有相同哈希值的所有文件
+                duplicate_files = [row[1:] for row in group]
                 
-                if len(duplicate_files) <= 1:
+                if len(duplicate_files) == 1:
                     # 没有重复文件
-                    if len(duplicate_files) == 1:
-                        path, size, is_target, processed = duplicate_files[0]
-                        if not is_target and not processed:
-                            # 源目录中的唯一文件，复制到目标目录
-                            target_path = os.path.join(type_target_dir, os.path.basename(path))
-                            
-                            # 处理文件名冲突
-                            counter = 1
-                            while os.path.exists(target_path):
-                                name, ext = os.path.splitext(os.path.basename(path))
-                                target_path = os.path.join(type_target_dir, f"{name}_{counter}{ext}")
-                                counter += 1
-                            
-                            try:
-                                shutil.copy2(path, target_path)
-                                copied_count += 1
-                                cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
-                            except Exception as e:
-                                logger.error(f"复制文件失败: {path}, 错误: {e}")
+                    path, filename, size, is_target, processed = duplicate_files[0]
+                    if not is_target and not processed:
+                        # 源目录中的唯一文件，复制到目标目录
+                        to_copy.append((path, filename, False))
                 else:
                     # 有重复文件，选择最大的
                     largest_file = duplicate_files[0]
-                    largest_path, largest_size, largest_is_target, largest_processed = largest_file
+                    largest_path, largest_filename, largest_size, largest_is_target, largest_processed = largest_file
                     
                     if largest_is_target:
-                        # 最大文件已在目标目录中
-                        for path, size, is_target, processed in duplicate_files[1:]:
+                        # 最大文件已在目标目录中，删除目标目录中的其他重复文件
+                        for path, _, size, is_target, processed in duplicate_files[1:]:
                             if is_target and not processed:
-                                try:
-                                    os.remove(path)
-                                    deleted_count += 1
-                                    cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
-                                except Exception as e:
-                                    logger.error(f"删除文件失败: {path}, 错误: {e}")
+                                to_delete.append(path)
                         
                         # 跳过源目录中的重复文件
-                        for path, size, is_target, processed in duplicate_files:
+                        for path, _, size, is_target, processed in duplicate_files:
                             if not is_target and not processed:
                                 skipped_count += 1
-                                cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
+                                processed_paths.append(path)
                         
-                        cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (largest_path,))
+                        processed_paths.append(largest_path)
                         
                     else:
                         # 最大文件在源目录中，需要复制并替换
-                        for path, size, is_target, processed in duplicate_files:
+                        for path, _, size, is_target, processed in duplicate_files:
                             if is_target and not processed:
-                                try:
-                                    os.remove(path)
-                                    deleted_count += 1
-                                    cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
-                                except Exception as e:
-                                    logger.error(f"删除文件失败: {path}, 错误: {e}")
+                                to_delete.append(path)
                         
                         # 复制最大的文件
                         if not largest_processed:
-                            target_path = os.path.join(type_target_dir, os.path.basename(largest_path))
-                            
-                            counter = 1
-                            while os.path.exists(target_path):
-                                name, ext = os.path.splitext(os.path.basename(largest_path))
-                                target_path = os.path.join(type_target_dir, f"{name}_{counter}{ext}")
-                                counter += 1
-                            
-                            try:
-                                shutil.copy2(largest_path, target_path)
-                                replaced_count += 1
-                                cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (largest_path,))
-                            except Exception as e:
-                                logger.error(f"复制文件失败: {largest_path}, 错误: {e}")
+                            to_copy.append((largest_path, largest_filename, True))
                         
                         # 跳过源目录中其他较小的重复文件
-                        for path, size, is_target, processed in duplicate_files[1:]:
+                        for path, _, size, is_target, processed in duplicate_files[1:]:
                             if not is_target and not processed:
                                 skipped_count += 1
-                                cursor.execute('UPDATE files SET processed = TRUE WHERE path = ?', (path,))
+                                processed_paths.append(path)
+            
+            # 删除和复制都是纯IO操作，不同哈希组之间互不依赖，在线程池中并行执行
+            with ThreadPoolExecutor(max_workers=FILE_OP_WORKERS) as file_pool:
+                # 先删除再复制，被删除的重复文件让出的文件名可以给之后复制的文件使用
+                for path, error in zip(to_delete, file_pool.map(self.remove_file, to_delete)):
+                    if error is None:
+                        deleted_count += 1
+                        processed_paths.append(path)
+                    else:
+                        logger.error(f"删除文件失败: {path}, 错误: {error}")
                 
-                # 定期提交数据库更改
-                if i % 100 == 0:
-                    self.conn.commit()
+                # 删除完成后读取一次目标目录的文件列表，重名判断在内存中完成；
+                # 目标文件名按计划顺序依次分配，同时复制的文件不会选到同一个文件名
+                existing_names = set(os.listdir(type_target_dir))
+                copy_tasks = [(src, filename, self.get_unique_target_path(type_target_dir, filename, existing_names),
+                               existing_names) for src, filename, _ in to_copy]
+                for (src, _, replaced), error in zip(to_copy, file_pool.map(self.copy_file_safe, copy_tasks)):
+                    if error is None:
+                        if replaced:
+                            replaced_count += 1
+                        else:
+                            copied_count += 1
+                        processed_paths.append(src)
+                    else:
+                        logger.error(f"复制文件失败: {src}, 错误: {error}")
+            
+            cursor.executemany('UPDATE files SET processed = 1 WHERE path = ?', ((path,) for path in processed_paths))
             
-            # 最终提交
+            # 每种文件类型的处理结果在一个事务中提交
             self.conn.commit()
             
             logger.info(f"{file_type} 处理完成! 复制: {copied_count}, 替换: {replaced_count}, 跳过: {skipped_count}, 删除重复: {deleted_count}")
@@ -451,10 +812,13 @@ class MediaOrganizer:
         self.clear_database()
         
         # 扫描目标目录
-        self.scan_directory(target_dir, is_target=True, use_content_hash=use_content_hash)
+        self.scan_directory(target_dir, is_target=True)
         
         # 扫描源目录
-        self.scan_directory(source_dir, is_target=False, use_content_hash=use_content_hash)
+        self.scan_directory(source_dir, is_target=False)
+        
+        # 两个目录都扫描完后才能知道哪些文件可能重复，再计算哈希
+        self.hash_files(use_content_hash)
         
         # 处理重复文件
         return self.process_duplicates(target_dir)
@@ -465,11 +829,14 @@ def main():
     parser.add_argument('--target', '-t', required=True, nargs='+', help='目标文件目录（可指定多个）')
     parser.add_argument('--fast', action='store_true', help='使用快速模式（仅文件哈希，不检测图片内容相似性）')
     parser.add_argument('--db', default='media_organizer.db', help='数据库文件路径（默认：media_organizer.db）')
+    parser.add_argument('--workers', type=int, default=None, help='并行计算哈希的线程数（默认：CPU核心数的4倍，最多32）')
     
     args = parser.parse_args()
     
+    gc.set_threshold(*GC_THRESHOLD)
+    
     # 创建媒体整理器实例
-    organizer = MediaOrganizer(args.db)
+    organizer = MediaOrganizer(args.db, args.workers)
     
     try:
         logger.info("=== 媒体文件去重和整理工具启动（高性能优化版）===")
@@ -477,6 +844,7 @@ def main():
         logger.info(f"目标目录: {', '.join(args.target)}")
         logger.info(f"模式: {'快速模式' if args.fast else '精确模式(包含图片内容比较)'}")
         logger.info(f"数据库文件: {args.db}")
+        logger.info(f"哈希线程数: {organizer.workers}")
         logger.info("文件分类规则:")
         logger.info("- 图片文件: 保存在主目录")
         logger.info("- 视频文件: 保存在 mp4/ 子目录")
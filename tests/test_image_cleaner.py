@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_cleaner import calculate_image_content_hash
+from test_image_deduplicator import encode, make_photo
+
+
+class ContentHashRoundTripTest(unittest.TestCase):
+    """同一图片的JPEG与其无损重新编码的PNG应得到相同的平均哈希"""
+
+    SIZES = ((640, 480), (1600, 1200), (1200, 1600), (2400, 1800), (3000, 2000), (2048, 2048))
+
+    def test_jpeg_png_round_trip(self):
+        for seed, size in enumerate(self.SIZES):
+            with self.subTest(size=size, seed=seed):
+                jpeg = encode(make_photo(size, seed), 'JPEG', quality=85)
+                png = encode(Image.open(io.BytesIO(jpeg)), 'PNG')
+                jpeg_hash = calculate_image_content_hash('photo.jpg', io.BytesIO(jpeg))
+                png_hash = calculate_image_content_hash('photo.png', io.BytesIO(png))
+                self.assertIsNotNone(jpeg_hash)
+                self.assertEqual(jpeg_hash, png_hash)
+
+
+if __name__ == '__main__':
+    unittest.main()
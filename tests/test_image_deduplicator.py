@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image, ImageChops
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_deduplicator
+from image_deduplicator import PHASH_IMAGE_SIZE, _hash_image_data, _phash_from_pixels, _thumbnail_pixels_pil, process_images
+
+
+def make_photo(size, seed):
+    """生成带渐变、分形细节和噪声的测试照片"""
+    width, height = size
+    extent = (-2.0 + seed * 0.05, -1.2, 1.0, 1.2 - seed * 0.03)
+    red = Image.effect_mandelbrot(size, extent, 60 + seed * 7)
+    green = Image.radial_gradient('L').resize(size).rotate(seed * 37)
+    blue = ImageChops.add(Image.linear_gradient('L').resize(size).rotate(seed * 53),
+                          Image.effect_noise(size, 24 + seed), scale=2.0)
+    return Image.merge('RGB', (red, green, blue))
+
+
+def encode(img, fmt, **params):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+class ContentHashRoundTripTest(unittest.TestCase):
+    """同一图片的JPEG与其无损重新编码的PNG应得到相同的感知哈希"""
+
+    # 较大的尺寸会触发JPEG按DCT比例缩小解码
+    SIZES = ((640, 480), (1600, 1200), (1200, 1600), (2400, 1800), (3000, 2000), (2048, 2048))
+
+    def test_jpeg_png_round_trip(self):
+        for seed, size in enumerate(self.SIZES):
+            with self.subTest(size=size, seed=seed):
+                jpeg = encode(make_photo(size, seed), 'JPEG', quality=85)
+                png = encode(Image.open(io.BytesIO(jpeg)), 'PNG')
+                _, jpeg_hash = _hash_image_data('photo.jpg', jpeg)
+                _, png_hash = _hash_image_data('photo.png', png)
+                self.assertIsNotNone(jpeg_hash)
+                self.assertEqual(jpeg_hash, png_hash)
+
+
+class PhashBackendTest(unittest.TestCase):
+    """Numba、NumPy和纯Python三种实现对同一像素数据应得到相同的感知哈希"""
+
+    def backend_hashes(self, pixels):
+        hashes = {'default': _phash_from_pixels(pixels)}
+        with mock.patch.object(image_deduplicator, '_phash_kernel', None):
+            hashes['numpy'] = _phash_from_pixels(pixels)
+            with mock.patch.object(image_deduplicator, 'np', None):
+                hashes['python'] = _phash_from_pixels(pixels)
+        return hashes
+
+    def assert_backends_agree(self, pixels):
+        hashes = self.backend_hashes(pixels)
+        self.assertEqual(len(set(hashes.values())), 1, hashes)
+
+    def test_flat(self):
+        for value in (0, 1, 127, 128, 200, 255):
+            with self.subTest(value=value):
+                self.assert_backends_agree(bytes([value]) * PHASH_IMAGE_SIZE ** 2)
+
+    def test_gradient(self):
+        size = PHASH_IMAGE_SIZE
+        gradients = {
+            'horizontal': [x * 8 for y in range(size) for x in range(size)],
+            'vertical': [y * 8 for y in range(size) for x in range(size)],
+            'diagonal': [(x + y) * 4 for y in range(size) for x in range(size)],
+            'low_contrast': [100 + (x * 3 + y) % 4 for y in range(size) for x in range(size)],
+        }
+        for name, pixels in gradients.items():
+            with self.subTest(gradient=name):
+                self.assert_backends_agree(bytes(pixels))
+
+    def test_photo(self):
+        for seed, size in enumerate(((640, 480), (1600, 1200))):
+            with self.subTest(seed=seed):
+                self.assert_backends_agree(_thumbnail_pixels_pil(encode(make_photo(size, seed), 'PNG')))
+
+
+class TruncatedImageTest(unittest.TestCase):
+    """文件头有效但无法完整解码的图片在精确模式和快速模式下都应复制到目标目录"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source = os.path.join(self.tmp.name, 'src')
+        os.makedirs(self.source)
+        jpeg = encode(make_photo((320, 240), 0), 'JPEG', quality=85)
+        with open(os.path.join(self.source, 'trunc.jpg'), 'wb') as f:
+            f.write(jpeg[:len(jpeg) // 2])
+        with open(os.path.join(self.source, 'broken.jpg'), 'wb') as f:
+            f.write(b'not an image')
+
+    def organize(self, use_content_hash):
+        target = tempfile.mkdtemp(dir=self.tmp.name)
+        process_images(self.source, target, use_content_hash, workers=1)
+        return sorted(os.listdir(target))
+
+    def test_modes_agree(self):
+        for use_content_hash in (True, False):
+            with self.subTest(use_content_hash=use_content_hash):
+                self.assertEqual(self.organize(use_content_hash), ['trunc.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_organizer import calculate_image_hash
+from test_image_deduplicator import encode, make_photo
+
+
+class ContentHashRoundTripTest(unittest.TestCase):
+    """同一图片的JPEG与其无损重新编码的PNG应得到相同的感知哈希"""
+
+    SIZES = ((640, 480), (1600, 1200), (1200, 1600), (2400, 1800), (3000, 2000), (2048, 2048))
+
+    def content_hash(self, name, data):
+        # 文件哈希已知时只计算内容哈希
+        _, content_hash = calculate_image_hash(name, file_hash='known', img=Image.open(io.BytesIO(data)))
+        return content_hash
+
+    def test_jpeg_png_round_trip(self):
+        for seed, size in enumerate(self.SIZES):
+            with self.subTest(size=size, seed=seed):
+                jpeg = encode(make_photo(size, seed), 'JPEG', quality=85)
+                png = encode(Image.open(io.BytesIO(jpeg)), 'PNG')
+                jpeg_hash = self.content_hash('photo.jpg', jpeg)
+                self.assertIsNotNone(jpeg_hash)
+                self.assertEqual(jpeg_hash, self.content_hash('photo.png', png))
+
+
+if __name__ == '__main__':
+    unittest.main()
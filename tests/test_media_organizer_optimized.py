@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_organizer_optimized import MediaOrganizer
+from test_image_deduplicator import encode, make_photo
+
+
+def jpeg_bytes(size=(200, 150)):
+    gradient = Image.linear_gradient('L').resize(size)
+    buffer = io.BytesIO()
+    Image.merge('RGB', (gradient, Image.new('L', size, 120), gradient.rotate(90))).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class TruncatedImageTest(unittest.TestCase):
+    """文件头有效但无法完整解码的图片在精确模式和快速模式下都应复制到目标目录"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source = os.path.join(self.tmp.name, 'src')
+        self.target = os.path.join(self.tmp.name, 'tgt')
+        os.makedirs(self.source)
+        data = jpeg_bytes()
+        with open(os.path.join(self.source, 'trunc.jpg'), 'wb') as f:
+            f.write(data[:len(data) // 2])
+        with open(os.path.join(self.source, 'broken.jpg'), 'wb') as f:
+            f.write(b'not an image')
+
+    def organize(self, use_content_hash):
+        organizer = MediaOrganizer(os.path.join(self.tmp.name, 'test.db'), workers=1)
+        try:
+            organizer.process_media_files(self.source, self.target, use_content_hash)
+        finally:
+            organizer.close_database()
+        return sorted(os.listdir(self.target))
+
+    def test_precise_mode_keeps_truncated_image(self):
+        self.assertIn('trunc.jpg', self.organize(use_content_hash=True))
+
+    def test_fast_mode_keeps_truncated_image(self):
+        self.assertIn('trunc.jpg', self.organize(use_content_hash=False))
+
+    def test_unidentified_image_skipped(self):
+        for use_content_hash in (True, False):
+            with self.subTest(use_content_hash=use_content_hash):
+                self.assertNotIn('broken.jpg', self.organize(use_content_hash))
+
+
+class ContentHashRoundTripTest(unittest.TestCase):
+    """同一图片的JPEG与其无损重新编码的PNG应得到相同的平均哈希"""
+
+    # 8x8平均哈希对细微差异不如感知哈希敏感，小尺寸多取几组图片
+    CASES = tuple(((640, 480), seed) for seed in range(16)) + (
+        ((1600, 1200), 16), ((2400, 1800), 17), ((3000, 2000), 18), ((2048, 2048), 19))
+
+    def content_hash(self, data):
+        pixels = MediaOrganizer.load_thumbnail(io.BytesIO(data))
+        self.assertIsNotNone(pixels)
+        return MediaOrganizer.average_hashes([pixels])[0]
+
+    def test_jpeg_png_round_trip(self):
+        for size, seed in self.CASES:
+            with self.subTest(size=size, seed=seed):
+                jpeg = encode(make_photo(size, seed), 'JPEG', quality=85)
+                png = encode(Image.open(io.BytesIO(jpeg)), 'PNG')
+                self.assertEqual(self.content_hash(jpeg), self.content_hash(png))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import media_organizer_ultra
+from media_organizer_ultra import MediaOrganizer, PREFIX_HASH_SIZE
+from test_image_deduplicator import encode, make_photo
+
+
+class HashFilesTest(unittest.TestCase):
+    """hash_files 的预筛选：大小相同但开头不同的文件不读取完整内容"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source = os.path.join(self.tmp.name, 'src')
+        os.makedirs(self.source)
+        self.organizer = MediaOrganizer(os.path.join(self.tmp.name, 'test.db'), workers=2)
+        self.addCleanup(self.organizer.close_database)
+
+    def write_file(self, name, data):
+        with open(os.path.join(self.source, name), 'wb') as f:
+            f.write(data)
+
+    def full_hash_paths(self):
+        """执行扫描和哈希，返回计算了完整文件哈希的文件名"""
+        hashed = []
+        calculate_file_hash = self.organizer.calculate_file_hash
+
+        def recording_hash(file_path, *args, **kwargs):
+            hashed.append(os.path.basename(file_path))
+            return calculate_file_hash(file_path, *args, **kwargs)
+
+        self.organizer.calculate_file_hash = recording_hash
+        self.organizer.scan_directory(self.source, is_target=False)
+        self.organizer.hash_files(use_content_hash=False)
+        return sorted(hashed)
+
+    def test_same_size_different_head_not_fully_hashed(self):
+        tail = b'x' * PREFIX_HASH_SIZE
+        self.write_file('a.mp4', b'A' * PREFIX_HASH_SIZE + tail)
+        self.write_file('b.mp4', b'B' * PREFIX_HASH_SIZE + tail)
+        self.write_file('c.zip', b'C' * PREFIX_HASH_SIZE + tail)
+        self.write_file('d.zip', b'D' * PREFIX_HASH_SIZE + tail)
+
+        self.assertEqual(self.full_hash_paths(), [])
+
+        cursor = self.organizer.conn.cursor()
+        cursor.execute('SELECT file_hash FROM files')
+        self.assertTrue(all(row[0].startswith('PF:') for row in cursor.fetchall()))
+
+    def test_same_head_fully_hashed(self):
+        head = b'H' * PREFIX_HASH_SIZE
+        self.write_file('a.mp4', head + b'1' * PREFIX_HASH_SIZE)
+        self.write_file('b.mp4', head + b'2' * PREFIX_HASH_SIZE)
+        # 不同类型的文件即使开头相同也不会互相比较
+        self.write_file('c.zip', head + b'3' * PREFIX_HASH_SIZE)
+
+        self.assertEqual(self.full_hash_paths(), ['a.mp4', 'b.mp4'])
+
+    def test_insert_error_does_not_deadlock(self):
+        for i in range(20):
+            self.write_file(f'{i}.mp4', bytes([i]))
+        errors = []
+
+        def scan():
+            try:
+                self.organizer.scan_directory(self.source)
+            except Exception as e:
+                errors.append(e)
+
+        # 每批一个文件，遍历线程很快填满队列并阻塞在put上
+        with mock.patch('media_organizer_ultra.DB_BATCH_SIZE', 1), \
+                mock.patch.object(self.organizer, 'insert_files', side_effect=sqlite3.OperationalError('disk I/O error')):
+            scanner = threading.Thread(target=scan, daemon=True)
+            scanner.start()
+            scanner.join(10)
+        self.assertFalse(scanner.is_alive(), '写入出错后扫描未能退出')
+        self.assertEqual([type(e) for e in errors], [sqlite3.OperationalError])
+
+
+class ContentHashTest(unittest.TestCase):
+    """内容哈希与图片格式以及是否安装NumPy/Numba无关"""
+
+    SIZES = ((5, 5), (8, 8), (9, 13), (100, 77), (640, 480), (1600, 1200))
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.organizer = MediaOrganizer(os.path.join(self.tmp.name, 'test.db'))
+        self.addCleanup(self.organizer.close_database)
+
+    def content_hash(self, data):
+        return self.organizer.calculate_content_hash(io.BytesIO(data))
+
+    def test_backends_agree(self):
+        for seed, size in enumerate(self.SIZES):
+            with self.subTest(size=size):
+                png = encode(make_photo(size, seed), 'PNG')
+                expected = self.content_hash(png)
+                self.assertIsNotNone(expected)
+                with mock.patch.object(media_organizer_ultra, '_ahash_pack', None):
+                    self.assertEqual(self.content_hash(png), expected)
+                    with mock.patch.object(media_organizer_ultra, 'np', None):
+                        self.assertEqual(self.content_hash(png), expected)
+
+    def test_jpeg_png_round_trip(self):
+        for seed, size in enumerate(self.SIZES):
+            with self.subTest(size=size):
+                jpeg = encode(make_photo(size, seed), 'JPEG', quality=85)
+                png = encode(Image.open(io.BytesIO(jpeg)), 'PNG')
+                self.assertEqual(self.content_hash(jpeg), self.content_hash(png))
+
+
+class CopyFileTest(unittest.TestCase):
+    """copy_file 在内核复制不完整或复制失败时的处理"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.organizer = MediaOrganizer(os.path.join(self.tmp.name, 'test.db'))
+        self.addCleanup(self.organizer.close_database)
+        self.data = os.urandom(3 * PREFIX_HASH_SIZE)
+        self.src = os.path.join(self.tmp.name, 'a.mp4')
+        self.dst = os.path.join(self.tmp.name, 'b.mp4')
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+
+    @unittest.skipUnless(hasattr(os, 'copy_file_range'), '需要copy_file_range')
+    def test_short_copy_falls_back(self):
+        copy_file_range = os.copy_file_range
+
+        def short_copy(src, dst, count, offset_src, offset_dst):
+            # 模拟只复制了第一块就返回0的文件系统
+            if offset_src >= PREFIX_HASH_SIZE:
+                return 0
+            return copy_file_range(src, dst, min(count, PREFIX_HASH_SIZE), offset_src, offset_dst)
+
+        with mock.patch('os.copy_file_range', short_copy):
+            self.organizer.copy_file(self.src, self.dst)
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_failed_copy_removes_destination(self):
+        with mock.patch('shutil.copystat', side_effect=OSError('copystat failed')):
+            with self.assertRaises(OSError):
+                self.organizer.copy_file(self.src, self.dst)
+        self.assertFalse(os.path.exists(self.dst))
+
+    def test_existing_destination_kept(self):
+        with open(self.dst, 'wb') as f:
+            f.write(b'existing')
+        with self.assertRaises(FileExistsError):
+            self.organizer.copy_file(self.src, self.dst)
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), b'existing')
+
+
+if __name__ == '__main__':
+    unittest.main()